@@ -0,0 +1,274 @@
+"""Admisión de peticiones a /chat: cupo global, una generación por sesión y límites de tasa.
+
+Cada petición pide un turno antes de leer el historial y lo devuelve cuando
+su respuesta queda guardada, así:
+
+- no hay más de `max_activas` respuestas generándose a la vez en el proceso;
+  el resto espera en una cola FIFO de hasta `max_cola` turnos;
+- cada sesión tiene como mucho una respuesta en curso: dos pestañas (o un
+  doble clic) no leen el mismo historial ni se pisan al guardarlo. Con la
+  política 'reemplazar' un mensaje nuevo de la sesión ocupa el lugar del que
+  seguía esperando (ese recibe 409); con 'encolar' espera detrás;
+- un cubo de tokens por sesión y otro por IP frenan a quien envía en ráfaga.
+
+Como una sesión ocupa a lo sumo un cupo y un lugar en la cola, quien
+insiste no desplaza a los demás. Lo que no se puede atender se rechaza al
+instante con 429 y Retry-After; quien agota `espera_maxima` en la cola
+recibe 503.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentacion import registro
+
+espera_cola = registro.histograma(
+    "incalake_chat_queue_seconds",
+    "Espera de las peticiones de /chat en la cola de admisión, por resultado",
+    etiquetas=("outcome",),
+)
+admisiones = registro.contador(
+    "incalake_chat_admission_total",
+    "Decisiones de admisión de /chat",
+    etiquetas=("outcome",),
+)
+
+
+class Rechazada(Exception):
+    """La petición no se admite; `reintentar_en` va en Retry-After."""
+
+    def __init__(self, motivo, reintentar_en=1, estado=429):
+        super().__init__(motivo)
+        self.motivo = motivo
+        self.reintentar_en = max(1, math.ceil(reintentar_en))
+        self.estado = estado
+
+
+# === Límites de tasa ===
+class LimitadorTasa:
+    """Cubos de tokens por clave (sesión o IP): `rafaga` de capacidad y `por_minuto` de recarga.
+
+    Sin lock propio: se usa bajo el del Planificador.
+    """
+
+    def __init__(self, por_minuto, rafaga, max_claves=10000):
+        self.por_segundo = por_minuto / 60
+        self.rafaga = rafaga
+        self.max_claves = max_claves
+        self._cubos = OrderedDict()  # clave -> [tokens, actualizado_en]
+
+    @property
+    def activo(self):
+        return self.por_segundo > 0 and self.rafaga > 0
+
+    def _cubo(self, clave, ahora):
+        cubo = self._cubos.get(clave)
+        if cubo is None:
+            cubo = self._cubos[clave] = [float(self.rafaga), ahora]
+            while len(self._cubos) > self.max_claves:
+                self._cubos.popitem(last=False)
+        else:
+            cubo[0] = min(self.rafaga, cubo[0] + (ahora - cubo[1]) * self.por_segundo)
+            cubo[1] = ahora
+            self._cubos.move_to_end(clave)
+        return cubo
+
+    def espera(self, clave, ahora):
+        """Segundos hasta que `clave` tenga un token (0 si ya lo tiene)."""
+        if not self.activo or clave is None:
+            return 0.0
+        tokens = self._cubo(clave, ahora)[0]
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.por_segundo
+
+    def consumir(self, clave, ahora):
+        if self.activo and clave is not None:
+            self._cubo(clave, ahora)[0] -= 1
+
+
+# === Turnos ===
+class Turno:
+    """Lugar de una petición: esperando en la cola, activa o terminada."""
+
+    ESPERANDO, ACTIVO, RECHAZADO, TERMINADO = 'waiting', 'active', 'rejected', 'done'
+
+    __slots__ = ('sesion', 'llegada', 'admitido_en', 'estado', 'rechazo', '_evento', '_futuro')
+
+    def __init__(self, sesion, llegada):
+        self.sesion = sesion
+        self.llegada = llegada
+        self.admitido_en = None
+        self.estado = self.ESPERANDO
+        self.rechazo = None
+        self._evento = threading.Event()
+        self._futuro = None  # (loop, futuro) de una espera asíncrona
+
+    def _avisar(self):
+        self._evento.set()
+        if self._futuro is not None:
+            loop, futuro = self._futuro
+            loop.call_soon_threadsafe(lambda: futuro.done() or futuro.set_result(None))
+
+
+class Planificador:
+    """Cola de admisión de /chat compartida por los hilos (Flask) o el event loop (ASGI) del proceso."""
+
+    def __init__(self, max_activas=32, max_cola=100, espera_maxima=5.0, politica_sesion='reemplazar',
+                 max_en_cola_sesion=2, limite_sesion=None, limite_ip=None):
+        self.max_activas = max_activas
+        self.max_cola = max_cola
+        self.espera_maxima = espera_maxima
+        self.politica_sesion = politica_sesion
+        self.max_en_cola_sesion = max_en_cola_sesion
+        self.limite_sesion = limite_sesion or LimitadorTasa(0, 0)
+        self.limite_ip = limite_ip or LimitadorTasa(0, 0)
+        self._cola = []
+        self._sesiones_activas = set()
+        self._activas = 0
+        self._lock = threading.Lock()
+        # Duración media de una respuesta, para estimar el Retry-After con la cola llena
+        self._duracion_media = 2.0
+
+    def _rechazar(self, motivo, reintentar_en, estado=429):
+        admisiones.incrementar(motivo)
+        return Rechazada(motivo, reintentar_en, estado)
+
+    def solicitar(self, sesion, ip, ahora=None):
+        """Turno para una petición nueva; lanza Rechazada si no se puede atender ni encolar."""
+        ahora = time.monotonic() if ahora is None else ahora
+        reemplazados = []
+        with self._lock:
+            espera_ip = self.limite_ip.espera(ip, ahora)
+            if espera_ip:
+                raise self._rechazar('ip_rate_limited', espera_ip)
+            espera_sesion = self.limite_sesion.espera(sesion, ahora)
+            if espera_sesion:
+                raise self._rechazar('session_rate_limited', espera_sesion)
+
+            turno = Turno(sesion, ahora)
+            en_cola = [i for i, otro in enumerate(self._cola) if otro.sesion == sesion]
+            if en_cola and self.politica_sesion == 'reemplazar':
+                # El mensaje nuevo toma el lugar del que esperaba: la sesión no pierde su posición
+                reemplazados = [self._cola[i] for i in en_cola]
+                self._cola[en_cola[0]] = turno
+                for i in reversed(en_cola[1:]):
+                    del self._cola[i]
+            elif len(en_cola) >= self.max_en_cola_sesion:
+                raise self._rechazar('session_busy', self._duracion_media)
+            elif len(self._cola) >= self.max_cola:
+                raise self._rechazar('queue_full', self._duracion_media * (len(self._cola) + 1) / self.max_activas)
+            else:
+                self._cola.append(turno)
+            self.limite_ip.consumir(ip, ahora)
+            self.limite_sesion.consumir(sesion, ahora)
+            for otro in reemplazados:
+                otro.estado = Turno.RECHAZADO
+                otro.rechazo = self._rechazar('superseded', 1, estado=409)
+                espera_cola.observar(ahora - otro.llegada, 'superseded')
+            self._despachar(ahora)
+        for otro in reemplazados:
+            otro._avisar()
+        return turno
+
+    def _despachar(self, ahora):
+        """Activa, en orden de llegada, los turnos cuya sesión está libre mientras haya cupo. Bajo el lock."""
+        activados = []
+        for turno in self._cola:
+            if self._activas >= self.max_activas:
+                break
+            if turno.sesion in self._sesiones_activas:
+                continue
+            turno.estado = Turno.ACTIVO
+            turno.admitido_en = ahora
+            self._activas += 1
+            self._sesiones_activas.add(turno.sesion)
+            activados.append(turno)
+        if activados:
+            self._cola = [turno for turno in self._cola if turno.estado == Turno.ESPERANDO]
+            for turno in activados:
+                espera_cola.observar(ahora - turno.llegada, 'admitted')
+                admisiones.incrementar('admitted' if ahora == turno.llegada else 'admitted_after_wait')
+                turno._avisar()
+
+    def _vencer(self, turno):
+        """Saca de la cola un turno que agotó la espera; None si justo lo activaron o lo reemplazaron."""
+        with self._lock:
+            if turno.estado != Turno.ESPERANDO:
+                return None
+            self._cola.remove(turno)
+            turno.estado = Turno.RECHAZADO
+            ahora = time.monotonic()
+            espera_cola.observar(ahora - turno.llegada, 'timeout')
+            return self._rechazar('queue_timeout', self._duracion_media, estado=503)
+
+    def esperar(self, turno):
+        """Bloquea hasta que el turno se active; lanza Rechazada si vence la espera o lo reemplazan."""
+        if turno.estado == Turno.ESPERANDO:
+            turno._evento.wait(max(0.0, turno.llegada + self.espera_maxima - time.monotonic()))
+        return self._resultado(turno)
+
+    async def esperar_async(self, turno):
+        """Como `esperar` sin bloquear el event loop."""
+        if turno.estado == Turno.ESPERANDO:
+            loop = asyncio.get_running_loop()
+            futuro = loop.create_future()
+            turno._futuro = (loop, futuro)
+            if turno.estado == Turno.ESPERANDO:
+                try:
+                    await asyncio.wait_for(futuro, max(0.0, turno.llegada + self.espera_maxima - time.monotonic()))
+                except asyncio.TimeoutError:
+                    pass
+                except asyncio.CancelledError:
+                    self.liberar(turno)
+                    raise
+        return self._resultado(turno)
+
+    def _resultado(self, turno):
+        if turno.estado == Turno.ACTIVO:
+            return turno
+        if turno.estado == Turno.ESPERANDO:
+            rechazo = self._vencer(turno)
+            if rechazo is None:
+                return self._resultado(turno)
+            raise rechazo
+        raise turno.rechazo
+
+    def admitir(self, sesion, ip):
+        """solicitar + esperar, para los hilos de Flask."""
+        return self.esperar(self.solicitar(sesion, ip))
+
+    def liberar(self, turno):
+        """Devuelve el cupo del turno (o lo saca de la cola). Se puede llamar más de una vez."""
+        with self._lock:
+            ahora = time.monotonic()
+            if turno.estado == Turno.ACTIVO:
+                self._activas -= 1
+                self._sesiones_activas.discard(turno.sesion)
+                self._duracion_media += 0.1 * ((ahora - turno.admitido_en) - self._duracion_media)
+                turno.estado = Turno.TERMINADO
+                self._despachar(ahora)
+            elif turno.estado == Turno.ESPERANDO:
+                self._cola.remove(turno)
+                turno.estado = Turno.TERMINADO
+                espera_cola.observar(ahora - turno.llegada, 'abandoned')
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "active": self._activas,
+                "max_active": self.max_activas,
+                "queued": len(self._cola),
+                "max_queue": self.max_cola,
+                "session_policy": self.politica_sesion,
+                "avg_generation_seconds": round(self._duracion_media, 3),
+            }
+
+
+def ip_cliente(cabeceras, remota, confiar_proxy=False):
+    """IP del visitante; detrás de un proxy de confianza, la primera de X-Forwarded-For."""
+    if confiar_proxy:
+        reenviada = (cabeceras.get('X-Forwarded-For') or "").split(",")[0].strip()
+        if reenviada:
+            return reenviada
+    return remota
@@ -1,218 +1,192 @@
-import os
-import json
 import time
-import google.generativeai as genai
-from flask import Flask, request, Response, jsonify
+_inicio_import = time.perf_counter()  # incluye el costo de los imports de abajo
+
+import os
+import threading
+from flask import Blueprint, Flask, request, Response, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from admision import LimitadorTasa, Planificador, Rechazada, ip_cliente
+from cache_respuestas import CacheRespuestas, normalizar_pregunta
+from catalogo import compilar_catalogo
+from catalogo_binario import CatalogoBinario
+from cliente_gemini import Circuito, ClienteGemini
+from destinos import FacetasDestinos
+from fake_gemini import FakeGeminiModel, traducir_terminos_fake
+from filtros_tours import FiltrosConsulta, IndiceFiltros, extraer_filtros, filtros_de_conversacion
+from generaciones import GeneracionesEnCurso
+from gestor_catalogo import GestorCatalogo, SnapshotCatalogo
+from idiomas import IDIOMA_BASE, RegistroIdiomas, cargar_idiomas_extra, ruta_catalogo_nativo, tokenizador_de
+from indice_tours import IndiceTours, crear_motor
+from instrumentacion import (
+    configurar_logging, iniciar_muestreo, medir_etapa, memoria_proceso, observar_etapa, peticiones_chat, registro,
+)
+from intenciones import INTENCION_POR_DEFECTO, INTENCIONES_BASE, MotorIntenciones, cargar_intenciones_extra
+from presupuesto_prompt import EnsambladorPrompt, estimar_tokens
+from semantica import IndiceSemantico, MotorHibrido, disponible as semantica_disponible
+from sesiones import ConserjeSesiones, FileSessionStore, SQLiteSessionStore
+from sse import (
+    CABECERAS_SSE, Agrupador, Compresor, RegistroTransmisiones, RespuestaInterrumpida, elegir_codificacion, emitir_sse,
+    reenviar,
+)
+from traduccion import CacheTraducciones, TraductorKeywords, construir_lexico
 
 # --- Cargar variables de entorno ---
 load_dotenv()
 
-app = Flask(__name__)
-# Permitir CORS para todas las rutas
-CORS(app, resources={r"/*": {"origins": "*"}}) 
+# Logging nivelado (LOG_LEVEL, OFF lo apaga) y muestreado por petición (LOG_SAMPLE_RATE)
+log = configurar_logging()
+
+# Importar este módulo no toca disco ni red: el catálogo se construye en precargar(),
+# el estado por proceso en create_app() y genai se importa con el primer modelo.
+# Duración de cada fase del arranque, expuesta en /health y /metrics.
+arranque = {}
 
 # --- Configuración de Gemini ---
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY no está configurada.")
-
-genai.configure(api_key=GEMINI_API_KEY)
-
-gemini_model = genai.GenerativeModel(
-    model_name="gemini-2.5-flash",
-    generation_config={
-        "temperature": 0.6,
-        "top_p": 0.95,      
-        "top_k": 64,        
-        "max_output_tokens": 8192, 
-    },
-    safety_settings=[
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    ]
-)
+# FAKE_GEMINI=1 reemplaza Gemini por un stub local (benchmarks y pruebas de carga)
+FAKE_GEMINI = os.getenv("FAKE_GEMINI") == "1"
+
+_genai = None
+_lock_genai = threading.Lock()
+
+def cargar_genai():
+    """Importa y configura google.generativeai la primera vez que se crea un modelo."""
+    global _genai
+    with _lock_genai:
+        if _genai is None:
+            if not GEMINI_API_KEY:
+                raise ValueError("GEMINI_API_KEY no está configurada.")
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            _genai = genai
+    return _genai
+
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+GEMINI_GENERATION_CONFIG = {
+    "temperature": 0.6,
+    "top_p": 0.95,      
+    "top_k": 64,        
+    "max_output_tokens": 8192, 
+}
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+if FAKE_GEMINI:
+    log.info("🧪 FAKE_GEMINI activo: usando el stub local de Gemini")
 
 # === Gestión de Sesiones basada en Archivos ===
 # Obtenemos la ruta absoluta del directorio donde se encuentra app.py
 basedir = os.path.abspath(os.path.dirname(__file__))
 # Creamos la ruta completa y segura para la carpeta de sesiones
-SESSIONS_DIR = os.path.join(basedir, "chat_sessions")
+SESSIONS_DIR = os.getenv("SESSIONS_DIR", os.path.join(basedir, "chat_sessions"))
+SESSIONS_ARCHIVE_DIR = os.getenv("SESSIONS_ARCHIVE_DIR", os.path.join(basedir, "chat_sessions_archive"))
+# Igual que MAX_SESSION_TIME_MS del widget (static/index.html): 48 horas
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(48 * 60 * 60)))
 
-# Verificar que la carpeta de sesiones existe y tiene permisos
-if not os.path.exists(SESSIONS_DIR):
-    try:
-        os.makedirs(SESSIONS_DIR)
-        print(f"✅ Directorio de sesiones creado en: {SESSIONS_DIR}")
-        # Dar permisos (Linux/Mac)
-        print(f"Sistema operativo: {os.name}")
-        if os.name != 'nt':  # Linux/Mac
-            os.chmod(SESSIONS_DIR, 0o755)  # Cambiar a 755 en lugar de 777
-        print("Permisos establecidos correctamente")
-    except Exception as e:
-        print(f"❌ Error crítico al crear directorio de sesiones: {e}")
-        raise
+# Backend de sesiones: 'file' (un JSON por sesión) o 'sqlite' (recomendado con varios workers)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "file")
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+# Se crean en create_app(), dentro de cada worker (hilos y conexiones no sobreviven a un fork)
+session_store = None
+conserje_sesiones = None
 
-# Verificar permisos de escritura
-try:
-    test_file = os.path.join(SESSIONS_DIR, 'test_permissions.txt')
-    with open(test_file, 'w') as f:
-        f.write('test')
-    os.remove(test_file)
-    print("✅ Permisos de escritura verificados correctamente")
-except Exception as e:
-    print(f"❌ Error de permisos en {SESSIONS_DIR}: {e}")
-    raise
+def crear_almacen_sesiones():
+    """Almacén de sesiones según SESSION_BACKEND; crea el directorio si no existe."""
+    if SESSION_BACKEND == 'sqlite':
+        return SQLiteSessionStore(
+            os.getenv("SESSION_DB_PATH", os.path.join(basedir, "chat_sessions.db")),
+            max_cache=SESSION_CACHE_SIZE,
+            ttl_segundos=SESSION_TTL_SECONDS,
+        )
+    return FileSessionStore(
+        SESSIONS_DIR,
+        max_cache=SESSION_CACHE_SIZE,
+        intervalo_escritura=float(os.getenv("SESSION_WRITE_BEHIND_SECONDS", "0")),
+        ttl_segundos=SESSION_TTL_SECONDS,
+        directorio_archivo=SESSIONS_ARCHIVE_DIR,
+    )
 
 def load_session_history(session_id):
-    """Carga el historial de un archivo JSON."""
-    # Sanitizar el session_id para evitar problemas de path traversal
-    safe_session_id = re.sub(r'[^a-zA-Z0-9_-]', '', session_id)
-    filepath = os.path.join(SESSIONS_DIR, f"{safe_session_id}.json")
-    
-    print(f"🔍 Intentando cargar sesión desde: {filepath}")
-    
-    if os.path.exists(filepath):
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                print(f"✅ Sesión cargada exitosamente: {len(data)} mensajes")
-                return data
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"⚠️ Error al leer archivo de sesión {session_id}: {e}")
-            return []
-    else:
-        print(f"ℹ️ Archivo de sesión no encontrado: {filepath}")
-        return []
+    """Carga el historial de la sesión desde el almacén (caché LRU o disco)."""
+    historial = session_store.cargar(session_id)
+    log.debug("🔍 Sesión %s: %d mensajes", session_id, len(historial))
+    return historial
 
 def save_session_history(session_id, history):
-    """Guarda el historial en un archivo JSON."""
-    # Sanitizar el session_id para evitar problemas de path traversal
-    safe_session_id = re.sub(r'[^a-zA-Z0-9_-]', '', session_id)
-    filepath = os.path.join(SESSIONS_DIR, f"{safe_session_id}.json")
-    
-    print(f"💾 Intentando guardar sesión en: {filepath}")
-    print(f"📝 Contenido a guardar: {json.dumps(history, indent=2)}")
-    
-        # AGREGAR ESTA VERIFICACIÓN:
+    """Guarda el historial completo de la sesión en el almacén."""
     try:
-        # Crear directorio si no existe
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-        print(f"✅ Sesión guardada exitosamente: {filepath}")
+        session_store.guardar(session_id, history)
+        log.debug("✅ Sesión guardada exitosamente: %s", session_id)
         return True
-    except IOError as e:
-        print(f"❌ Error grave al guardar sesión {session_id}: {e}")
-        print(f"Ruta absoluta intentada: {os.path.abspath(filepath)}")
-        print(f"Directorio padre existe: {os.path.exists(os.path.dirname(filepath))}")
-        print(f"Permisos de escritura: {os.access(os.path.dirname(filepath), os.W_OK)}")
+    except (IOError, sqlite3.Error) as e:
+        log.error(f"❌ Error grave al guardar sesión {session_id}: {e}")
         return False
 
-# === Función para Cargar Tours ===
-def cargar_tours():
-    """Carga la información de los tours desde el archivo JSON en inglés."""
-    try:
-        with open('tours_ingles.json', 'r', encoding='utf-8') as f:
-            tours_data = json.load(f)
-        print(f"✅ {len(tours_data)} tours cargados desde tours_ingles.json.")
-        return tours_data
-    except FileNotFoundError:
-        print("❌ Error: tours_ingles.json no encontrado.")
-        return [] 
-    except json.JSONDecodeError:
-        print("❌ Error al decodificar tours_ingles.json.")
-        return [] 
-
-tours_data_loaded = cargar_tours()
 MAX_HISTORY_TURNS = 5
 
+# Caché de respuestas de primer turno (saludos, consultas generales, "tours en Puno?"...)
+response_cache = CacheRespuestas(
+    max_entradas=int(os.getenv("RESPONSE_CACHE_SIZE", "500")),
+    ttl_segundos=int(os.getenv("RESPONSE_CACHE_TTL", str(6 * 3600))),
+)
+
+# === Admisión de /chat (admision.py) ===
+# Cupo global de respuestas en curso, una por sesión (CHAT_SESSION_POLICY: reemplazar | encolar)
+# y cubos de tokens por sesión e IP (tasa 0 los desactiva). Detrás de un proxy de confianza
+# (TRUST_PROXY_HEADERS=1) la IP se toma de X-Forwarded-For.
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS") == "1"
+planificador_chat = Planificador(
+    max_activas=int(os.getenv("CHAT_MAX_ACTIVE", os.getenv("GEMINI_MAX_CONCURRENT", "32"))),
+    max_cola=int(os.getenv("CHAT_MAX_QUEUE", "100")),
+    espera_maxima=float(os.getenv("CHAT_QUEUE_TIMEOUT", "5")),
+    politica_sesion=os.getenv("CHAT_SESSION_POLICY", "reemplazar"),
+    limite_sesion=LimitadorTasa(float(os.getenv("CHAT_SESSION_RATE_PER_MIN", "20")),
+                                int(os.getenv("CHAT_SESSION_BURST", "5"))),
+    limite_ip=LimitadorTasa(float(os.getenv("CHAT_IP_RATE_PER_MIN", "120")), int(os.getenv("CHAT_IP_BURST", "30"))),
+)
+MENSAJES_RECHAZO = {
+    'superseded': "Se respondió un mensaje más reciente de esta conversación.",
+    'queue_timeout': "Servidor ocupado, intenta nuevamente en unos segundos.",
+    'queue_full': "Servidor ocupado, intenta nuevamente en unos segundos.",
+}
+
+def clave_admision(data, ip):
+    """Sesión que ocupa el turno; sin session_id, la IP (no todos los anónimos comparten una sesión)."""
+    return (data or {}).get('session_id') or f"ip:{ip}"
+
+def cuerpo_rechazo(rechazo):
+    """(JSON, estado, cabeceras) para una petición que la admisión no dejó pasar."""
+    peticiones_chat.incrementar('rejected')
+    mensaje = MENSAJES_RECHAZO.get(rechazo.motivo, "Estás enviando mensajes muy rápido, espera unos segundos.")
+    return {"error": mensaje, "reason": rechazo.motivo}, rechazo.estado, {"Retry-After": str(rechazo.reintentar_en)}
+
+# Peticiones simultáneas con el mismo prompt comparten un stream de Gemini (GEMINI_SINGLE_FLIGHT=0 lo desactiva)
+generaciones_en_curso = GeneracionesEnCurso(activo=os.getenv("GEMINI_SINGLE_FLIGHT", "1") == "1")
+
 # === Nuevas funciones para detección de intención ===
+# Patrones precompilados por idioma; intenciones extra (reservas, precios,
+# derivación a humano) en intenciones.json, editable sin tocar el código.
+INTENTS_PATH = os.getenv("INTENTS_PATH", os.path.join(os.path.abspath(os.path.dirname(__file__)), 'intenciones.json'))
+motor_intenciones = MotorIntenciones(INTENCIONES_BASE + cargar_intenciones_extra(INTENTS_PATH))
+
 def detectar_intencion_consulta(pregunta, language='es'):
     """Detecta intención priorizando Puno/Titicaca como especialidad."""
-    pregunta_lower = pregunta.lower()
-    
-    # Detectar mención de Puno/Titicaca (alta prioridad)
-    puno_keywords = ['puno', 'titicaca', 'uros', 'taquile', 'amantani', 'floating islands', 'islas flotantes']
-    menciona_puno = any(keyword in pregunta_lower for keyword in puno_keywords)
-    
-    # Patrones para preguntas muy generales
-    patrones_generales = {
-        'es': [
-            r'\b(info|información)\s+(sobre\s+)?tours?\b',
-            r'\btours?\s+(disponibles?|que\s+tienen?)\b',
-            r'\bqué\s+tours?\s+(hay|tienen|ofrecen)\b',
-            r'\bque\s+actividades?\s+(hay|tienen|ofrecen)\b',
-            r'\bque\s+hacer\s+en\s+(perú|peru)\b',
-            r'\bturismo\s+en\s+(perú|peru)\b',
-            r'^(hola|hello|buenos?\s+días?|buenas?\s+tardes?)',
-            r'\bpaquetes?\s+turísticos?\b',
-            r'\brecomendaciones?\b'
-        ],
-        'en': [
-            r'\binfo\s+(about\s+)?tours?\b',
-            r'\btours?\s+(available|you\s+have)\b',
-            r'\bwhat\s+tours?\s+(do\s+you\s+have|are\s+available)\b',
-            r'\bwhat\s+activities?\s+(do\s+you\s+have|are\s+available)\b',
-            r'\bwhat\s+to\s+do\s+in\s+peru\b',
-            r'\btourism\s+in\s+peru\b',
-            r'^(hi|hello|good\s+morning|good\s+afternoon)',
-            r'\btravel\s+packages?\b',
-            r'\brecommendations?\b'
-        ]
-    }
-    
-    if menciona_puno:
-        return 'specific_puno'
-    
-    for patron in patrones_generales.get(language, patrones_generales['es']):
-        if re.search(patron, pregunta_lower):
-            return 'general'
-    
-    return 'specific'
-
-def obtener_destinos_disponibles():
-    """Extrae los destinos únicos de los tours disponibles."""
-    destinos = set()
-    for tour in tours_data_loaded:
-        titulo = tour.get("titulo_producto", "").lower()
-        tipo = tour.get("tipo_servicio", "").lower()
-        
-        if any(word in titulo + " " + tipo for word in ['puno', 'titicaca', 'uros', 'taquile', 'amantani']):
-            destinos.add('Puno')
-        if any(word in titulo + " " + tipo for word in ['cusco', 'machu picchu', 'sacred valley']):
-            destinos.add('Cusco')
-        if any(word in titulo + " " + tipo for word in ['arequipa', 'colca', 'canyon']):
-            destinos.add('Arequipa')
-        if any(word in titulo + " " + tipo for word in ['uyuni', 'salar', 'bolivia']):
-            destinos.add('Uyuni')
-    
-    return sorted(list(destinos))
+    return motor_intenciones.detectar(pregunta, language)
+
+def obtener_destinos_disponibles(catalogo=None):
+    """Destinos con tours disponibles, precalculados al cargar el catálogo."""
+    return (catalogo or gestor_catalogo.actual).facetas.destinos
 
-def contar_tours_por_destino(destino):
+def contar_tours_por_destino(destino, catalogo=None):
     """Cuenta cuántos tours hay para un destino específico."""
-    count = 0
-    destino_lower = destino.lower()
-    
-    for tour in tours_data_loaded:
-        titulo = tour.get("titulo_producto", "").lower()
-        tipo = tour.get("tipo_servicio", "").lower()
-        
-        if destino_lower == 'puno' and any(word in titulo + " " + tipo for word in ['puno', 'titicaca', 'uros', 'taquile', 'amantani']):
-            count += 1
-        elif destino_lower == 'cusco' and any(word in titulo + " " + tipo for word in ['cusco', 'machu picchu', 'sacred valley']):
-            count += 1
-        elif destino_lower == 'arequipa' and any(word in titulo + " " + tipo for word in ['arequipa', 'colca', 'canyon']):
-            count += 1
-        elif destino_lower == 'uyuni' and any(word in titulo + " " + tipo for word in ['uyuni', 'salar', 'bolivia']):
-            count += 1
-    
-    return count
+    return (catalogo or gestor_catalogo.actual).facetas.conteo(destino)
 
 # === Configuraciones por idioma actualizadas ===
 LANGUAGE_CONFIGS = {
@@ -324,6 +298,146 @@ LANGUAGE_CONFIGS = {
     }
 }
 
+# Mercados adicionales (pt, fr, de...) declarados en idiomas.json con sus textos y stopwords
+LANGUAGES_PATH = os.getenv("LANGUAGES_PATH", os.path.join(basedir, 'idiomas.json'))
+LANGUAGE_CONFIGS.update(cargar_idiomas_extra(LANGUAGES_PATH))
+
+# === Modelos de Gemini por idioma ===
+# La instrucción de sistema va en el slot `system_instruction` de un modelo por
+# idioma, creado una vez y reutilizado, en lugar de reenviarse como turno de usuario.
+def crear_modelo_gemini(language):
+    return cargar_genai().GenerativeModel(
+        model_name=GEMINI_MODEL_NAME,
+        generation_config=GEMINI_GENERATION_CONFIG,
+        safety_settings=GEMINI_SAFETY_SETTINGS,
+        system_instruction=LANGUAGE_CONFIGS[language]['system_instruction'],
+    )
+
+if FAKE_GEMINI:
+    _modelo_fake = FakeGeminiModel.desde_entorno()
+    fabrica_modelo_gemini = lambda language: _modelo_fake
+else:
+    fabrica_modelo_gemini = crear_modelo_gemini
+
+# Un solo circuito para chat y traducción: si Gemini cae, ambos dejan de llamarlo a la vez
+circuito_gemini = Circuito(
+    tasa_fallos=float(os.getenv("GEMINI_BREAKER_FAILURE_RATE", "0.5")),
+    ventana=int(os.getenv("GEMINI_BREAKER_WINDOW", "50")),
+    espera_segundos=float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30")),
+)
+# Plazos, reintentos con jitter y hedging opcional (GEMINI_HEDGE_MS=0 lo desactiva).
+# Los modelos (y el transporte de genai) se crean con la primera petición de cada idioma.
+cliente_gemini = ClienteGemini(
+    fabrica_modelo_gemini,
+    circuito_gemini,
+    nombre='chat',
+    max_concurrentes=int(os.getenv("GEMINI_MAX_CONCURRENT", "32")),
+    espera_cupo=float(os.getenv("GEMINI_QUEUE_TIMEOUT", "5")),
+    plazo_primer_chunk=float(os.getenv("GEMINI_FIRST_CHUNK_TIMEOUT", "20")),
+    plazo_total=float(os.getenv("GEMINI_DEADLINE", "120")),
+    reintentos=int(os.getenv("GEMINI_RETRIES", "2")),
+    espera_base=float(os.getenv("GEMINI_RETRY_BASE_MS", "200")) / 1000,
+    espera_max=float(os.getenv("GEMINI_RETRY_MAX_MS", "2000")) / 1000,
+    cobertura_segundos=float(os.getenv("GEMINI_HEDGE_MS", "0")) / 1000,
+)
+
+# Presupuesto de tokens por petición (historial + consulta; la instrucción de sistema va aparte)
+ensamblador_prompt = EnsambladorPrompt(
+    presupuesto_tokens=int(os.getenv("PROMPT_TOKEN_BUDGET", "3000")),
+    max_tokens_resumen=int(os.getenv("PROMPT_SUMMARY_TOKENS", "400")),
+)
+TOKENS_INSTRUCCION = {
+    language: estimar_tokens(config['system_instruction']) for language, config in LANGUAGE_CONFIGS.items()
+}
+
+# === Catálogo compilado e índices ===
+# Motor de ranking: 'bm25' o 'heuristico'. Los términos de re-ranking de BM25 son configurables.
+RANKING_ENGINE = os.getenv("RANKING_ENGINE", "bm25")
+RANKING_CONFIG = {}
+if RANKING_ENGINE == 'bm25':
+    RANKING_CONFIG = {
+        "bonus_puno": float(os.getenv("RANKING_BONUS_PUNO", "2.0")),
+        "peso_prioridad": float(os.getenv("RANKING_PESO_PRIORIDAD", "1.0")),
+    }
+# Búsqueda semántica (semantica.py): similitud de n-gramas de caracteres fusionada con el ranking léxico.
+# Necesita numpy; el índice se precalcula con `python semantica.py <catálogo>` o se calcula al cargar.
+SEMANTIC_SEARCH = os.getenv("SEMANTIC_SEARCH") == "1"
+SEMANTIC_CONFIG = {
+    "peso": float(os.getenv("SEMANTIC_WEIGHT", "0.4")),
+    "umbral": float(os.getenv("SEMANTIC_MIN_SIMILARITY", "0.05")),
+}
+SEMANTIC_DIMENSION = int(os.getenv("SEMANTIC_DIMENSION", "4096"))
+if SEMANTIC_SEARCH and not semantica_disponible():
+    log.warning("⚠️ SEMANTIC_SEARCH=1 pero numpy no está instalado: se usa solo el ranking léxico")
+    SEMANTIC_SEARCH = False
+DESTINATIONS_MAX_AGE = int(os.getenv("DESTINATIONS_MAX_AGE", "300"))
+
+# Idiomas cuyo contexto se renderiza al compilar el catálogo base (en el master, compartido entre workers)
+IDIOMAS_PRERENDERIZADOS = ('es', 'en')
+
+# JSON de tours o su versión binaria compilada (python catalogo_binario.py compilar ...)
+TOURS_PATH = os.getenv("TOURS_PATH", os.path.join(basedir, 'tours_ingles.json'))
+
+def crear_motor_catalogo(tours, indice, version, ruta=None):
+    """Motor de ranking del catálogo: el léxico configurado, fusionado con el semántico si está activo."""
+    motor = crear_motor(RANKING_ENGINE, indice, **RANKING_CONFIG)
+    if not SEMANTIC_SEARCH:
+        return motor
+    semantico = IndiceSemantico.para_catalogo(tours, version, ruta, SEMANTIC_DIMENSION)
+    return MotorHibrido(motor, semantico, **SEMANTIC_CONFIG)
+
+def construir_catalogo(tours_json, version, idioma=IDIOMA_BASE, ruta=None):
+    """Compila una versión del catálogo con todos sus índices derivados.
+
+    El catálogo base (inglés) sirve a todos los idiomas sin catálogo propio;
+    uno nativo (idiomas.py) solo renderiza su idioma y no necesita léxico.
+    `ruta` es la del archivo del catálogo: junto a él se guardan sus vectores.
+    """
+    if isinstance(tours_json, CatalogoBinario):
+        # Tours y postings ya compilados: se leen del archivo mapeado al usarlos
+        tours = tours_json.tours
+        indice = IndiceTours(tours, tours_json.postings_titulo, tours_json.postings_cuerpo, tours_json.longitudes,
+                             tours_json.tokenizador)
+        identidades = tours_json.identidades
+    else:
+        # Cada tour se compila una sola vez en un TourRecord inmutable; los contextos de los
+        # mercados adicionales del catálogo base se renderizan con su primer uso
+        tours = compilar_catalogo(tours_json, IDIOMAS_PRERENDERIZADOS if idioma == IDIOMA_BASE else (idioma,))
+        # Índice invertido y facetas por destino (conteos, rangos de precio, prioridad)
+        indice = IndiceTours(tours, tokenizador=tokenizador_de(idioma, LANGUAGE_CONFIGS.get(idioma, {})))
+        identidades = None
+    return SnapshotCatalogo(
+        version=version,
+        idioma=idioma,
+        tours=tours,
+        indice=indice,
+        motor=crear_motor_catalogo(tours, indice, version, ruta),
+        facetas=FacetasDestinos(tours, version_catalogo=version),
+        # Léxico ES->EN para traducir keywords al catálogo base
+        lexico=construir_lexico(indice.postings_cuerpo.keys(), identidades=identidades) if idioma == IDIOMA_BASE else {},
+        # Columnas de precio por tamaño de grupo y duración para los filtros de la consulta
+        filtros=IndiceFiltros(tours),
+    )
+
+# Se construye en precargar(); se recarga solo al cambiar tours_ingles.json
+# (o vía /admin/catalog/reload) sin reiniciar workers
+gestor_catalogo = None
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Catálogos nativos por idioma (idiomas.py): se crea en create_app() y carga cada uno con su primera consulta
+registro_idiomas = None
+
+def crear_gestor_idioma(codigo, ruta):
+    """GestorCatalogo de un idioma con catálogo propio, vigilado como el base."""
+    return GestorCatalogo(
+        ruta, lambda tours_json, version: construir_catalogo(tours_json, version, codigo, ruta),
+        intervalo_vigilancia=float(os.getenv("CATALOG_WATCH_INTERVAL", "5")),
+    )
+
+def catalogo_para(language):
+    """Snapshot del catálogo nativo del idioma o, si no tiene, el del catálogo base."""
+    return registro_idiomas.catalogo(language) or gestor_catalogo.actual
+
 # === Funciones de Búsqueda y Traducción Contextual ===
 def obtener_keywords_contextuales(historial, pregunta_actual, language='es'):
     """Extrae palabras clave del contexto de la conversación según el idioma."""
@@ -335,222 +449,524 @@ def obtener_keywords_contextuales(historial, pregunta_actual, language='es'):
     stopwords = LANGUAGE_CONFIGS[language]['stopwords']
     palabras = re.findall(r'\b\w{3,}\b', texto_a_procesar)
     keywords = {palabra for palabra in palabras if palabra not in stopwords}
-    print(f"🔑 Keywords contextuales ({language.upper()}): {keywords}")
+    log.debug("🔑 Keywords contextuales (%s): %s", language.upper(), keywords)
     return list(keywords)
 
+# Modelo de respaldo para términos que no están en el léxico ni en la caché; comparte el circuito del chat
+cliente_traduccion = ClienteGemini(
+    lambda clave: cargar_genai().GenerativeModel('gemini-1.5-flash'),
+    circuito_gemini,
+    nombre='translation',
+    max_concurrentes=int(os.getenv("GEMINI_TRANSLATION_MAX_CONCURRENT", "4")),
+    plazo_total=float(os.getenv("GEMINI_TRANSLATION_DEADLINE", "3")),
+    reintentos=1,
+)
+
+def traducir_terminos_remoto(terminos):
+    """Traduce en una sola llamada a Gemini un lote de términos desconocidos."""
+    prompt = (
+        "Translate the following travel keywords to English. Provide only the most relevant, "
+        "single-word English equivalent for each. Answer one per line as 'original=english'. "
+        f"Keywords: '{', '.join(terminos)}'"
+    )
+    response = cliente_traduccion.modelo('traduccion').generate_content(
+        prompt, request_options={"timeout": cliente_traduccion.plazo_total}
+    )
+    traducciones = {}
+    for linea in response.text.strip().lower().splitlines():
+        if '=' in linea:
+            origen, destino = linea.split('=', 1)
+            traducciones[origen.strip(" -*'\"")] = destino.strip(" '\".,")
+    log.debug("🌐 Lote traducido remotamente (%d términos): %s", len(terminos), traducciones)
+    return traducciones
+
+def traducir_terminos_protegido(terminos):
+    """Traducción remota con plazo, reintento y circuito."""
+    return cliente_traduccion.ejecutar(traducir_terminos_fake if FAKE_GEMINI else traducir_terminos_remoto, terminos)
+
+# Se crea en create_app(): la caché persistente se lee en cada proceso
+traductor_keywords = None
+
+def actualizar_lexico(catalogo):
+    """Las recargas del catálogo traen un léxico nuevo para el traductor."""
+    traductor_keywords.lexico = catalogo.lexico
+
 def traducir_keywords_a_ingles(keywords, source_language='es'):
-    """Usa Gemini para traducir keywords al inglés si es necesario."""
+    """Traduce keywords al inglés con el léxico local y la caché; Gemini solo como último recurso."""
     if not keywords: 
         return []
     
     if source_language == 'en':
-        print(f"🌐 Keywords ya en inglés: {keywords}")
+        log.debug("🌐 Keywords ya en inglés: %s", keywords)
         return keywords
     
-    prompt = f"Translate the following Spanish travel keywords to English. Provide only the most relevant, single-word English equivalent for each. Return as a comma-separated list. Keywords: '{', '.join(keywords)}'"
-    try:
-        response = genai.GenerativeModel('gemini-1.5-flash').generate_content(prompt)
-        english_keywords = [kw.strip() for kw in response.text.strip().lower().split(',')]
-        print(f"🌐 Keywords traducidas (EN): {english_keywords}")
-        return english_keywords
-    except Exception as e:
-        print(f"❌ Error en la traducción de keywords: {e}")
-        return keywords
+    english_keywords = traductor_keywords.traducir(keywords)
+    log.debug("🌐 Keywords traducidas (EN): %s", english_keywords)
+    return english_keywords
 
-def buscar_tours_relevantes(keywords_en, intencion='specific'):
-    """Busca tours priorizando Puno/Titicaca según la especialización."""
-    if not keywords_en: 
+def buscar_tours_relevantes(keywords_en, intencion='specific', catalogo=None, candidatos=None):
+    """Busca tours priorizando Puno/Titicaca según la especialización.
+
+    `candidatos` (de IndiceFiltros.candidatos) limita la búsqueda a los tours
+    que cumplen grupo, presupuesto, duración y destino.
+    """
+    if not keywords_en and candidatos is None:
         return []
     
-    scored_tours = []
-    for tour in tours_data_loaded:
-        score = 0
-        texto_busqueda = (
-            tour.get("titulo_producto", "") + " " + 
-            tour.get("tipo_servicio", "") + " " + 
-            tour.get("descripcion_tab", "")
-        ).lower()
-        
-        puno_bonus = 0
-        if any(keyword in texto_busqueda for keyword in ['puno', 'titicaca', 'uros', 'taquile', 'amantani']):
-            puno_bonus = 10 
-        
-        for keyword in keywords_en:
-            if keyword in texto_busqueda:
-                score += 5 if keyword in tour.get("titulo_producto", "").lower() else 1
-        
-        if score > 0 or puno_bonus > 0:
-            score += puno_bonus
-            score += (6 - tour.get("prioridad", 5))
-            scored_tours.append((score, tour))
-    
-    scored_tours.sort(key=lambda x: x[0], reverse=True)
+    catalogo = catalogo or gestor_catalogo.actual
+    resultados = catalogo.motor.buscar(keywords_en, limite=3, candidatos=candidatos)
+    tours = catalogo.tours
     
     if intencion == 'specific_puno':
-        puno_tours = [tour for score, tour in scored_tours if score >= 10] 
-        return puno_tours[:3] if puno_tours else [tour for score, tour in scored_tours[:2]]
+        # Solo tours de nuestra especialidad, sin depender de la escala del motor
+        puno_tours = [tours[doc_id] for score, doc_id in resultados if tours[doc_id].es_puno]
+        return puno_tours[:3] if puno_tours else [tours[doc_id] for score, doc_id in resultados[:2]]
     
-    return [tour for score, tour in scored_tours[:3]]
+    return [tours[doc_id] for score, doc_id in resultados[:3]]
 
-def formatear_contexto_detallado(tours, language='es'):
-    """Formatea tours con URLs clickeables y prioridad visible."""
+def formatear_contexto_detallado(tours, language='es', filtros=None, catalogo=None):
+    """Concatena los bloques de contexto ya renderizados de cada tour.
+
+    Con filtros de la consulta se antepone lo que pidió el usuario y cada tour
+    lleva solo el precio por persona para su grupo en vez de todos los tramos.
+    """
     if not tours: 
         return LANGUAGE_CONFIGS[language]['no_tours_message']
     
-    resumen_partes = ["--- Relevant Tour Information ---"]
-    for tour in tours:
-        titulo = tour.get("titulo_producto", "No title")
-        descripcion = tour.get("descripcion_tab", "No description")
-        itinerario = tour.get("itinerario_ta", "No itinerary provided.")
-        url = tour.get("url_servicio", "")
-        prioridad = tour.get("prioridad", 5)
-        
-        precios_formateados = "Price on request."
-        try:
-            precios = json.loads(tour.get("precios_rango", "{}"))
-            if precios and all(k in precios for k in ["desde", "hasta", "precio"]):
-                price_entries = [
-                    f"For {d}-{h} people: ${p} USD" 
-                    for d, h, p in zip(precios["desde"], precios["hasta"], precios["precio"])
-                ]
-                precios_formateados = " | ".join(price_entries)
-        except (json.JSONDecodeError, TypeError):
-            pass
-        
-        es_puno = any(keyword in titulo.lower() + descripcion.lower() for keyword in ['puno', 'titicaca', 'uros', 'taquile', 'amantani'])
-        especialidad_nota = " ⭐ (NUESTRA ESPECIALIDAD)" if es_puno else ""
-        
-        resumen_partes.append(
-            f"\n🎯 Tour: {titulo}{especialidad_nota}\n"
-            f"Priority: {prioridad}/5 (1=highest priority)\n"
-            f"Description: {descripcion}\n"
-            f"Brief Itinerary: {itinerario[:150]}{'...' if len(itinerario) > 150 else ''}\n"
-            f"Prices per person: {precios_formateados}\n"
-            f"Booking URL: {url}\n"
-            f"IMPORTANT: Make URL clickable as: [Ver más información]({url}) (Spanish) or [More information]({url}) (English)"
-        )
-    
-    return "\n".join(resumen_partes)
+    if filtros is None or not filtros.activos:
+        return "\n".join(["--- Relevant Tour Information ---"] + [tour.contexto[language] for tour in tours])
 
-def construir_historial_gemini(historial_previo, instruccion_principal, contexto_detallado, pregunta_actual, language='es', intencion='specific'):
-    """Construye historial optimizado para especialización en Puno."""
-    historial_para_gemini = []
-    
-    historial_para_gemini.append({
-        "role": "user", 
-        "parts": [instruccion_principal]
-    })
-    
+    catalogo = catalogo or gestor_catalogo.actual
+    lineas = ["--- Relevant Tour Information ---", f"Customer requirements: {filtros.describir()}."]
+    if filtros.omitidos:
+        lineas.append("No tour meets every requirement: say so briefly and offer these closest options.")
+    lineas.extend(catalogo.filtros.contexto(tour, language, filtros) for tour in tours)
+    return "\n".join(lineas)
+
+def construir_historial_gemini(historial_previo, instruccion_principal, contexto_detallado, pregunta_actual, language='es', intencion='specific', catalogo=None):
+    """Construye historial optimizado para especialización en Puno, dentro del presupuesto de tokens."""
     es_primera_interaccion = len(historial_previo) == 0
     
-    if es_primera_interaccion:
-        historial_para_gemini.append({
-            "role": "model", 
-            "parts": [LANGUAGE_CONFIGS[language]['greeting']]
-        })
-    else:
-        historial_para_gemini.append({
-            "role": "model", 
-            "parts": ["¡Hola de nuevo! ¿En qué más te puedo ayudar? 😊" if language == 'es' else "Hello again! How else can I help you? 😊"]
-        })
-    
-    historial_para_gemini.extend(historial_previo)
-    
-    if intencion == 'general' and es_primera_interaccion:
-        destinos = obtener_destinos_disponibles()
+    modo = motor_intenciones.modo(intencion)
+    if modo == 'handoff':
+        # Reserva ya hecha, cancelación o reembolso: ni tours ni preguntas de fecha y número de personas
+        prompt_actual = f"SOLICITUD DE ATENCIÓN HUMANA (cancelación, reembolso o pedido de hablar con una persona). No recomiendes tours ni pidas fecha o número de personas.\n\nUser Question: {pregunta_actual}"
+    elif modo == 'general' and es_primera_interaccion:
+        destinos = obtener_destinos_disponibles(catalogo)
         prompt_actual = f"CONSULTA GENERAL - PRIMERA INTERACCIÓN. Especialidad: Puno/Titicaca. Otros destinos: {', '.join(destinos)}. Necesita consultar fecha y número de personas.\n\nUser Question: {pregunta_actual}"
     elif intencion == 'specific_puno':
         prompt_actual = f"CONSULTA ESPECÍFICA SOBRE PUNO/TITICACA (nuestra especialidad) 🌊:\n{contexto_detallado}\n\nRecuerda mencionar nuestra experiencia especializada en esta región.\n\nUser Question: {pregunta_actual}"
-    elif intencion == 'specific':
+    elif modo == 'specific':
         prompt_actual = f"{contexto_detallado}\n\nSi es relevante, menciona también nuestros tours especialidad en Puno/Titicaca.\n\nUser Question: {pregunta_actual}"
     else:
         prompt_actual = f"Consulta general. Recuerda que somos especialistas en Puno/Titicaca. Necesita fecha y número de personas.\n\nUser Question: {pregunta_actual}"
     
-    historial_para_gemini.append({
-        "role": "user", 
-        "parts": [prompt_actual]
-    })
+    pista = motor_intenciones.pista(intencion, language)
+    if pista:
+        prompt_actual = f"{pista}\n\n{prompt_actual}"
+    
+    # La instrucción viaja en el system_instruction del modelo; aquí solo se mide
+    historial_para_gemini, medidas = ensamblador_prompt.ensamblar(
+        historial_previo, prompt_actual, language,
+        tokens_instruccion=TOKENS_INSTRUCCION.get(language) or estimar_tokens(instruccion_principal),
+    )
+    log.info(
+        "📏 Prompt ~%d tokens (instrucción %d, historial %d en %d turnos, resumen %d de %d turnos, consulta %d); "
+        "formato anterior ~%d",
+        medidas['total'], medidas['instruccion'], medidas['historial'], medidas['turnos_conservados'],
+        medidas['resumen'], medidas['turnos_resumidos'], medidas['consulta'], medidas['formato_anterior'],
+    )
     
     return historial_para_gemini
 
+# === Pipeline compartido por los modos WSGI y ASGI ===
+# Pool acotado para solapar la carga de la sesión con la traducción remota
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "16"))
+PIPELINE_SESSION_TIMEOUT = float(os.getenv("PIPELINE_SESSION_TIMEOUT", "2.0"))
+PIPELINE_TRANSLATION_TIMEOUT = float(os.getenv("PIPELINE_TRANSLATION_TIMEOUT", "3.0"))
+# Cuánto se espera a Gemini-traducción antes de aceptar la búsqueda especulativa
+PIPELINE_SPECULATIVE_GRACE = float(os.getenv("PIPELINE_SPECULATIVE_GRACE_MS", "250")) / 1000
+pool_pipeline = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+resultado_especulativo = registro.contador(
+    "incalake_speculative_search_total",
+    "Búsquedas con traducción remota pendiente, según qué resultado se usó",
+    etiquetas=("outcome",),
+)
+filtros_aplicados = registro.contador(
+    "incalake_query_filters_total",
+    "Filtros estructurados resueltos antes del ranking (relaxed: ningún tour los cumplía todos)",
+    etiquetas=("filter",),
+)
+
+def resolver_filtros(historial, pregunta, catalogo):
+    """Filtros de la conversación y tours que los cumplen. Devuelve (filtros, candidatos o None)."""
+    mensajes_usuario = [h['parts'][0] for h in historial if h['role'] == 'user'][-2:]
+    filtros = filtros_de_conversacion(mensajes_usuario, pregunta)
+    if not filtros.activos:
+        return filtros, None
+    candidatos, filtros = catalogo.filtros.candidatos(filtros, catalogo.facetas)
+    for nombre, activo in (("group_size", filtros.personas), ("budget", filtros.presupuesto),
+                           ("duration", filtros.dias or filtros.corto), ("destination", filtros.destinos),
+                           ("relaxed", filtros.omitidos)):
+        if activo:
+            filtros_aplicados.incrementar(nombre)
+    log.debug("🎚️ Filtros: %s → %s candidatos", filtros, len(candidatos) if candidatos else "sin")
+    return filtros, candidatos
+
+def recuperar_contexto(pregunta, session_id, language, catalogo):
+    """Carga de sesión, traducción y búsqueda solapadas.
+
+    La sesión se lee en el pool mientras se detecta la intención y, si hay
+    keywords de la pregunta sin traducción local, se piden a Gemini en
+    paralelo. Con la traducción pendiente se busca de inmediato con lo
+    traducido localmente; ese resultado especulativo se usa si la traducción
+    no llega dentro de la gracia y ya hay coincidencias en el catálogo.
+
+    Grupo, presupuesto y duración pedidos en la conversación se resuelven
+    sobre las columnas del catálogo antes del ranking (resolver_filtros).
+
+    Si `catalogo` está en el idioma de la consulta (catálogo nativo, ver
+    idiomas.py) las keywords se buscan tal cual, sin traducir.
+
+    Devuelve (historial, intencion, tours, historial_completo, filtros).
+    """
+    futuro_historial = pool_pipeline.submit(load_session_history, session_id)
+    with medir_etapa('intent'):
+        intencion = detectar_intencion_consulta(pregunta, language)
+        # "¿Qué tours tienen para 4 personas por menos de $100?" necesita contexto de tours
+        if intencion == 'general' and extraer_filtros(pregunta).activos:
+            intencion = INTENCION_POR_DEFECTO
+    log.info("🧭 Intención detectada: %s", intencion)
+    buscar = motor_intenciones.busca_tours(intencion)
+    traducir = language != catalogo.idioma
+
+    futuro_traduccion = None
+    if buscar:
+        keywords_pregunta = obtener_keywords_contextuales([], pregunta, language)
+        locales_pregunta, pendientes = (
+            traductor_keywords.traducir_local(keywords_pregunta) if traducir else (keywords_pregunta, [])
+        )
+        if pendientes:
+            futuro_traduccion = pool_pipeline.submit(traducir_keywords_a_ingles, keywords_pregunta, language)
+
+    historial_completo = True
+    with medir_etapa('session_load'):
+        try:
+            historial = futuro_historial.result(timeout=PIPELINE_SESSION_TIMEOUT)
+        except FuturesTimeoutError:
+            log.warning("⏱️ La sesión %s tardó más de %ss en cargar; se responde sin historial",
+                        session_id, PIPELINE_SESSION_TIMEOUT)
+            historial = []
+            historial_completo = False
+    if not buscar:
+        return historial, intencion, [], historial_completo, FiltrosConsulta()
+
+    with medir_etapa('filters'):
+        filtros, candidatos = resolver_filtros(historial, pregunta, catalogo)
+
+    with medir_etapa('keywords'):
+        keywords_historial = [
+            k for k in obtener_keywords_contextuales(historial, pregunta, language) if k not in keywords_pregunta
+        ]
+
+    # Las keywords del historial ya se tradujeron en turnos anteriores: léxico o caché
+    if traducir:
+        with medir_etapa('translation'):
+            en_historial = traducir_keywords_a_ingles(keywords_historial, language)
+            if futuro_traduccion is None:
+                en_pregunta = traducir_keywords_a_ingles(keywords_pregunta, language)
+    else:
+        en_historial, en_pregunta = keywords_historial, keywords_pregunta
+
+    if futuro_traduccion is not None:
+        especulativas = locales_pregunta + en_historial
+        with medir_etapa('retrieval_speculative'):
+            tours_especulativos = buscar_tours_relevantes(especulativas, catalogo=catalogo, candidatos=candidatos)
+        usable = bool(tours_especulativos) and catalogo.indice.tiene_coincidencias(especulativas)
+        try:
+            with medir_etapa('translation_wait'):
+                en_pregunta = futuro_traduccion.result(
+                    timeout=PIPELINE_SPECULATIVE_GRACE if usable else PIPELINE_TRANSLATION_TIMEOUT
+                )
+        except FuturesTimeoutError:
+            # La traducción sigue en segundo plano y deja el resultado en la caché para el próximo turno
+            resultado_especulativo.incrementar('speculative' if usable else 'timeout')
+            return historial, intencion, tours_especulativos, historial_completo, filtros
+        resultado_especulativo.incrementar('translated')
+
+    with medir_etapa('retrieval'):
+        tours = buscar_tours_relevantes(en_pregunta + en_historial, catalogo=catalogo, candidatos=candidatos)
+    return historial, intencion, tours, historial_completo, filtros
+
+def preparar_consulta(data):
+    """Valida la petición y arma el historial para Gemini.
+
+    Devuelve (consulta, error): `consulta` es un dict con todo lo necesario
+    para generar y registrar la respuesta; `error` es el mensaje para un 400.
+    """
+    if not data:
+        return None, "No data provided"
+        
+    pregunta = data.get('message', '').strip()
+    session_id = data.get('session_id', 'default_session')
+    language = data.get('language', 'es')
+    
+    if language not in LANGUAGE_CONFIGS:
+        language = 'es'
+        
+    log.info("📨 Nueva petición: sesión=%s idioma=%s pregunta=%r", session_id, language, pregunta)
+
+    if not pregunta:
+        return None, "El mensaje no puede estar vacío."
+
+    # Snapshot del catálogo para toda la petición: una recarga a mitad del stream no la afecta
+    catalogo = catalogo_para(language)
+    historial, intencion, tours_relevantes, historial_completo, filtros = recuperar_contexto(
+        pregunta, session_id, language, catalogo
+    )
+    contexto_detallado = ""
+    if motor_intenciones.busca_tours(intencion):
+        contexto_detallado = formatear_contexto_detallado(tours_relevantes, language, filtros, catalogo)
+
+    config = LANGUAGE_CONFIGS[language]
+    with medir_etapa('prompt_build'):
+        historial_para_gemini = construir_historial_gemini(
+            historial, config['system_instruction'], contexto_detallado, pregunta, language, intencion, catalogo
+        )
+
+    # Sin historial el prompt depende solo de idioma, intención, pregunta y tours:
+    # esas respuestas se pueden reutilizar entre visitantes.
+    clave_cache = None
+    if not historial and historial_completo:
+        clave_cache = response_cache.clave(
+            language, intencion, normalizar_pregunta(pregunta, config['stopwords']),
+            [tour.id for tour in tours_relevantes], catalogo.version, filtros.clave()
+        )
+    return {
+        "pregunta": pregunta,
+        "session_id": session_id,
+        "language": language,
+        "config": config,
+        "intencion": intencion,
+        "catalogo": catalogo,
+        "historial": historial,
+        "historial_para_gemini": historial_para_gemini,
+        "clave_cache": clave_cache,
+        # El modelo de cada idioma lleva su instrucción de sistema: el idioma entra en la clave
+        "clave_generacion": generaciones_en_curso.clave(
+            [GEMINI_MODEL_NAME, GEMINI_GENERATION_CONFIG, language], historial_para_gemini
+        ),
+    }, None
+
+def respuesta_cacheada(consulta):
+    """Chunks de una respuesta previa idéntica, o None."""
+    if not consulta["clave_cache"]:
+        return None
+    return response_cache.obtener(consulta["clave_cache"])
+
+def cachear_respuesta(consulta, chunks):
+    """Guarda una respuesta completa de primer turno para reutilizarla."""
+    if consulta["clave_cache"] and chunks:
+        response_cache.guardar(consulta["clave_cache"], chunks)
+
+def respuesta_de_respaldo(consulta):
+    """Respuesta sin Gemini: la de la caché aunque haya expirado o, si no hay, la plantilla general."""
+    if consulta["clave_cache"]:
+        cacheados = response_cache.obtener_respaldo(consulta["clave_cache"])
+        if cacheados is not None:
+            return list(cacheados)
+    return [consulta["config"]['general_response_template']]
+
+def registrar_respuesta(consulta, respuesta_completa):
+    """Agrega el turno al historial de la sesión y lo guarda.
+
+    El turno se agrega sobre el historial vigente bajo el bloqueo de la sesión,
+    así dos pestañas con el mismo session_id no se pisan los mensajes.
+    """
+    try:
+        with medir_etapa('session_save'):
+            session_store.agregar_turno(
+                consulta["session_id"],
+                [
+                    {"role": "user", "parts": [consulta["pregunta"]]},
+                    {"role": "model", "parts": [respuesta_completa]},
+                ],
+                max_mensajes=MAX_HISTORY_TURNS * 2,
+            )
+        log.debug("✅ Historial guardado para sesión %s", consulta['session_id'])
+    except (IOError, sqlite3.Error) as e:
+        log.error(f"❌ Error grave al guardar sesión {consulta['session_id']}: {e}")
+
+def generar_respuesta(consulta):
+    """Textos de la respuesta: de la caché, de Gemini o, si Gemini no está disponible, de respaldo.
+
+    La respuesta completa queda en la sesión y recién entonces se libera el
+    turno de admisión. Si Gemini corta después del primer texto se lanza
+    RespuestaInterrumpida con el mensaje de error.
+    """
+    consulta["iniciada"] = True
+    chunks = []
+    inicio = time.perf_counter()
+    try:
+        cacheados = respuesta_cacheada(consulta)
+        if cacheados is not None:
+            log.info("⚡ Respuesta servida desde la caché")
+            yield from cacheados
+            registrar_respuesta(consulta, "".join(cacheados))
+            peticiones_chat.incrementar('cached')
+            return
+
+        textos = generaciones_en_curso.generar(
+            consulta["clave_generacion"],
+            lambda: cliente_gemini.generar_stream(consulta["language"], consulta["historial_para_gemini"]),
+        )
+        for texto in textos:
+            if not chunks:
+                observar_etapa('gemini_ttfb', time.perf_counter() - inicio)
+            chunks.append(texto)
+            yield texto
+
+        registrar_respuesta(consulta, "".join(chunks))
+        cachear_respuesta(consulta, chunks)
+        peticiones_chat.incrementar('ok')
+
+    except RespuestaInterrumpida:
+        raise
+    except Exception as e:
+        if chunks:
+            peticiones_chat.incrementar('error')
+            log.error(f"❌ Error al generar respuesta de Gemini: {e}")
+            raise RespuestaInterrumpida(consulta["config"]['error_message']) from e
+        # Nada enviado aún (circuito abierto, sin cupo o reintentos agotados): respuesta de respaldo
+        peticiones_chat.incrementar('fallback')
+        log.warning("🛟 Gemini no disponible (%s); se sirve la respuesta de respaldo", e)
+        respaldo = respuesta_de_respaldo(consulta)
+        yield from respaldo
+        registrar_respuesta(consulta, "".join(respaldo))
+    finally:
+        observar_etapa('stream_total', time.perf_counter() - inicio)
+        planificador_chat.liberar(consulta["turno"])
+
+# === Salida SSE (sse.py) ===
+# Agrupación de fragmentos por tamaño o ventana de tiempo, compresión (SSE_COMPRESSION="" la
+# desactiva) y reanudación con Last-Event-ID durante SSE_RESUME_SECONDS (0 la desactiva).
+# Los eventos se anexan en SSE_RESUME_DIR para que la reconexión la atienda cualquier worker
+# de la máquina ("" la deja en el worker que generó la respuesta)
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "512"))
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "50"))
+SSE_COMPRESSION = tuple(c.strip() for c in os.getenv("SSE_COMPRESSION", "br,gzip").split(",") if c.strip())
+SSE_RESUME_SECONDS = float(os.getenv("SSE_RESUME_SECONDS", "60"))
+transmisiones = RegistroTransmisiones(
+    ttl_segundos=SSE_RESUME_SECONDS,
+    max_transmisiones=int(os.getenv("SSE_RESUME_MAX_STREAMS", "1000")),
+    directorio=os.getenv("SSE_RESUME_DIR", os.path.join(basedir, "chat_streams")) or None,
+)
+# Termina las respuestas cuyo cliente se desconectó, para que el reintento las encuentre completas
+pool_reanudacion = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SSE_RESUME_WORKERS", "8")), thread_name_prefix="sse-resume"
+)
+
+def crear_agrupador():
+    return Agrupador(max_bytes=SSE_COALESCE_BYTES, ventana=SSE_COALESCE_MS / 1000)
+
+def cabeceras_sse(codificacion):
+    cabeceras = dict(CABECERAS_SSE)
+    if SSE_COMPRESSION:
+        cabeceras["Vary"] = "Accept-Encoding"
+    if codificacion:
+        cabeceras["Content-Encoding"] = codificacion
+    return cabeceras
+
+# Medidores leídos en cada scrape de /metrics
+registro.medidor("incalake_sessions_active", "Sesiones activas en el almacén", lambda: session_store.contar())
+registro.medidor("incalake_catalog_tours", "Tours en el catálogo publicado", lambda: len(gestor_catalogo.actual.tours))
+registro.medidor("incalake_catalog_generation", "Generación del catálogo publicado", lambda: gestor_catalogo.generacion)
+registro.medidor("incalake_response_cache_hit_ratio", "Tasa de aciertos de la caché de respuestas",
+                 lambda: response_cache.estadisticas()["hit_rate"])
+registro.medidor("incalake_chat_active", "Respuestas de /chat en curso", lambda: planificador_chat.estadisticas()["active"])
+registro.medidor("incalake_chat_queued", "Peticiones de /chat esperando turno",
+                 lambda: planificador_chat.estadisticas()["queued"])
+registro.medidor("incalake_gemini_dedup_ratio",
+                 "Fracción de respuestas de Gemini servidas desde un stream en curso con el mismo prompt",
+                 lambda: generaciones_en_curso.estadisticas()["dedup_ratio"])
+registro.medidor("incalake_translation_hit_ratio", "Tasa de aciertos locales del traductor de keywords",
+                 lambda: traductor_keywords.estadisticas()["hit_rate"])
+registro.medidor("incalake_upstream_circuit_open", "1 si el circuito hacia Gemini está abierto",
+                 lambda: int(circuito_gemini.abierto))
+registro.medidor("incalake_process_rss_bytes", "Memoria residente de este proceso",
+                 lambda: memoria_proceso().get("rss_kb", 0) * 1024 or None)
+registro.medidor("incalake_process_private_bytes", "Memoria privada (no compartida con otros procesos) de este proceso",
+                 lambda: memoria_proceso().get("private_kb", 0) * 1024 or None)
+registro.medidor("incalake_sse_resumable_streams", "Respuestas recientes que admiten reanudación con Last-Event-ID",
+                 lambda: len(transmisiones))
+registro.medidor("incalake_language_catalog_loaded", "1 si el catálogo del idioma está cargado en este proceso",
+                 lambda: {codigo: int(datos["loaded"]) for codigo, datos in registro_idiomas.estadisticas().items()},
+                 etiqueta="language")
+registro.medidor("incalake_language_catalog_heap_bytes", "Memoria de heap del catálogo e índices de cada idioma",
+                 lambda: {codigo: datos.get("heap_bytes") for codigo, datos in registro_idiomas.estadisticas().items()},
+                 etiqueta="language")
+registro.medidor("incalake_language_catalog_mapped_bytes", "Bytes del catálogo binario mapeado de cada idioma",
+                 lambda: {codigo: datos.get("mapped_bytes") for codigo, datos in registro_idiomas.estadisticas().items()},
+                 etiqueta="language")
+registro.medidor("incalake_startup_seconds", "Duración del arranque de este proceso (import + precarga + create_app)",
+                 lambda: round(sum(arranque.get(fase, 0) for fase in ("import_ms", "preload_ms", "create_app_ms")) / 1000, 3))
+
+rutas = Blueprint('chatbot', __name__)
+
 # === Ruta Principal del Chat ===
-# === Ruta Principal del Chat CORREGIDA ===
-@app.route('/chat', methods=['POST'])
+@rutas.route('/chat', methods=['POST'])
 def chat():
+    iniciar_muestreo()
+    codificacion = elegir_codificacion(request.headers.get('Accept-Encoding'), SSE_COMPRESSION)
+    ultimo_evento = request.headers.get('Last-Event-ID')
+    if ultimo_evento:
+        # Reconexión del widget: se reenvía lo que faltó sin volver a consultar a Gemini
+        transmision, desde = transmisiones.reanudar(ultimo_evento)
+        if transmision is None:
+            return Response(status=204)
+        return Response(reenviar(transmision, desde, Compresor(codificacion)),
+                        mimetype='text/event-stream', headers=cabeceras_sse(codificacion))
+    turno = None
     try:
         data = request.get_json()
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-            
-        pregunta = data.get('message', '').strip()
-        session_id = data.get('session_id', 'default_session')
-        language = data.get('language', 'es')
-        
-        if language not in LANGUAGE_CONFIGS:
-            language = 'es'
-            
-        print(f"\n--- Nueva Petición ---")
-        print(f"ID de Sesión: {session_id}")
-        print(f"Idioma: {language}")
-        print(f"Pregunta: {pregunta}")
-
-        if not pregunta:
-            return jsonify({"error": "El mensaje no puede estar vacío."}), 400
-
-        # MOVER ESTA LÍNEA ANTES DE LA FUNCIÓN stream_response()
-        historial = load_session_history(session_id)
-        intencion = detectar_intencion_consulta(pregunta, language)
-        print(f"Intención Detectada: {intencion}")
+        # El turno se toma antes de leer el historial: una sola respuesta en curso por sesión
+        ip = ip_cliente(request.headers, request.remote_addr, TRUST_PROXY_HEADERS)
+        try:
+            turno = planificador_chat.admitir(clave_admision(data, ip), ip)
+        except Rechazada as e:
+            cuerpo, estado, cabeceras = cuerpo_rechazo(e)
+            return jsonify(cuerpo), estado, cabeceras
 
-        contexto_detallado = ""
-        if intencion != 'general':
-            keywords = obtener_keywords_contextuales(historial, pregunta, language)
-            keywords_en = traducir_keywords_a_ingles(keywords, language)
-            tours_relevantes = buscar_tours_relevantes(keywords_en)
-            contexto_detallado = formatear_contexto_detallado(tours_relevantes, language)
+        consulta, error = preparar_consulta(data)
+        if error:
+            planificador_chat.liberar(turno)
+            peticiones_chat.incrementar('bad_request')
+            return jsonify({"error": error}), 400
+        consulta["turno"] = turno
 
-        config = LANGUAGE_CONFIGS[language]
-        historial_para_gemini = construir_historial_gemini(
-            historial, config['system_instruction'], contexto_detallado, pregunta, language, intencion
+        stream = emitir_sse(
+            generar_respuesta(consulta), transmisiones.crear(), crear_agrupador(), Compresor(codificacion),
+            pool_reanudacion.submit if SSE_RESUME_SECONDS > 0 else None,
         )
+        respuesta = Response(stream, mimetype='text/event-stream', headers=cabeceras_sse(codificacion))
 
-        def stream_response():
-            # USAR nonlocal PARA ACCEDER A LA VARIABLE DEL SCOPE EXTERIOR
-            nonlocal historial
-            respuesta_completa = ""
-            try:
-                response_stream = gemini_model.generate_content(
-                    historial_para_gemini, stream=True
-                )
-                
-                for chunk in response_stream:
-                    if chunk.text:
-                        respuesta_completa += chunk.text
-                        yield chunk.text
-                        time.sleep(0.01)
-                
-                # Actualizar y guardar historial en archivo
-                historial.append({"role": "user", "parts": [pregunta]})
-                historial.append({"role": "model", "parts": [respuesta_completa]})
-                
-                if len(historial) > MAX_HISTORY_TURNS * 2:
-                    historial = historial[-(MAX_HISTORY_TURNS * 2):]
-                
-                save_session_history(session_id, historial)
-                print(f"✅ Historial guardado para sesión {session_id}")
-
-            except Exception as e:
-                print(f"❌ Error al generar respuesta de Gemini: {e}")
-                yield config['error_message']
-
-        return Response(stream_response(), mimetype='text/event-stream')
+        @respuesta.call_on_close
+        def liberar_sin_empezar():
+            # El cliente se fue antes del primer byte: generar_respuesta no llegó a correr ni a liberar el turno
+            if not consulta.get("iniciada"):
+                planificador_chat.liberar(turno)
+
+        return respuesta
     
     except Exception as e:
-        print(f"❌ Error general en /chat: {e}")
+        if turno is not None:
+            planificador_chat.liberar(turno)
+        peticiones_chat.incrementar('internal_error')
+        log.error(f"❌ Error general en /chat: {e}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
 # === Rutas Adicionales ===
-@app.route('/session/<session_id>/history', methods=['GET'])
+@rutas.route('/session/<session_id>/history', methods=['GET'])
 def get_session_history(session_id):
     """Obtiene el historial de chat de una sesión desde su archivo."""
     historial = load_session_history(session_id)
@@ -561,60 +977,192 @@ def get_session_history(session_id):
         "message": "Historial cargado exitosamente" if historial else "Nueva sesión sin historial previo"
     })
 
-@app.route('/session/<session_id>/clear', methods=['POST'])
+@rutas.route('/session/<session_id>/clear', methods=['POST'])
 def clear_session(session_id):
     """Limpia el historial de una sesión eliminando su archivo."""
-    safe_session_id = re.sub(r'[^a-zA-Z0-9_-]', '', session_id)
-    filepath = os.path.join(SESSIONS_DIR, f"{safe_session_id}.json")
-    if os.path.exists(filepath):
-        try:
-            os.remove(filepath)
-            print(f"🗑️ Historial de sesión {session_id} limpiado.")
+    try:
+        if session_store.eliminar(session_id):
+            log.info(f"🗑️ Historial de sesión {session_id} limpiado.")
             return jsonify({"message": f"Historial de sesión {session_id} limpiado."})
-        except OSError as e:
-            print(f"❌ Error limpiando sesión {session_id}: {e}")
-            return jsonify({"error": "No se pudo limpiar la sesión"}), 500
+    except (OSError, sqlite3.Error) as e:
+        log.error(f"❌ Error limpiando sesión {session_id}: {e}")
+        return jsonify({"error": "No se pudo limpiar la sesión"}), 500
     return jsonify({"message": "Sesión no encontrada."}), 404
 
-@app.route('/destinations', methods=['GET'])
+@rutas.route('/destinations', methods=['GET'])
 def get_destinations():
     """Endpoint para obtener destinos disponibles."""
-    destinos = obtener_destinos_disponibles()
-    destinos_con_conteo = [
-        {"destination": destino, "tour_count": contar_tours_por_destino(destino)}
-        for destino in destinos
-    ]
+    # Cuerpo precalculado; el widget revalida con If-None-Match y recibe 304 si el catálogo no cambió
+    facetas = gestor_catalogo.actual.facetas
+    response = jsonify(facetas.respuesta)
+    response.set_etag(facetas.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = DESTINATIONS_MAX_AGE
+    return response.make_conditional(request)
+
+@rutas.route('/admin/catalog/reload', methods=['POST'])
+def reload_catalog():
+    """Recarga el catálogo en este worker sin reiniciarlo (requiere ADMIN_TOKEN)."""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Recarga manual deshabilitada: ADMIN_TOKEN no está configurado."}), 403
+    if request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({"error": "Token de administración inválido."}), 401
+
+    publicado = gestor_catalogo.recargar(forzar=request.args.get('force') == '1')
     return jsonify({
-        "destinations": destinos_con_conteo,
-        "total_destinations": len(destinos)
+        "reloaded": publicado,
+        "tours_loaded": len(gestor_catalogo.actual.tours),
+        **gestor_catalogo.estadisticas(),
     })
 
-@app.route('/')
+@rutas.route('/')
 def index():
     return jsonify({
         "message": "API de IncaLake Chatbot funcionando",
         "version": "2.2-persistent",
-        "active_sessions_files": len(os.listdir(SESSIONS_DIR)),
+        "active_sessions_files": session_store.contar(),
     })
 
-@app.route('/health')
+@rutas.route('/metrics')
+def metrics():
+    """Métricas de este proceso en formato de texto de Prometheus."""
+    return Response(registro.exportar(), mimetype='text/plain; version=0.0.4')
+
+@rutas.route('/health')
 def health_check():
-    """Endpoint de health check para monitoring."""
+    """Endpoint de health check para monitoring; no llama a Gemini ni requiere la API key."""
     return jsonify({
         "status": "healthy",
         "timestamp": time.time(),
-        "tours_loaded": len(tours_data_loaded),
-        "active_sessions_files": len(os.listdir(SESSIONS_DIR)),
+        "tours_loaded": len(gestor_catalogo.actual.tours),
+        "catalog_version": gestor_catalogo.actual.version,
+        "catalog": gestor_catalogo.estadisticas(),
+        "languages": registro_idiomas.estadisticas(),
+        "active_sessions_files": session_store.contar(),
+        "sessions": {**session_store.estadisticas(), **conserje_sesiones.estadisticas()},
+        "translation": traductor_keywords.estadisticas(),
+        "response_cache": response_cache.estadisticas(),
+        "prompt": ensamblador_prompt.estadisticas(),
+        "upstream": {
+            "api_key_configured": bool(GEMINI_API_KEY) or FAKE_GEMINI,
+            "chat": cliente_gemini.estadisticas(),
+            "single_flight": generaciones_en_curso.estadisticas(),
+            "admission": planificador_chat.estadisticas(),
+            "translation": cliente_traduccion.estadisticas(),
+        },
+        "process": {"pid": os.getpid(), "startup": arranque, "memory": memoria_proceso()},
     })
 
+# === Arranque: precarga compartida y fábrica de la app ===
+_lock_arranque = threading.Lock()
+
+def precargar():
+    """Construye el catálogo y sus índices una vez por proceso.
+
+    Con gunicorn se llama en el master (ver gunicorn.conf.py) antes de forkear:
+    los workers heredan el snapshot por copy-on-write en vez de parsear cada
+    uno su copia de tours_ingles.json.
+    """
+    global gestor_catalogo
+    with _lock_arranque:
+        if gestor_catalogo is None:
+            inicio = time.perf_counter()
+            gestor = GestorCatalogo(
+                TOURS_PATH, lambda tours_json, version: construir_catalogo(tours_json, version, ruta=TOURS_PATH),
+                intervalo_vigilancia=float(os.getenv("CATALOG_WATCH_INTERVAL", "5")),
+            )
+            gestor.recargar()
+            gestor_catalogo = gestor
+            arranque["preload_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+            arranque["preload_pid"] = os.getpid()
+    return gestor_catalogo
+
+def create_app():
+    """Fábrica de la app Flask.
+
+    La primera llamada del proceso crea el estado propio del worker (almacén
+    de sesiones, traductor, hilos del conserje y de vigilancia del catálogo);
+    las siguientes solo arman otra app con las mismas rutas.
+    """
+    global session_store, conserje_sesiones, traductor_keywords, registro_idiomas
+    precargar()
+    with _lock_arranque:
+        if session_store is None:
+            inicio = time.perf_counter()
+            if not GEMINI_API_KEY and not FAKE_GEMINI:
+                log.warning("⚠️ GEMINI_API_KEY no está configurada: /chat responderá con la plantilla de respaldo")
+
+            session_store = crear_almacen_sesiones()
+            log.info(f"✅ Almacén de sesiones: {type(session_store).__name__}")
+            # Conserje: archiva (o elimina con SESSION_EXPIRED_ACTION=delete) las sesiones expiradas.
+            # SESSION_JANITOR_INTERVAL=0 lo desactiva.
+            conserje_sesiones = ConserjeSesiones(
+                session_store,
+                intervalo_segundos=float(os.getenv("SESSION_JANITOR_INTERVAL", "3600")),
+                archivar=os.getenv("SESSION_EXPIRED_ACTION", "archive") != "delete",
+            )
+            conserje_sesiones.iniciar()
+
+            traductor_keywords = TraductorKeywords(
+                gestor_catalogo.actual.lexico,
+                CacheTraducciones(
+                    os.getenv("TRANSLATION_CACHE_PATH", os.path.join(basedir, "translation_cache.json")),
+                    max_entradas=int(os.getenv("TRANSLATION_CACHE_SIZE", "5000")),
+                    ttl_segundos=int(os.getenv("TRANSLATION_CACHE_TTL", str(30 * 24 * 3600))),
+                    intervalo_persistencia=float(os.getenv("TRANSLATION_CACHE_FLUSH_INTERVAL", "60")),
+                ),
+                funcion_remota=traducir_terminos_protegido,
+            )
+            gestor_catalogo.al_publicar = actualizar_lexico
+            gestor_catalogo.iniciar()
+
+            # LANGUAGE_IDLE_SECONDS=0 mantiene cargados los catálogos nativos una vez usados
+            registro_idiomas = RegistroIdiomas(
+                {
+                    codigo: ruta_catalogo_nativo(codigo, config, basedir)
+                    for codigo, config in LANGUAGE_CONFIGS.items() if codigo != IDIOMA_BASE
+                },
+                crear_gestor_idioma,
+                base=gestor_catalogo,
+                inactividad_segundos=float(os.getenv("LANGUAGE_IDLE_SECONDS", "1800")),
+            )
+
+            arranque["create_app_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+            arranque["preloaded_in_master"] = arranque.get("preload_pid") != os.getpid()
+
+    flask_app = Flask(__name__)
+    # Permitir CORS para todas las rutas
+    CORS(flask_app, resources={r"/*": {"origins": "*"}})
+    flask_app.register_blueprint(rutas)
+    return flask_app
+
+_app_por_defecto = None
+
+def __getattr__(nombre):
+    """`app:app` (gunicorn, flask run, asgi_app) crea la app con el primer acceso, no al importar."""
+    global _app_por_defecto
+    if nombre == 'app':
+        with _lock_arranque:
+            creada = _app_por_defecto
+        if creada is None:
+            creada = create_app()
+            with _lock_arranque:
+                _app_por_defecto = _app_por_defecto or creada
+        return _app_por_defecto
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+
+arranque["import_ms"] = round((time.perf_counter() - _inicio_import) * 1000, 1)
+
 if __name__ == '__main__':
-    print("🚀 Iniciando IncaLake Chatbot API...")
-    print(f"📚 Tours cargados: {len(tours_data_loaded)}")
-    print(f"🌍 Idiomas soportados: {list(LANGUAGE_CONFIGS.keys())}")
-    print(f"🎯 Destinos disponibles: {obtener_destinos_disponibles()}")
-    print(f"📂 Directorio de sesiones: '{SESSIONS_DIR}'")
-    print(f"📂 Directorio de trabajo: {os.getcwd()}")
-    print(f"📁 Directorio de sesiones: {SESSIONS_DIR}")
-    print(f"📁 Directorio existe: {os.path.exists(SESSIONS_DIR)}")
-    print(f"📁 Permisos de escritura: {os.access(SESSIONS_DIR, os.W_OK) if os.path.exists(SESSIONS_DIR) else 'N/A'}")
+    app = create_app()
+    log.info("🚀 Iniciando IncaLake Chatbot API...")
+    log.info(f"📚 Tours cargados: {len(gestor_catalogo.actual.tours)} (versión {gestor_catalogo.actual.version})")
+    log.info(f"🌍 Idiomas soportados: {list(LANGUAGE_CONFIGS.keys())} "
+             f"(con catálogo propio: {[codigo for codigo in LANGUAGE_CONFIGS if codigo in registro_idiomas]})")
+    log.info(f"🎯 Destinos disponibles: {obtener_destinos_disponibles()}")
+    log.info(f"📂 Directorio de sesiones: '{SESSIONS_DIR}'")
+    log.info(f"📂 Directorio de trabajo: {os.getcwd()}")
+    log.info(f"📁 Directorio de sesiones: {SESSIONS_DIR}")
+    log.info(f"📁 Directorio existe: {os.path.exists(SESSIONS_DIR)}")
+    log.info(f"📁 Permisos de escritura: {os.access(SESSIONS_DIR, os.W_OK) if os.path.exists(SESSIONS_DIR) else 'N/A'}")
     app.run(debug=True, host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""Modo de servicio ASGI del chatbot de IncaLake.
+
+/chat se atiende con el cliente asíncrono de Gemini y un generador asíncrono,
+así que una conversación en curso ya no ocupa un worker mientras Gemini
+genera. El resto de rutas se sirven desde la app Flask montada.
+
+Ejecutar con:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as chatbot
+from admision import Rechazada, ip_cliente
+from instrumentacion import iniciar_muestreo, observar_etapa, peticiones_chat
+from sse import Compresor, RespuestaInterrumpida, elegir_codificacion, emitir_sse_async, reenviar
+
+# Estado del worker (sesiones, traductor, hilos de fondo) y rutas Flask
+flask_app = chatbot.create_app()
+
+# La admisión (cupo, cola, una respuesta por sesión, límites de tasa) es la de app.py.
+# ASGI_MAX_STREAMS y ASGI_QUEUE_TIMEOUT, si se definen, ajustan su cupo y su espera en este modo.
+planificador = chatbot.planificador_chat
+planificador.max_activas = int(os.getenv("ASGI_MAX_STREAMS", str(planificador.max_activas)))
+planificador.espera_maxima = float(os.getenv("ASGI_QUEUE_TIMEOUT", str(planificador.espera_maxima)))
+
+
+async def stream_response(consulta):
+    """Reenvía los chunks de Gemini a medida que llegan.
+
+    Cada `yield` espera a que el servidor entregue el chunk al cliente, de modo
+    que un cliente lento frena la lectura del stream de Gemini (backpressure)
+    en lugar de acumular texto en memoria. El framing SSE lo pone
+    sse.emitir_sse_async.
+    """
+    consulta["iniciada"] = True
+    chunks = []
+    inicio = time.perf_counter()
+    try:
+        cacheados = chatbot.respuesta_cacheada(consulta)
+        if cacheados is not None:
+            for chunk in cacheados:
+                yield chunk
+            await asyncio.to_thread(chatbot.registrar_respuesta, consulta, "".join(cacheados))
+            peticiones_chat.incrementar('cached')
+            return
+
+        textos = chatbot.generaciones_en_curso.generar_async(
+            consulta["clave_generacion"],
+            lambda: chatbot.cliente_gemini.generar_stream_async(consulta["language"], consulta["historial_para_gemini"]),
+        )
+        async for texto in textos:
+            if not chunks:
+                observar_etapa('gemini_ttfb', time.perf_counter() - inicio)
+            chunks.append(texto)
+            yield texto
+
+        await asyncio.to_thread(chatbot.registrar_respuesta, consulta, "".join(chunks))
+        chatbot.cachear_respuesta(consulta, chunks)
+        peticiones_chat.incrementar('ok')
+
+    except Exception as e:
+        if chunks:
+            peticiones_chat.incrementar('error')
+            chatbot.log.error(f"❌ Error al generar respuesta de Gemini: {e}")
+            raise RespuestaInterrumpida(consulta["config"]['error_message']) from e
+        peticiones_chat.incrementar('fallback')
+        chatbot.log.warning("🛟 Gemini no disponible (%s); se sirve la respuesta de respaldo", e)
+        respaldo = chatbot.respuesta_de_respaldo(consulta)
+        for chunk in respaldo:
+            yield chunk
+        await asyncio.to_thread(chatbot.registrar_respuesta, consulta, "".join(respaldo))
+    finally:
+        observar_etapa('stream_total', time.perf_counter() - inicio)
+        planificador.liberar(consulta["turno"])
+
+
+class RespuestaSSE(StreamingResponse):
+    """StreamingResponse que devuelve el turno de admisión si el cliente se va antes de que empiece el stream."""
+
+    def __init__(self, contenido, consulta, **kwargs):
+        super().__init__(contenido, **kwargs)
+        self.consulta = consulta
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Si stream_response llegó a correr, el turno se libera en su finally
+            if not self.consulta.get("iniciada"):
+                planificador.liberar(self.consulta["turno"])
+
+
+async def chat(request):
+    iniciar_muestreo()
+    codificacion = elegir_codificacion(request.headers.get('accept-encoding'), chatbot.SSE_COMPRESSION)
+    ultimo_evento = request.headers.get('last-event-id')
+    if ultimo_evento:
+        # Reconexión: no ocupa cupo de Gemini, solo reenvía eventos ya generados (en el threadpool)
+        transmision, desde = chatbot.transmisiones.reanudar(ultimo_evento)
+        if transmision is None:
+            return Response(status_code=204)
+        return StreamingResponse(reenviar(transmision, desde, Compresor(codificacion)),
+                                 media_type='text/event-stream', headers=chatbot.cabeceras_sse(codificacion))
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    ip = ip_cliente(request.headers, request.client.host if request.client else None, chatbot.TRUST_PROXY_HEADERS)
+    try:
+        turno = planificador.solicitar(chatbot.clave_admision(data, ip), ip)
+        await planificador.esperar_async(turno)
+    except Rechazada as e:
+        cuerpo, estado, cabeceras = chatbot.cuerpo_rechazo(e)
+        return JSONResponse(cuerpo, status_code=estado, headers=cabeceras)
+
+    try:
+        # Sesión, traducción y búsqueda son bloqueantes: se ejecutan fuera del event loop
+        consulta, error = await asyncio.to_thread(chatbot.preparar_consulta, data)
+        if error:
+            planificador.liberar(turno)
+            peticiones_chat.incrementar('bad_request')
+            return JSONResponse({"error": error}, status_code=400)
+        consulta["turno"] = turno
+    except Exception as e:
+        planificador.liberar(turno)
+        peticiones_chat.incrementar('internal_error')
+        chatbot.log.error(f"❌ Error general en /chat: {e}")
+        return JSONResponse({"error": "Error interno del servidor"}, status_code=500)
+
+    stream = emitir_sse_async(
+        stream_response(consulta), chatbot.transmisiones.crear(), chatbot.crear_agrupador(), Compresor(codificacion),
+        reanudable=chatbot.SSE_RESUME_SECONDS > 0,
+    )
+    return RespuestaSSE(stream, consulta, media_type='text/event-stream', headers=chatbot.cabeceras_sse(codificacion))
+
+
+app = Starlette(
+    routes=[
+        Route(
+            '/chat', chat, methods=['POST', 'OPTIONS'],
+            middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+        ),
+        # Las demás rutas (historial, destinos, health...) siguen en Flask
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+)
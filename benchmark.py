@@ -0,0 +1,874 @@
+"""Benchmarks del chatbot de IncaLake.
+
+Uso:
+    python benchmark.py ranking [--repeticiones N] [--k 3]
+    python benchmark.py intenciones [--repeticiones N]
+    python benchmark.py micro [--repeticiones N] [--sesiones N]
+    python benchmark.py servidor --url http://127.0.0.1:5000 [--concurrencia 50] [--peticiones 500]
+    python benchmark.py servidor --local --replay [--visitantes 100] [--latencia-chunk-ms 20] [--ttfb-ms 300]
+    python benchmark.py servidor --local [--fallos 0.2] [--lentos 0.1 --lento-ms 3000] [--cobertura-ms 800]
+    python benchmark.py resiliencia [--peticiones 200] [--cobertura-ms 800]
+    python benchmark.py arranque [--workers 4] [--peticiones 200] [--tours tours_ingles.incat]
+    python benchmark.py sse [--respuestas 200] [--chunks 60] [--tamano-chunk 12] [--latencia-chunk-ms 15]
+
+`servidor --local` levanta la app en el mismo proceso con el stub local de
+Gemini (respuestas y traducción) y sesiones en un directorio temporal, así
+que no consume cuota ni toca chat_sessions/. `--replay` reproduce, en orden y
+sobre una misma sesión, los mensajes de cada conversación guardada.
+
+`ranking` mide relevancia (hit@k, MRR y recall@k, con las URLs que recomendó
+el modelo como juicio) y latencia de cada motor sobre las consultas de
+chat_sessions/, más un juego de paráfrasis que el ranking por términos no
+resuelve. Con numpy compara también la búsqueda semántica (semantica.py) sola
+y fusionada, y el tiempo de calcular su índice frente a leerlo del .npz.
+
+`arranque` levanta gunicorn con y sin la precarga de gunicorn.conf.py y
+compara el tiempo hasta que todos los workers responden y la memoria de cada
+worker (RSS, PSS y privada, de /proc/<pid>/smaps_rollup) tras recibir tráfico.
+
+`sse` compara, sobre las mismas llegadas simuladas de fragmentos de Gemini,
+la salida anterior (una escritura por fragmento, sin framing) con la de
+sse.py: escrituras al socket, bytes en el cable y latencia añadida por la
+agrupación, sin comprimir y comprimida.
+
+`resiliencia` pasa el cliente de Gemini (reintentos, hedging y circuito) por
+escenarios de fallos inyectados en el stub: sano, 20% de errores, 5% de
+llamadas lentas, caída total y recuperación.
+
+Para comparar los modos de servicio sin gastar cuota, levantar el servidor con
+el stub local de Gemini, por ejemplo:
+    FAKE_GEMINI=1 gunicorn -w 4 --threads 8 app:app
+    FAKE_GEMINI=1 uvicorn asgi_app:app
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+SESSIONS_DIR = os.getenv("SESSIONS_DIR", os.path.join(basedir, "chat_sessions"))
+SESSIONS_ARCHIVE_DIR = os.getenv("SESSIONS_ARCHIVE_DIR", os.path.join(basedir, "chat_sessions_archive"))
+
+_URL_RE = re.compile(r'https://incalake\.com/[^\s)\]"]+')
+
+
+def cargar_conversaciones(directorios=(SESSIONS_DIR, SESSIONS_ARCHIVE_DIR)):
+    """Lee las transcripciones de chat_sessions/ y del archivo de sesiones expiradas (shards incluidos)."""
+    conversaciones = []
+    for raiz, _, archivos in (paso for directorio in directorios for paso in os.walk(directorio)):
+        for nombre in sorted(archivos):
+            if not nombre.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(raiz, nombre), 'r', encoding='utf-8') as f:
+                    historial = json.load(f)
+            except (json.JSONDecodeError, IOError):
+                continue
+            if isinstance(historial, list) and historial:
+                conversaciones.append(historial)
+    return conversaciones
+
+
+def extraer_consultas(conversaciones):
+    """Devuelve [(historial_previo, pregunta, urls_recomendadas)] a partir de las transcripciones.
+
+    Las URLs que el modelo recomendó en su respuesta sirven como juicio de
+    relevancia para la pregunta del usuario.
+    """
+    consultas = []
+    for historial in conversaciones:
+        for i, mensaje in enumerate(historial):
+            if mensaje.get('role') != 'user':
+                continue
+            respuesta = historial[i + 1] if i + 1 < len(historial) else None
+            urls = set()
+            if respuesta and respuesta.get('role') == 'model':
+                urls = set(_URL_RE.findall(respuesta['parts'][0]))
+            consultas.append((historial[:i], mensaje['parts'][0], urls))
+    return consultas
+
+
+def percentil(valores, p):
+    """Percentil p (0-100) por el método del rango más cercano."""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def medir(funcion, repeticiones):
+    """Ejecuta `funcion` varias veces y devuelve las duraciones en microsegundos."""
+    duraciones = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        duraciones.append((time.perf_counter() - inicio) * 1e6)
+    return duraciones
+
+
+def imprimir_latencias(nombre, duraciones, unidad="µs"):
+    print(
+        f"  {nombre:<34} media={statistics.mean(duraciones):8.1f}{unidad} "
+        f"p50={percentil(duraciones, 50):8.1f}{unidad} p95={percentil(duraciones, 95):8.1f}{unidad} "
+        f"p99={percentil(duraciones, 99):8.1f}{unidad}"
+    )
+
+
+# === Benchmark de ranking ===
+# Paráfrasis (en inglés, como llegan al motor) de lo que el catálogo dice con otras palabras,
+# con el fragmento de URL de algún tour correcto: miden lo que el ranking por términos no ve
+CONSULTAS_PARAFRASIS = [
+    ("reeds", "uros"),
+    ("floating villages", "uros"),
+    ("stay with a local family", "amantani"),
+    ("homestay", "amantani"),
+    ("inca burial towers", "sillustani"),
+    ("chullpa", "sillustani"),
+    ("sillustany", "sillustani"),
+    ("fertility temple", "chucuito"),
+    ("condors", "colca"),
+    ("salar", "uyuni"),
+    ("kayaks", "kayak"),
+    ("machupichu", "machupicchu"),
+    ("titikaka", "titicaca"),
+    ("turquoise lagoon", "humantay"),
+    ("cable cars", "cable"),
+    ("quad bikes", "atv"),
+]
+
+
+def evaluar_relevancia(motor, tours, juzgadas, k):
+    """(hit@k, MRR, recall@k) de `motor` sobre [(keywords, urls_relevantes)]."""
+    aciertos = 0
+    rr_total = 0.0
+    recall_total = 0.0
+    for keywords, urls in juzgadas:
+        urls_resultado = [tours[doc_id].url for _, doc_id in motor.buscar(keywords, limite=k)]
+        encontradas = urls.intersection(urls_resultado)
+        aciertos += bool(encontradas)
+        recall_total += len(encontradas) / len(urls)
+        for posicion, url in enumerate(urls_resultado, 1):
+            if url in urls:
+                rr_total += 1 / posicion
+                break
+    n = len(juzgadas) or 1
+    return aciertos / n, rr_total / n, recall_total / n
+
+
+def benchmark_ranking(args):
+    import app
+    import semantica
+    from indice_tours import MOTORES_RANKING, crear_motor
+    from traduccion import CacheTraducciones, TraductorKeywords
+
+    # Solo la capa local de traducción: el benchmark no consume cuota de la API
+    catalogo = app.precargar().actual
+    traductor = TraductorKeywords(catalogo.lexico, CacheTraducciones(None))
+
+    consultas = extraer_consultas(cargar_conversaciones())
+    print(f"\n📊 {len(consultas)} consultas extraídas de {SESSIONS_DIR}")
+
+    preparadas = []
+    for historial, pregunta, urls in consultas:
+        keywords = app.obtener_keywords_contextuales(historial, pregunta, 'es')
+        preparadas.append((traductor.traducir(keywords), urls))
+    juzgadas = [(kw, urls) for kw, urls in preparadas if urls]
+    # Juicio de las paráfrasis: todas las URLs del catálogo que contienen el fragmento esperado
+    parafrasis = [
+        (consulta.split(), {tour.url for tour in catalogo.tours if fragmento in tour.url.lower()})
+        for consulta, fragmento in CONSULTAS_PARAFRASIS
+    ]
+    parafrasis = [(kw, urls) for kw, urls in parafrasis if urls]
+
+    motores = {}
+    for nombre in MOTORES_RANKING:
+        config = app.RANKING_CONFIG if nombre == app.RANKING_ENGINE else {}
+        inicio = time.perf_counter()
+        motores[nombre] = (crear_motor(nombre, catalogo.indice, **config), (time.perf_counter() - inicio) * 1000)
+
+    if semantica.disponible():
+        inicio = time.perf_counter()
+        semantico = semantica.IndiceSemantico.construir(catalogo.tours, catalogo.version, app.SEMANTIC_DIMENSION)
+        construccion_ms = (time.perf_counter() - inicio) * 1000
+        with tempfile.TemporaryDirectory() as temporal:
+            ruta = os.path.join(temporal, "tours.json")
+            semantico.guardar(semantica.ruta_indice(ruta))
+            tamano_kb = os.path.getsize(semantica.ruta_indice(ruta)) / 1024
+            inicio = time.perf_counter()
+            semantica.IndiceSemantico.cargar(semantica.ruta_indice(ruta), catalogo.version, app.SEMANTIC_DIMENSION)
+            carga_ms = (time.perf_counter() - inicio) * 1000
+        print(f"\n🧭 Índice semántico: {len(semantico)} tours x {semantico.dimension}, "
+              f"calculado en {construccion_ms:.1f} ms, leído del .npz ({tamano_kb:.0f} KB) en {carga_ms:.1f} ms")
+        lexico, lexico_ms = motores[app.RANKING_ENGINE]
+        motores[f"{app.RANKING_ENGINE}+semantico"] = (
+            semantica.MotorHibrido(lexico, semantico, **app.SEMANTIC_CONFIG), lexico_ms + construccion_ms)
+        motores["semantico"] = (
+            semantica.MotorHibrido(lexico, semantico, peso=1.0, umbral=app.SEMANTIC_CONFIG["umbral"]),
+            construccion_ms)
+    else:
+        print("\n⚠️ numpy no está instalado: se omite la búsqueda semántica")
+
+    for nombre, (motor, construccion_ms) in motores.items():
+        duraciones = []
+        for keywords, _ in preparadas:
+            duraciones.extend(medir(lambda: motor.buscar(keywords, limite=args.k), args.repeticiones))
+
+        print(f"\n🔎 Motor '{nombre}' (construcción {construccion_ms:.1f} ms)")
+        for titulo, conjunto in (("conversaciones", juzgadas), ("paráfrasis", parafrasis)):
+            if conjunto:
+                hit, mrr, recall = evaluar_relevancia(motor, catalogo.tours, conjunto, args.k)
+                print(f"  {titulo:<15} hit@{args.k}={hit:.2f}  MRR={mrr:.2f}  recall@{args.k}={recall:.2f}  "
+                      f"({len(conjunto)} consultas juzgadas)")
+        imprimir_latencias("buscar()", duraciones)
+
+
+# === Benchmark de detección de intención ===
+def detectar_intencion_legacy(pregunta, language='es'):
+    """Implementación original (bucle de re.search por patrón) como referencia."""
+    from intenciones import PATRONES_GENERALES, PUNO_KEYWORDS_INTENCION
+
+    pregunta_lower = pregunta.lower()
+    if any(keyword in pregunta_lower for keyword in PUNO_KEYWORDS_INTENCION):
+        return 'specific_puno'
+    for patron in PATRONES_GENERALES.get(language, PATRONES_GENERALES['es']):
+        if re.search(patron, pregunta_lower):
+            return 'general'
+    return 'specific'
+
+
+def benchmark_intenciones(args):
+    import app
+
+    corpus = [pregunta for _, pregunta, _ in extraer_consultas(cargar_conversaciones())] + MENSAJES_CARGA
+    print(f"\n🧭 {len(corpus)} mensajes (sesiones guardadas + mensajes de carga)")
+
+    conteo = {}
+    for pregunta in corpus:
+        intencion = app.motor_intenciones.detectar(pregunta, 'es')
+        conteo[intencion] = conteo.get(intencion, 0) + 1
+    print(f"  intenciones: {dict(sorted(conteo.items(), key=lambda x: -x[1]))}")
+
+    for nombre, funcion in (("legacy (re.search)", detectar_intencion_legacy),
+                            ("MotorIntenciones", app.motor_intenciones.detectar)):
+        duraciones = []
+        for pregunta in corpus:
+            duraciones.extend(medir(lambda: funcion(pregunta, 'es'), args.repeticiones))
+        imprimir_latencias(nombre, duraciones)
+
+
+# === Benchmark del servidor /chat ===
+MENSAJES_CARGA = [
+    "hola", "tours en Puno?", "info de tours", "tour a las islas uros y taquile",
+    "tour a aramu muru", "somos 4 personas", "tour al cañón del colca en 2 días",
+]
+
+
+def enviar_mensaje(url, mensaje, session_id, language='es', timeout=120):
+    """POST /chat leyendo el stream completo. Devuelve (status, ttfb_s, total_s, bytes)."""
+    destino = urlparse(url)
+    clase = http.client.HTTPSConnection if destino.scheme == 'https' else http.client.HTTPConnection
+    conexion = clase(destino.hostname, destino.port, timeout=timeout)
+    cuerpo = json.dumps({"message": mensaje, "session_id": session_id, "language": language})
+    inicio = time.perf_counter()
+    try:
+        conexion.request("POST", destino.path.rstrip('/') + "/chat", body=cuerpo,
+                         headers={"Content-Type": "application/json"})
+        respuesta = conexion.getresponse()
+        ttfb = None
+        total_bytes = 0
+        while True:
+            bloque = respuesta.read1(65536) if hasattr(respuesta, 'read1') else respuesta.read(65536)
+            if not bloque:
+                break
+            if ttfb is None:
+                ttfb = time.perf_counter() - inicio
+            total_bytes += len(bloque)
+        total = time.perf_counter() - inicio
+        return respuesta.status, (ttfb if ttfb is not None else total), total, total_bytes
+    finally:
+        conexion.close()
+
+
+_ETAPA_RE = re.compile(r'^incalake_chat_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+_CONTADOR_RE = re.compile(
+    r'^incalake_(?:chat_requests_total\{result="([^"]+)"\}|upstream_events_total\{client="([^"]+)",event="([^"]+)"\}) (\S+)$'
+)
+
+
+def leer_metricas(url):
+    """Lee /metrics. Devuelve ({etapa: (suma_s, conteo)}, {contador: valor}) con peticiones y eventos de Gemini."""
+    destino = urlparse(url)
+    conexion = http.client.HTTPConnection(destino.hostname, destino.port, timeout=10)
+    try:
+        conexion.request("GET", destino.path.rstrip('/') + "/metrics")
+        respuesta = conexion.getresponse()
+        if respuesta.status != 200:
+            return {}, {}
+        texto = respuesta.read().decode('utf-8')
+    except (OSError, http.client.HTTPException):
+        return {}, {}
+    finally:
+        conexion.close()
+
+    etapas = {}
+    contadores = {}
+    for linea in texto.splitlines():
+        coincidencia = _ETAPA_RE.match(linea)
+        if coincidencia:
+            tipo, etapa, valor = coincidencia.groups()
+            suma, conteo = etapas.get(etapa, (0.0, 0))
+            etapas[etapa] = (float(valor), conteo) if tipo == "sum" else (suma, int(float(valor)))
+            continue
+        coincidencia = _CONTADOR_RE.match(linea)
+        if coincidencia:
+            resultado, cliente, evento, valor = coincidencia.groups()
+            nombre = f"requests {resultado}" if resultado else f"{cliente} {evento}"
+            contadores[nombre] = int(float(valor))
+    return etapas, contadores
+
+
+def guiones_de_carga(args):
+    """Lista de guiones: cada guion es la secuencia de mensajes de un visitante."""
+    if not args.replay:
+        return [[mensaje] for mensaje in MENSAJES_CARGA]
+    guiones = []
+    for historial in cargar_conversaciones():
+        mensajes = [m['parts'][0] for m in historial if m.get('role') == 'user']
+        if mensajes:
+            guiones.append(mensajes)
+    return guiones or [[mensaje] for mensaje in MENSAJES_CARGA]
+
+
+def entorno_local(temporal):
+    """Variables para correr la app con el stub de Gemini y datos en un directorio temporal."""
+    return {
+        "FAKE_GEMINI": "1",
+        "SESSIONS_DIR": os.path.join(temporal, "sessions"),
+        "SESSIONS_ARCHIVE_DIR": os.path.join(temporal, "archive"),
+        "SESSION_DB_PATH": os.path.join(temporal, "sessions.db"),
+        "TRANSLATION_CACHE_PATH": os.path.join(temporal, "translation_cache.json"),
+        "SESSION_JANITOR_INTERVAL": "0",
+        "CATALOG_WATCH_INTERVAL": "0",
+        # Toda la carga sale de 127.0.0.1: los límites por IP y por sesión medirían el limitador, no la app
+        "CHAT_IP_RATE_PER_MIN": os.getenv("CHAT_IP_RATE_PER_MIN", "0"),
+        "CHAT_SESSION_RATE_PER_MIN": os.getenv("CHAT_SESSION_RATE_PER_MIN", "0"),
+    }
+
+
+def iniciar_servidor_local(args):
+    """Levanta la app en este proceso con el stub de Gemini y sesiones temporales. Devuelve la URL."""
+    temporal = tempfile.mkdtemp(prefix="incalake_bench_")
+    os.environ.update(entorno_local(temporal))
+    os.environ.update({
+        "FAKE_GEMINI_CHUNKS": str(args.chunks),
+        "FAKE_GEMINI_CHUNK_SIZE": str(args.tamano_chunk),
+        "FAKE_GEMINI_CHUNK_LATENCY_MS": str(args.latencia_chunk_ms),
+        "FAKE_GEMINI_TTFB_MS": str(args.ttfb_ms),
+        "FAKE_GEMINI_TRANSLATION_MS": str(args.traduccion_ms),
+        "FAKE_GEMINI_ERROR_RATE": str(args.fallos),
+        "FAKE_GEMINI_SLOW_RATE": str(args.lentos),
+        "FAKE_GEMINI_SLOW_MS": str(args.lento_ms),
+        "GEMINI_HEDGE_MS": str(args.cobertura_ms),
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import app
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    servidor = make_server("127.0.0.1", 0, app.create_app(), threaded=True)
+    threading.Thread(target=servidor.serve_forever, name="bench-server", daemon=True).start()
+    print(f"🧪 Servidor local con FAKE_GEMINI en el puerto {servidor.server_port} (datos en {temporal})")
+    return f"http://127.0.0.1:{servidor.server_port}"
+
+
+def benchmark_servidor(args):
+    url = iniciar_servidor_local(args) if args.local else args.url
+    guiones = guiones_de_carga(args)
+    resultados = []
+    errores = 0
+    lock = threading.Lock()
+
+    def trabajo(i):
+        """Un visitante: recorre su guion en orden sobre la misma sesión."""
+        nonlocal errores
+        session_id = f"bench_{uuid.uuid4().hex[:12]}"
+        for mensaje in guiones[i % len(guiones)]:
+            try:
+                resultado = enviar_mensaje(url, mensaje, session_id)
+            except (OSError, http.client.HTTPException) as e:
+                with lock:
+                    errores += 1
+                print(f"❌ Petición del visitante {i} falló: {e}")
+                return
+            with lock:
+                resultados.append(resultado)
+
+    etapas_antes, contadores_antes = leer_metricas(url)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        list(pool.map(trabajo, range(args.visitantes if args.replay else args.peticiones)))
+    duracion = time.perf_counter() - inicio
+    etapas_despues, contadores_despues = leer_metricas(url)
+
+    ok = [r for r in resultados if r[0] == 200]
+    modo = f"{len(guiones)} conversaciones reproducidas" if args.replay else "mensajes sueltos"
+    print(f"\n🚀 {url}: {len(resultados) + errores} peticiones ({modo}), concurrencia {args.concurrencia}")
+    print(f"  completadas={len(ok)}  no-200={len(resultados) - len(ok)}  errores={errores}")
+    print(f"  throughput={len(ok) / duracion:.1f} req/s  duración total={duracion:.1f}s")
+    if ok:
+        imprimir_latencias("TTFB", [r[1] * 1000 for r in ok], "ms")
+        imprimir_latencias("stream completo", [r[2] * 1000 for r in ok], "ms")
+        print(f"  bytes/respuesta media={statistics.mean(r[3] for r in ok):.0f}")
+
+    if etapas_despues:
+        print("\n⏱️ Costo medio por etapa (según /metrics del servidor)")
+        for etapa, (suma, conteo) in sorted(etapas_despues.items()):
+            suma_antes, conteo_antes = etapas_antes.get(etapa, (0.0, 0))
+            if conteo > conteo_antes:
+                print(f"  {etapa:<22} {(suma - suma_antes) / (conteo - conteo_antes) * 1000:9.3f} ms  (n={conteo - conteo_antes})")
+    diferencias = {
+        nombre: valor - contadores_antes.get(nombre, 0)
+        for nombre, valor in sorted(contadores_despues.items())
+        if valor > contadores_antes.get(nombre, 0)
+    }
+    if diferencias:
+        print("\n🔌 Resultados y llamadas a Gemini (según /metrics)")
+        for nombre, valor in diferencias.items():
+            print(f"  {nombre:<24} {valor}")
+
+
+# === Benchmark de resiliencia frente a Gemini ===
+ESCENARIOS_RESILIENCIA = [
+    # (nombre, tasa de fallos, tasa de llamadas lentas)
+    ("sano", 0.0, 0.0),
+    ("20% de errores 503", 0.2, 0.0),
+    ("5% de llamadas lentas", 0.0, 0.05),
+    ("caída total", 1.0, 0.0),
+    ("recuperación", 0.0, 0.0),
+    ("después de recuperar", 0.0, 0.0),
+]
+
+
+def benchmark_resiliencia(args):
+    from cliente_gemini import Circuito, ClienteGemini
+    from fake_gemini import FakeGeminiModel
+
+    logging.getLogger("incalake").setLevel(logging.ERROR)
+    configuraciones = [("sin hedging", 0.0)]
+    if args.cobertura_ms:
+        configuraciones.append((f"hedging a {args.cobertura_ms:.0f} ms", args.cobertura_ms / 1000))
+
+    for etiqueta, cobertura in configuraciones:
+        modelo = FakeGeminiModel(n_chunks=5, tamano_chunk=40, latencia_chunk_ms=5, latencia_inicial_ms=args.ttfb_ms,
+                                 latencia_lenta_ms=args.lento_ms, semilla=7)
+        cliente = ClienteGemini(
+            lambda clave: modelo,
+            Circuito(tasa_fallos=args.tasa_circuito, ventana=args.ventana, espera_segundos=args.espera_circuito),
+            nombre='bench',
+            plazo_primer_chunk=args.plazo_primer_chunk_ms / 1000,
+            plazo_total=30,
+            reintentos=args.reintentos,
+            cobertura_segundos=cobertura,
+        )
+
+        def peticion(_):
+            """Una respuesta: (ttfb_ms, servida_por_gemini)."""
+            inicio = time.perf_counter()
+            try:
+                for _texto in cliente.generar_stream('es', []):
+                    return (time.perf_counter() - inicio) * 1000, True
+            except Exception:
+                pass
+            return (time.perf_counter() - inicio) * 1000, False
+
+        print(f"\n🛡️ Cliente de Gemini {etiqueta}: {args.peticiones} peticiones por escenario, "
+              f"concurrencia {args.concurrencia}, TTFB {args.ttfb_ms:.0f} ms (lentas {args.lento_ms:.0f} ms)")
+        for nombre, tasa_fallos, tasa_lentos in ESCENARIOS_RESILIENCIA:
+            modelo.tasa_fallos, modelo.tasa_lentos = tasa_fallos, tasa_lentos
+            eventos_antes = cliente.estadisticas()["events"]
+            with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+                resultados = list(pool.map(peticion, range(args.peticiones)))
+            eventos = {
+                evento: valor - eventos_antes.get(evento, 0)
+                for evento, valor in cliente.estadisticas()["events"].items()
+                if valor > eventos_antes.get(evento, 0)
+            }
+            servidas = sum(1 for _, ok in resultados if ok)
+            print(f"  {nombre:<24} gemini={servidas:4d} respaldo={len(resultados) - servidas:4d} "
+                  f"circuito={cliente.circuito.estado:<9} eventos={eventos}")
+            imprimir_latencias("TTFB o respaldo", [ttfb for ttfb, _ in resultados], "ms")
+            if nombre == "caída total":
+                # Deja pasar la espera del circuito para que la recuperación empiece con una sonda
+                time.sleep(args.espera_circuito)
+
+
+# === Benchmark de arranque y memoria por worker ===
+def consultar_health(url, timeout=2):
+    """GET /health; devuelve el JSON o None si el servidor aún no responde."""
+    destino = urlparse(url)
+    conexion = http.client.HTTPConnection(destino.hostname, destino.port, timeout=timeout)
+    try:
+        conexion.request("GET", "/health")
+        respuesta = conexion.getresponse()
+        return json.loads(respuesta.read()) if respuesta.status == 200 else None
+    except (OSError, http.client.HTTPException, ValueError):
+        return None
+    finally:
+        conexion.close()
+
+
+def hijos_de(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(hijo) for hijo in f.read().split()]
+    except OSError:
+        return []
+
+
+def medir_gunicorn(args, precarga, puerto):
+    """Levanta gunicorn, espera a todos los workers, envía tráfico y mide la memoria de cada proceso."""
+    from instrumentacion import memoria_proceso
+
+    temporal = tempfile.mkdtemp(prefix="incalake_arranque_")
+    entorno = {**os.environ, **entorno_local(temporal), "LOG_LEVEL": "WARNING",
+               "FAKE_GEMINI_TTFB_MS": "5", "FAKE_GEMINI_CHUNK_LATENCY_MS": "1"}
+    if args.tours:
+        entorno["TOURS_PATH"] = os.path.abspath(args.tours)
+    comando = [
+        sys.executable, "-m", "gunicorn",
+        "-c", os.path.join(basedir, "gunicorn.conf.py") if precarga else "/dev/null",
+        "-w", str(args.workers), "-k", "gthread", "--threads", "4",
+        "-b", f"127.0.0.1:{puerto}", "app:create_app()",
+    ]
+    url = f"http://127.0.0.1:{puerto}"
+    inicio = time.perf_counter()
+    master = subprocess.Popen(comando, cwd=basedir, env=entorno,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Listo cuando cada worker respondió al menos un /health
+        pids = {}
+        while len(pids) < args.workers and time.perf_counter() - inicio < 60:
+            salud = consultar_health(url)
+            if salud:
+                pids.setdefault(salud["process"]["pid"], salud["process"]["startup"])
+            else:
+                time.sleep(0.02)
+        listo_ms = (time.perf_counter() - inicio) * 1000
+
+        guiones = [mensaje for historial in cargar_conversaciones() for mensaje in
+                   (m['parts'][0] for m in historial if m.get('role') == 'user')] or MENSAJES_CARGA
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            list(pool.map(lambda i: enviar_mensaje(url, guiones[i % len(guiones)], f"arranque_{i}"),
+                          range(args.peticiones)))
+
+        memoria_workers = [memoria_proceso(pid) for pid in hijos_de(master.pid)]
+        return {
+            "listo_ms": listo_ms,
+            "workers_listos": len(pids),
+            "arranque_worker": list(pids.values()),
+            "master": memoria_proceso(master.pid),
+            "workers": [m for m in memoria_workers if m],
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        try:
+            master.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            master.kill()
+
+
+def benchmark_arranque(args):
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print("❌ gunicorn no está instalado: pip install gunicorn")
+        return
+
+    print(f"\n🧊 gunicorn con {args.workers} workers gthread, {args.peticiones} peticiones /chat con el stub de Gemini"
+          f" ({os.path.basename(args.tours or os.getenv('TOURS_PATH', 'tours_ingles.json'))})")
+    for nombre, precarga, puerto in (("sin precarga", False, args.puerto), ("precarga en el master", True, args.puerto + 1)):
+        resultado = medir_gunicorn(args, precarga, puerto)
+        workers = resultado["workers"]
+        if not workers:
+            print(f"  {nombre}: no se pudo leer la memoria de los workers (se requiere Linux)")
+            continue
+        fases = resultado["arranque_worker"]
+        create_app_ms = statistics.mean(f.get("create_app_ms", 0) for f in fases)
+        precarga_worker_ms = statistics.mean(
+            0 if f.get("preloaded_in_master") else f.get("preload_ms", 0) + f.get("import_ms", 0) for f in fases
+        )
+        pss_total = sum(w["pss_kb"] for w in workers) + resultado["master"].get("pss_kb", 0)
+        print(f"\n  {nombre}")
+        print(f"    todos los workers listos en {resultado['listo_ms']:.0f} ms ({resultado['workers_listos']}/{args.workers}); "
+              f"por worker: import+catálogo {precarga_worker_ms:.0f} ms, create_app {create_app_ms:.1f} ms")
+        print(f"    worker RSS={statistics.mean(w['rss_kb'] for w in workers) / 1024:6.1f} MB  "
+              f"PSS={statistics.mean(w['pss_kb'] for w in workers) / 1024:6.1f} MB  "
+              f"privada={statistics.mean(w['private_kb'] for w in workers) / 1024:6.1f} MB")
+        print(f"    master RSS={resultado['master'].get('rss_kb', 0) / 1024:6.1f} MB   "
+              f"PSS total (master + workers)={pss_total / 1024:6.1f} MB")
+
+
+# === Benchmark de la salida SSE ===
+# Por escritura: cabecera de chunk HTTP/1.1 ("1a2\r\n" + "\r\n") y cabeceras TCP/IP de su segmento
+BYTES_CHUNKED = 7
+BYTES_TCP_IP = 40
+
+
+def llegadas_simuladas(args, azar):
+    """Fragmentos de una respuesta del stub con su instante de llegada (s): intervalos exponenciales."""
+    from fake_gemini import FakeGeminiModel
+
+    modelo = FakeGeminiModel(n_chunks=args.chunks, tamano_chunk=args.tamano_chunk,
+                             latencia_chunk_ms=0, latencia_inicial_ms=0)
+    instante = 0.0
+    llegadas = []
+    for chunk in modelo.generate_content(None, stream=True):
+        llegadas.append((instante, chunk.text))
+        instante += azar.expovariate(1000 / args.latencia_chunk_ms)
+    return llegadas
+
+
+def simular_sse(llegadas, agrupador):
+    """Envíos de la etapa asíncrona: (instante, texto, retención máxima en s) por evento."""
+    envios = []
+    retenidos = []
+    anterior = None
+    for instante, texto in llegadas:
+        espera = agrupador.espera(anterior) if anterior is not None else None
+        if espera is not None and anterior + espera < instante:
+            # El temporizador vence antes de que llegue este fragmento: se envía lo retenido
+            vencimiento = anterior + espera
+            envios.append((vencimiento, agrupador.vaciar(vencimiento), vencimiento - retenidos[0]))
+            retenidos = []
+        retenidos.append(instante)
+        listo = agrupador.agregar(texto, instante)
+        if listo:
+            envios.append((instante, listo, instante - retenidos[0]))
+            retenidos = []
+        anterior = instante
+    resto = agrupador.vaciar(anterior)
+    if resto:
+        envios.append((anterior, resto, anterior - retenidos[0]))
+    return envios
+
+
+def benchmark_sse(args):
+    import sse
+
+    azar = random.Random(7)
+    respuestas = [llegadas_simuladas(args, azar) for _ in range(args.respuestas)]
+    codificaciones = [None, 'gzip'] + (['br'] if sse.brotli is not None else [])
+
+    print(f"\n📡 Salida de /chat: {args.respuestas} respuestas de {args.chunks} fragmentos de "
+          f"{args.tamano_chunk} caracteres, cada ~{args.latencia_chunk_ms:.0f} ms")
+    print(f"  agrupación: {args.max_bytes} bytes o {args.ventana_ms:.0f} ms"
+          + ("" if sse.brotli is not None else " (br no disponible: falta el paquete brotli)"))
+
+    def resumir(nombre, escrituras, carga, retenciones=None):
+        cable = carga + escrituras * (BYTES_CHUNKED + BYTES_TCP_IP)
+        linea = (f"  {nombre:<22} escrituras/resp={escrituras / args.respuestas:6.1f} "
+                 f"bytes/resp={carga / args.respuestas:8.0f} en el cable≈{cable / args.respuestas:8.0f}")
+        if retenciones:
+            linea += (f" retención p50={percentil(retenciones, 50) * 1000:.1f} ms "
+                      f"max={max(retenciones) * 1000:.1f} ms")
+        print(linea)
+
+    # Antes: un write por fragmento de Gemini, texto plano sin eventos ni fin explícito
+    resumir("anterior (texto plano)", sum(len(llegadas) for llegadas in respuestas),
+            sum(len(texto.encode('utf-8')) for llegadas in respuestas for _, texto in llegadas))
+
+    for codificacion in codificaciones:
+        escrituras = carga = 0
+        retenciones = []
+        for llegadas in respuestas:
+            transmision = sse.Transmision(uuid.uuid4().hex[:16])
+            compresor = sse.Compresor(codificacion)
+            envios = simular_sse(llegadas, sse.Agrupador(args.max_bytes, args.ventana_ms / 1000))
+            for _, texto, retencion in envios:
+                carga += len(compresor.comprimir(transmision.publicar(texto)))
+                escrituras += 1
+                retenciones.append(retencion)
+            # El evento done y la cola del compresor salen en la misma escritura
+            carga += len(compresor.comprimir(transmision.publicar("done", evento='done')) + compresor.cerrar())
+            escrituras += 1
+        resumir(f"SSE {codificacion or 'identity'}", escrituras, carga, retenciones)
+
+
+# === Micro-benchmarks del pipeline ===
+def benchmark_micro(args):
+    import app
+    from sesiones import FileSessionStore, SQLiteSessionStore
+    from traduccion import CacheTraducciones, TraductorKeywords
+
+    catalogo = app.precargar().actual
+    traductor = TraductorKeywords(catalogo.lexico, CacheTraducciones(None))
+    consultas = [
+        traductor.traducir(app.obtener_keywords_contextuales(historial, pregunta, 'es'))
+        for historial, pregunta, _ in extraer_consultas(cargar_conversaciones())
+    ] or [['puno', 'uros'], ['colca', 'canyon'], ['machu', 'picchu']]
+
+    print(f"\n🔬 Micro-benchmarks ({len(consultas)} consultas, {args.repeticiones} repeticiones)")
+    duraciones = []
+    tours_por_consulta = []
+    for keywords in consultas:
+        duraciones.extend(medir(lambda: app.buscar_tours_relevantes(keywords, catalogo=catalogo), args.repeticiones))
+        tours_por_consulta.append(app.buscar_tours_relevantes(keywords, catalogo=catalogo))
+    imprimir_latencias("buscar_tours_relevantes", duraciones)
+
+    duraciones = []
+    for tours in tours_por_consulta:
+        duraciones.extend(medir(lambda: app.formatear_contexto_detallado(tours, 'es'), args.repeticiones))
+    imprimir_latencias("formatear_contexto_detallado", duraciones)
+
+    # Consultas con grupo/presupuesto/duración: filtros antes del ranking vs. solo keywords
+    from filtros_tours import extraer_filtros
+    from presupuesto_prompt import estimar_tokens
+
+    duraciones = []
+    tokens_sin, tokens_con = [], []
+    for pregunta in CONSULTAS_FILTROS:
+        keywords = traductor.traducir(app.obtener_keywords_contextuales([], pregunta, 'es'))
+        duraciones.extend(medir(
+            lambda: catalogo.filtros.candidatos(extraer_filtros(pregunta), catalogo.facetas), args.repeticiones
+        ))
+        candidatos, filtros = catalogo.filtros.candidatos(extraer_filtros(pregunta), catalogo.facetas)
+        sin_filtros = app.buscar_tours_relevantes(keywords, catalogo=catalogo)
+        con_filtros = app.buscar_tours_relevantes(keywords, catalogo=catalogo, candidatos=candidatos)
+        tokens_sin.append(estimar_tokens(app.formatear_contexto_detallado(sin_filtros, 'es')))
+        tokens_con.append(estimar_tokens(app.formatear_contexto_detallado(con_filtros, 'es', filtros, catalogo)))
+    imprimir_latencias("extraer + resolver filtros", duraciones)
+    print(f"  contexto de tours para {len(CONSULTAS_FILTROS)} consultas con grupo/presupuesto/duración: "
+          f"~{statistics.mean(tokens_sin):.0f} tokens solo con keywords, ~{statistics.mean(tokens_con):.0f} con filtros")
+
+    turno = [
+        {"role": "user", "parts": ["tour a las islas uros y taquile para 4 personas"]},
+        {"role": "model", "parts": [TEXTO_RESPUESTA_MICRO]},
+    ]
+    with tempfile.TemporaryDirectory(prefix="incalake_micro_") as temporal:
+        almacenes = {
+            "file": lambda cache: FileSessionStore(os.path.join(temporal, f"file_{cache}"), max_cache=cache),
+            "sqlite": lambda cache: SQLiteSessionStore(os.path.join(temporal, f"sqlite_{cache}.db"), max_cache=cache),
+        }
+        for nombre, crear in almacenes.items():
+            for cache in (0, 1000):
+                store = crear(cache)
+                ids = [f"micro_{i}" for i in range(args.sesiones)]
+                escritura = []
+                for session_id in ids:
+                    escritura.extend(medir(lambda: store.agregar_turno(session_id, turno, max_mensajes=10), 5))
+                lectura = []
+                for session_id in ids:
+                    lectura.extend(medir(lambda: store.cargar(session_id), 5))
+                etiqueta = "sin caché" if cache == 0 else "con caché"
+                imprimir_latencias(f"{nombre} agregar_turno ({etiqueta})", escritura)
+                imprimir_latencias(f"{nombre} cargar ({etiqueta})", lectura)
+                store.cerrar()
+
+
+CONSULTAS_FILTROS = [
+    "tour para 4 personas por menos de 100 dólares",
+    "uros y taquile para 6 personas",
+    "tour de 2 días en Cusco",
+    "medio día en Puno para 2 personas",
+    "colca 2 días para 3, presupuesto 150 por persona",
+    "tour privado para 10 personas en Puno",
+    "somos una pareja, máximo $60",
+    "3 días en Uyuni para 2",
+]
+
+TEXTO_RESPUESTA_MICRO = (
+    "¡Perfecto! 🌊 Te recomiendo nuestro tour a las Islas Flotantes de los Uros y Taquile. "
+    "Precios por persona desde $35 USD. [Ver más información](https://incalake.com/en/puno/uros-floating-islands-tour) "
+) * 8
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del chatbot de IncaLake")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_ranking = sub.add_parser("ranking", help="Relevancia y latencia de los motores de ranking")
+    p_ranking.add_argument("--repeticiones", type=int, default=200)
+    p_ranking.add_argument("--k", type=int, default=3)
+    p_ranking.set_defaults(funcion=benchmark_ranking)
+
+    p_intenciones = sub.add_parser("intenciones", help="Costo por mensaje de la detección de intención")
+    p_intenciones.add_argument("--repeticiones", type=int, default=200)
+    p_intenciones.set_defaults(funcion=benchmark_intenciones)
+
+    p_servidor = sub.add_parser("servidor", help="Carga concurrente contra /chat")
+    p_servidor.add_argument("--url", default="http://127.0.0.1:5000")
+    p_servidor.add_argument("--concurrencia", type=int, default=50)
+    p_servidor.add_argument("--peticiones", type=int, default=500)
+    p_servidor.add_argument("--replay", action="store_true",
+                            help="Reproducir las conversaciones de chat_sessions/ en lugar de mensajes sueltos")
+    p_servidor.add_argument("--visitantes", type=int, default=100, help="Conversaciones a reproducir con --replay")
+    p_servidor.add_argument("--local", action="store_true",
+                            help="Levantar la app en este proceso con el stub de Gemini (ignora --url)")
+    p_servidor.add_argument("--chunks", type=int, default=20)
+    p_servidor.add_argument("--tamano-chunk", type=int, default=40)
+    p_servidor.add_argument("--latencia-chunk-ms", type=float, default=20)
+    p_servidor.add_argument("--ttfb-ms", type=float, default=300)
+    p_servidor.add_argument("--traduccion-ms", type=float, default=0,
+                            help="Latencia de la traducción remota simulada")
+    p_servidor.add_argument("--fallos", type=float, default=0, help="Fracción de llamadas a Gemini que fallan (503)")
+    p_servidor.add_argument("--lentos", type=float, default=0, help="Fracción de llamadas con primer chunk lento")
+    p_servidor.add_argument("--lento-ms", type=float, default=5000)
+    p_servidor.add_argument("--cobertura-ms", type=float, default=0,
+                            help="Lanzar una segunda llamada si el primer chunk tarda más (0 = sin hedging)")
+    p_servidor.set_defaults(funcion=benchmark_servidor)
+
+    p_arranque = sub.add_parser("arranque", help="Tiempo de arranque y memoria por worker con y sin precarga")
+    p_arranque.add_argument("--workers", type=int, default=4)
+    p_arranque.add_argument("--peticiones", type=int, default=200)
+    p_arranque.add_argument("--puerto", type=int, default=18700)
+    p_arranque.add_argument("--tours", help="Catálogo a cargar (JSON o binario); por defecto TOURS_PATH")
+    p_arranque.set_defaults(funcion=benchmark_arranque)
+
+    p_resiliencia = sub.add_parser("resiliencia", help="Reintentos, hedging y circuito frente a fallos inyectados")
+    p_resiliencia.add_argument("--peticiones", type=int, default=200)
+    p_resiliencia.add_argument("--concurrencia", type=int, default=20)
+    p_resiliencia.add_argument("--ttfb-ms", type=float, default=100)
+    p_resiliencia.add_argument("--lento-ms", type=float, default=3000)
+    p_resiliencia.add_argument("--plazo-primer-chunk-ms", type=float, default=2000)
+    p_resiliencia.add_argument("--reintentos", type=int, default=2)
+    p_resiliencia.add_argument("--tasa-circuito", type=float, default=0.5, help="Tasa de fallos que abre el circuito")
+    p_resiliencia.add_argument("--ventana", type=int, default=50, help="Llamadas recientes que mira el circuito")
+    p_resiliencia.add_argument("--espera-circuito", type=float, default=1.0)
+    p_resiliencia.add_argument("--cobertura-ms", type=float, default=400)
+    p_resiliencia.set_defaults(funcion=benchmark_resiliencia)
+
+    p_sse = sub.add_parser("sse", help="Escrituras y bytes de /chat: texto plano frente a eventos SSE agrupados")
+    p_sse.add_argument("--respuestas", type=int, default=200)
+    p_sse.add_argument("--chunks", type=int, default=60)
+    p_sse.add_argument("--tamano-chunk", type=int, default=12)
+    p_sse.add_argument("--latencia-chunk-ms", type=float, default=15)
+    p_sse.add_argument("--max-bytes", type=int, default=512)
+    p_sse.add_argument("--ventana-ms", type=float, default=50)
+    p_sse.set_defaults(funcion=benchmark_sse)
+
+    p_micro = sub.add_parser("micro", help="Micro-benchmarks de búsqueda, formateo de contexto y E/S de sesiones")
+    p_micro.add_argument("--repeticiones", type=int, default=200)
+    p_micro.add_argument("--sesiones", type=int, default=200)
+    p_micro.set_defaults(funcion=benchmark_micro)
+
+    args = parser.parse_args()
+    args.funcion(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalizar_pregunta(pregunta, stopwords=()):
+    """Normaliza una pregunta para usarla como clave de caché.
+
+    Minúsculas, sin tildes, sin puntuación ni emojis, sin stopwords y con los
+    términos ordenados: "¿Tours en Puno?" y "puno tours" comparten clave.
+    """
+    texto = unicodedata.normalize('NFKD', pregunta.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    terminos = {t for t in _TOKEN_RE.findall(texto) if t not in stopwords}
+    return ' '.join(sorted(terminos))
+
+
+class CacheRespuestas:
+    """Caché LRU con TTL de respuestas completas de Gemini.
+
+    Guarda la respuesta como la lista de chunks recibidos para poder
+    reproducirla por el mismo stream que una respuesta en vivo. Las entradas
+    expiradas no se borran al consultarlas: quedan hasta que el LRU las desaloje
+    por si hay que servirlas como respaldo mientras Gemini no responde.
+    """
+
+    def __init__(self, max_entradas=500, ttl_segundos=6 * 3600):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._entradas = OrderedDict()  # clave -> (chunks, expira_en)
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.guardadas = 0
+        self.desalojadas = 0
+        self.respaldos = 0
+
+    @staticmethod
+    def clave(language, intencion, pregunta_normalizada, tour_ids, version_catalogo, filtros=""):
+        """Clave estable a partir de todo lo que determina el prompt de un primer turno."""
+        partes = [language, intencion, pregunta_normalizada, ','.join(map(str, tour_ids)), version_catalogo, filtros]
+        return hashlib.sha1('\x1f'.join(partes).encode('utf-8')).hexdigest()
+
+    def obtener(self, clave):
+        """Devuelve los chunks guardados o None."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[1] < time.time():
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def obtener_respaldo(self, clave):
+        """Devuelve los chunks guardados aunque hayan expirado, o None."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            self.respaldos += 1
+            return entrada[0]
+
+    def guardar(self, clave, chunks):
+        with self._lock:
+            self._entradas[clave] = (tuple(chunks), time.time() + self.ttl_segundos)
+            self._entradas.move_to_end(clave)
+            self.guardadas += 1
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.desalojadas += 1
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "hits": self.aciertos,
+                "misses": self.fallos,
+                "stores": self.guardadas,
+                "evictions": self.desalojadas,
+                "stale_served": self.respaldos,
+                "size": len(self._entradas),
+                "hit_rate": round(self.aciertos / consultas, 3) if consultas else None,
+            }
@@ -0,0 +1,154 @@
+import json
+from array import array
+from dataclasses import dataclass
+
+# Palabras que identifican a Puno/Titicaca, nuestra especialidad
+PUNO_KEYWORDS = ['puno', 'titicaca', 'uros', 'taquile', 'amantani']
+
+LONGITUD_ITINERARIO = 150
+
+# Texto del enlace que Gemini debe usar según el idioma de la conversación
+ETIQUETAS_ENLACE = {
+    'es': "Ver más información",
+    'en': "More information",
+    'pt': "Mais informações",
+    'fr': "Plus d'informations",
+    'de': "Weitere Informationen",
+}
+
+
+@dataclass(frozen=True, slots=True)
+class TourRecord:
+    """Tour compilado una sola vez al cargar el catálogo."""
+    id: int
+    titulo: str
+    tipo_servicio: str
+    descripcion: str
+    itinerario_breve: str
+    incluye: str
+    url: str
+    prioridad: int
+    es_puno: bool
+    # Tramos de precio por persona: para desde[i]..hasta[i] personas se cobra precio[i]
+    precios_desde: array
+    precios_hasta: array
+    precios: array
+    # Bloque de contexto para el prompt por idioma (ContextoTour)
+    contexto: dict
+
+
+def prioridad_numerica(valor):
+    """Convierte la prioridad del catálogo (a veces string) a entero 1-5."""
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return 5
+
+
+def _parsear_precios(precios_rango):
+    """Convierte el string JSON de precios_rango en arreglos numéricos."""
+    desde, hasta, precios = array('i'), array('i'), array('d')
+    try:
+        datos = json.loads(precios_rango or "{}")
+        if datos and all(k in datos for k in ["desde", "hasta", "precio"]):
+            for d, h, p in zip(datos["desde"], datos["hasta"], datos["precio"]):
+                desde.append(int(d))
+                hasta.append(int(h))
+                precios.append(float(p))
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return array('i'), array('i'), array('d')
+    return desde, hasta, precios
+
+
+def formatear_precio(precio):
+    """Formatea un precio en USD como en el catálogo: '79' o '35.90'."""
+    return str(int(precio)) if precio.is_integer() else f"{precio:.2f}"
+
+
+def renderizar_contexto(titulo, descripcion, itinerario_breve, url, prioridad, es_puno,
+                        precios_desde, precios_hasta, precios, language, linea_precios=None):
+    """Renderiza el bloque 'Relevant Tour Information' de un tour para un idioma.
+
+    `linea_precios` reemplaza la tabla de tramos (p. ej. por el precio exacto de un grupo).
+    """
+    precios_formateados = linea_precios or "Price on request."
+    if len(precios) and not linea_precios:
+        precios_formateados = " | ".join(
+            f"For {d}-{h} people: ${formatear_precio(p)} USD"
+            for d, h, p in zip(precios_desde, precios_hasta, precios)
+        )
+
+    especialidad_nota = " ⭐ (NUESTRA ESPECIALIDAD)" if es_puno else ""
+    etiqueta = ETIQUETAS_ENLACE.get(language)
+    if etiqueta:
+        nota_url = f"IMPORTANT: Make URL clickable as: [{etiqueta}]({url})"
+    else:
+        nota_url = f"IMPORTANT: Make URL clickable as: [Ver más información]({url}) (Spanish) or [More information]({url}) (English)"
+
+    return (
+        f"\n🎯 Tour: {titulo}{especialidad_nota}\n"
+        f"Priority: {prioridad}/5 (1=highest priority)\n"
+        f"Description: {descripcion}\n"
+        f"Brief Itinerary: {itinerario_breve}\n"
+        f"Prices per person: {precios_formateados}\n"
+        f"Booking URL: {url}\n"
+        f"{nota_url}"
+    )
+
+
+class ContextoTour(dict):
+    """Bloque 'Relevant Tour Information' por idioma, renderizado y guardado al pedirlo."""
+
+    def __init__(self, tour):
+        super().__init__()
+        self.tour = tour
+
+    def __missing__(self, language):
+        tour = self.tour
+        self[language] = renderizar_contexto(
+            tour.titulo, tour.descripcion, tour.itinerario_breve, tour.url, tour.prioridad, tour.es_puno,
+            tour.precios_desde, tour.precios_hasta, tour.precios, language
+        )
+        return self[language]
+
+
+def compilar_tour(doc_id, tour, languages):
+    """Compila un tour del JSON en un TourRecord inmutable.
+
+    El contexto de `languages` se renderiza aquí; el de otros idiomas, con su primer uso.
+    """
+    titulo = tour.get("titulo_producto", "No title")
+    descripcion = tour.get("descripcion_tab", "No description")
+    itinerario = tour.get("itinerario_ta", "No itinerary provided.")
+    itinerario_breve = f"{itinerario[:LONGITUD_ITINERARIO]}{'...' if len(itinerario) > LONGITUD_ITINERARIO else ''}"
+    url = tour.get("url_servicio", "")
+    prioridad = prioridad_numerica(tour.get("prioridad", 5))
+    texto_puno = (titulo + " " + tour.get("tipo_servicio", "") + " " + descripcion).lower()
+    es_puno = any(keyword in texto_puno for keyword in PUNO_KEYWORDS)
+    precios_desde, precios_hasta, precios = _parsear_precios(tour.get("precios_rango"))
+
+    contexto = ContextoTour(None)
+    record = TourRecord(
+        id=doc_id,
+        titulo=titulo,
+        tipo_servicio=tour.get("tipo_servicio", ""),
+        descripcion=descripcion,
+        itinerario_breve=itinerario_breve,
+        incluye=tour.get("incluye_tab", ""),
+        url=url,
+        prioridad=prioridad,
+        es_puno=es_puno,
+        precios_desde=precios_desde,
+        precios_hasta=precios_hasta,
+        precios=precios,
+        contexto=contexto,
+    )
+    contexto.tour = record
+    for language in languages:
+        contexto[language]
+    return record
+
+
+def compilar_catalogo(tours_data, languages):
+    """Compila la lista de dicts del JSON en una tupla de TourRecord."""
+    return tuple(compilar_tour(doc_id, tour, languages) for doc_id, tour in enumerate(tours_data))
@@ -0,0 +1,477 @@
+"""Formato binario compacto del catálogo, leído con mmap.
+
+El JSON de tours guarda números como strings y los precios como un JSON
+anidado; parsearlo, compilarlo y tokenizarlo en cada proceso cuesta tiempo y
+memoria privada. `compilar` hace ese trabajo una sola vez, en el build:
+
+    python catalogo_binario.py compilar tours_ingles.json tours_ingles.incat
+    python catalogo_binario.py verificar tours_ingles.json tours_ingles.incat
+    python catalogo_binario.py compilar tours_pt.json tours_pt.incat --tokenizador plegado
+
+y deja un archivo con secciones alineadas:
+
+- tabla de strings (offsets uint32 + bytes UTF-8, sin duplicados)
+- columnas por tour: ids de string de cada campo, prioridad, Puno, longitud
+- tramos de precio: offsets por tour + desde/hasta int32 + precio float64
+- postings: términos ordenados, offsets y columnas doc_id / tf cuerpo / tf título
+- léxico: término normalizado (sin tildes) -> término, ordenado para búsqueda binaria
+
+Las columnas de ids y frecuencias usan el entero sin signo más angosto que
+cabe (uint8/16/32); su tipo queda en la sección de metadata.
+
+En ejecución (`abrir_catalogo_binario`, o TOURS_PATH apuntando al .incat) el
+archivo se mapea en memoria y cada campo se lee al pedirlo, así que abrirlo
+es casi instantáneo y las páginas son del page cache, compartidas entre
+workers. El archivo se reemplaza con os.replace: los mapeos abiertos siguen
+viendo la versión anterior hasta que se publique la nueva.
+"""
+import argparse
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections.abc import Mapping
+
+from catalogo import ContextoTour, compilar_catalogo
+
+MAGIA = b"INCATLG1"
+VERSION_FORMATO = 1
+_CABECERA = struct.Struct("<8sII")     # magia, versión del formato, número de secciones
+_SECCION = struct.Struct("<8sQQ")      # nombre, offset, longitud
+ALINEACION = 8
+
+# Orden de los ids de string en la columna "campos" de cada tour
+CAMPOS = ('titulo', 'tipo_servicio', 'descripcion', 'itinerario_breve', 'incluye', 'url')
+
+
+class FormatoCatalogoInvalido(ValueError):
+    """El archivo no es un catálogo binario válido para esta versión del formato."""
+
+
+# === Compilación (build) ===
+class _TablaStrings:
+    """Acumula strings sin duplicados y asigna a cada uno un id."""
+
+    def __init__(self):
+        self.ids = {}
+        self.datos = bytearray()
+        self.offsets = array('I', [0])
+
+    def id(self, texto):
+        if texto not in self.ids:
+            self.ids[texto] = len(self.ids)
+            self.datos += texto.encode('utf-8')
+            self.offsets.append(len(self.datos))
+        return self.ids[texto]
+
+
+def compilar(tours_json, version, fuente="", tokenizador='simple'):
+    """Compila la lista de tours del JSON en los bytes del formato binario.
+
+    Los postings se arman con `tokenizador` (ver indice_tours.TOKENIZADORES) y
+    su nombre queda en la metadata para tokenizar igual las consultas.
+    """
+    from indice_tours import IndiceTours
+    from traduccion import normalizar_termino
+
+    tours = compilar_catalogo(tours_json, ())
+    indice = IndiceTours(tours, tokenizador=tokenizador)
+    strings = _TablaStrings()
+
+    campos = array('I')
+    prioridad, puno = array('i'), array('B')
+    precios_offsets = array('I', [0])
+    desde, hasta, precios = array('i'), array('i'), array('d')
+    for tour in tours:
+        campos.extend(strings.id(getattr(tour, campo)) for campo in CAMPOS)
+        prioridad.append(tour.prioridad)
+        puno.append(tour.es_puno)
+        desde.extend(tour.precios_desde)
+        hasta.extend(tour.precios_hasta)
+        precios.extend(tour.precios)
+        precios_offsets.append(len(precios))
+
+    # Los títulos están incluidos en el cuerpo: una sola lista de postings con dos frecuencias
+    terminos = array('I')
+    postings_offsets = array('I', [0])
+    docs, tf_cuerpo, tf_titulo = array('I'), array('I'), array('I')
+    for termino in sorted(indice.postings_cuerpo):
+        terminos.append(strings.id(termino))
+        en_titulo = indice.postings_titulo.get(termino, {})
+        for doc_id, tf in sorted(indice.postings_cuerpo[termino].items()):
+            docs.append(doc_id)
+            tf_cuerpo.append(tf)
+            tf_titulo.append(en_titulo.get(doc_id, 0))
+        postings_offsets.append(len(docs))
+
+    # Parte del léxico que solo depende del vocabulario (ver traduccion.construir_lexico)
+    identidades = {}
+    for termino in indice.postings_cuerpo:
+        identidades.setdefault(normalizar_termino(termino), termino)
+    lexico_claves, lexico_terminos = array('I'), array('I')
+    for normalizado in sorted(identidades):
+        lexico_claves.append(strings.id(normalizado))
+        lexico_terminos.append(strings.id(identidades[normalizado]))
+
+    # Columnas enteras con el tipo más angosto posible; el tipo de cada una va en la metadata
+    compactas = {
+        b"campos": _compactar(campos),
+        b"longit": _compactar(indice.longitudes),
+        b"terminos": _compactar(terminos),
+        b"post_doc": _compactar(docs),
+        b"post_tfc": _compactar(tf_cuerpo),
+        b"post_tft": _compactar(tf_titulo),
+        b"lex_norm": _compactar(lexico_claves),
+        b"lex_term": _compactar(lexico_terminos),
+    }
+    meta = {
+        "version": version, "tours": len(tours), "terms": len(terminos), "source": fuente, "tokenizer": tokenizador,
+        "types": {nombre.decode('ascii'): columna.typecode for nombre, columna in compactas.items()},
+    }
+    secciones = [
+        (b"meta", json.dumps(meta, sort_keys=True).encode('utf-8')),
+        (b"str_off", strings.offsets.tobytes()),
+        (b"str_dat", bytes(strings.datos)),
+        (b"campos", compactas[b"campos"].tobytes()),
+        (b"priorid", prioridad.tobytes()),
+        (b"puno", puno.tobytes()),
+        (b"longit", compactas[b"longit"].tobytes()),
+        (b"prec_off", precios_offsets.tobytes()),
+        (b"prec_des", desde.tobytes()),
+        (b"prec_has", hasta.tobytes()),
+        (b"prec_val", precios.tobytes()),
+        (b"terminos", compactas[b"terminos"].tobytes()),
+        (b"post_off", postings_offsets.tobytes()),
+        (b"post_doc", compactas[b"post_doc"].tobytes()),
+        (b"post_tfc", compactas[b"post_tfc"].tobytes()),
+        (b"post_tft", compactas[b"post_tft"].tobytes()),
+        (b"lex_norm", compactas[b"lex_norm"].tobytes()),
+        (b"lex_term", compactas[b"lex_term"].tobytes()),
+    ]
+
+    inicio_datos = _alinear(_CABECERA.size + _SECCION.size * len(secciones))
+    tabla, cuerpo = [], bytearray()
+    for nombre, datos in secciones:
+        tabla.append(_SECCION.pack(nombre, inicio_datos + len(cuerpo), len(datos)))
+        cuerpo += datos
+        cuerpo += bytes(_alinear(len(cuerpo)) - len(cuerpo))
+    cabecera = _CABECERA.pack(MAGIA, VERSION_FORMATO, len(secciones)) + b"".join(tabla)
+    return cabecera + bytes(inicio_datos - len(cabecera)) + bytes(cuerpo)
+
+
+def _compactar(valores):
+    """Arreglo sin signo con el tipo más angosto que cabe ('B', 'H' o 'I')."""
+    maximo = max(valores, default=0)
+    return array('B' if maximo < 1 << 8 else 'H' if maximo < 1 << 16 else 'I', valores)
+
+
+def _alinear(n):
+    return (n + ALINEACION - 1) // ALINEACION * ALINEACION
+
+
+def compilar_archivo(ruta_json, ruta_salida, tokenizador='simple'):
+    """Convierte el JSON en el archivo binario (escritura atómica). Devuelve la versión."""
+    from gestor_catalogo import leer_catalogo
+
+    tours_json, version = leer_catalogo(ruta_json)
+    contenido = compilar(tours_json, version, os.path.basename(ruta_json), tokenizador)
+    temporal = f"{ruta_salida}.{os.getpid()}.tmp"
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+        f.flush()
+        os.fsync(f.fileno())
+    # Nunca se escribe sobre el archivo mapeado: otros procesos lo están leyendo
+    os.replace(temporal, ruta_salida)
+    return version
+
+
+# === Lectura (runtime) ===
+def es_catalogo_binario(ruta):
+    try:
+        with open(ruta, 'rb') as f:
+            return f.read(len(MAGIA)) == MAGIA
+    except OSError:
+        return False
+
+
+def abrir_catalogo_binario(ruta):
+    """Mapea el archivo en memoria. Devuelve (CatalogoBinario, versión del JSON de origen)."""
+    catalogo = CatalogoBinario(ruta)
+    return catalogo, catalogo.version
+
+
+class CatalogoBinario:
+    """Vista de solo lectura sobre un catálogo binario mapeado en memoria."""
+
+    def __init__(self, ruta):
+        if sys.byteorder != 'little':
+            raise FormatoCatalogoInvalido("El formato binario del catálogo es little-endian")
+        with open(ruta, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mm) < _CABECERA.size:
+            raise FormatoCatalogoInvalido(f"{ruta}: archivo truncado")
+        magia, version_formato, n_secciones = _CABECERA.unpack_from(self._mm, 0)
+        if magia != MAGIA or version_formato != VERSION_FORMATO:
+            raise FormatoCatalogoInvalido(f"{ruta}: no es un catálogo binario v{VERSION_FORMATO}")
+        vista = memoryview(self._mm)
+        self._secciones = {}
+        for i in range(n_secciones):
+            nombre, offset, longitud = _SECCION.unpack_from(self._mm, _CABECERA.size + i * _SECCION.size)
+            if offset + longitud > len(self._mm):
+                raise FormatoCatalogoInvalido(f"{ruta}: sección {nombre!r} fuera del archivo")
+            self._secciones[nombre.rstrip(b"\0").decode('ascii')] = vista[offset:offset + longitud]
+
+        try:
+            self.meta = json.loads(bytes(self._secciones["meta"]))
+            self._str_off = self._columna("str_off", 'I')
+            self._str_dat = self._secciones["str_dat"]
+            self._campos = self._columna("campos")
+            self._prioridad = self._columna("priorid", 'i')
+            self._puno = self._columna("puno", 'B')
+            self.longitudes = self._columna("longit")
+            self._prec_off = self._columna("prec_off", 'I')
+            self._desde = self._columna("prec_des", 'i')
+            self._hasta = self._columna("prec_has", 'i')
+            self._precios = self._columna("prec_val", 'd')
+            self._terminos = self._columna("terminos")
+            self._post_off = self._columna("post_off", 'I')
+            self._post_doc = self._columna("post_doc")
+            tf_cuerpo = self._columna("post_tfc")
+            tf_titulo = self._columna("post_tft")
+            self._lexico_claves = self._columna("lex_norm")
+            self._lexico_terminos = self._columna("lex_term")
+        except (KeyError, TypeError, ValueError) as e:
+            raise FormatoCatalogoInvalido(f"{ruta}: sección ausente o corrupta ({e})") from e
+
+        self.version = self.meta["version"]
+        # Los binarios anteriores a los tokenizadores por idioma se compilaron con el simple
+        self.tokenizador = self.meta.get("tokenizer", "simple")
+        self.tours = tuple(TourMapeado(self, doc_id) for doc_id in range(self.meta["tours"]))
+        self.postings_cuerpo = PostingsMapeados(self, tf_cuerpo)
+        self.postings_titulo = PostingsMapeados(self, tf_titulo)
+        self.identidades = IdentidadesMapeadas(self)
+        self._n_terminos = len(self._terminos)
+
+    def _columna(self, nombre, tipo=None):
+        return self._secciones[nombre].cast(tipo or self.meta["types"][nombre])
+
+    def __len__(self):
+        return len(self.tours)
+
+    def cadena(self, id_string):
+        return str(self._str_dat[self._str_off[id_string]:self._str_off[id_string + 1]], 'utf-8')
+
+    def campo(self, doc_id, campo):
+        return self.cadena(self._campos[doc_id * len(CAMPOS) + campo])
+
+    def termino(self, posicion):
+        return self.cadena(self._terminos[posicion])
+
+    def buscar(self, columna, clave):
+        """Búsqueda binaria de `clave` en una columna de ids de strings ordenados; None si no está."""
+        n = len(columna)
+        posicion = bisect.bisect_left(range(n), clave, key=lambda i: self.cadena(columna[i]))
+        if posicion < n and self.cadena(columna[posicion]) == clave:
+            return posicion
+        return None
+
+    def posicion_termino(self, termino):
+        return self.buscar(self._terminos, termino)
+
+    def tamano_bytes(self):
+        return len(self._mm)
+
+
+def bytes_mapeados(tours):
+    """Tamaño del archivo mapeado detrás de unos tours del catálogo, 0 si no vienen de un binario."""
+    if tours and isinstance(tours[0], TourMapeado):
+        return tours[0]._catalogo.tamano_bytes()
+    return 0
+
+
+class TourMapeado:
+    """Tour con la misma interfaz que TourRecord; cada campo se lee del mapeo al pedirlo."""
+
+    __slots__ = ('_catalogo', 'id', '_contexto')
+
+    def __init__(self, catalogo, doc_id):
+        self._catalogo = catalogo
+        self.id = doc_id
+        self._contexto = None
+
+    titulo = property(lambda self: self._catalogo.campo(self.id, 0))
+    tipo_servicio = property(lambda self: self._catalogo.campo(self.id, 1))
+    descripcion = property(lambda self: self._catalogo.campo(self.id, 2))
+    itinerario_breve = property(lambda self: self._catalogo.campo(self.id, 3))
+    incluye = property(lambda self: self._catalogo.campo(self.id, 4))
+    url = property(lambda self: self._catalogo.campo(self.id, 5))
+    prioridad = property(lambda self: self._catalogo._prioridad[self.id])
+    es_puno = property(lambda self: bool(self._catalogo._puno[self.id]))
+
+    def _tramo(self, columna, tipo):
+        catalogo = self._catalogo
+        return array(tipo, columna[catalogo._prec_off[self.id]:catalogo._prec_off[self.id + 1]])
+
+    precios_desde = property(lambda self: self._tramo(self._catalogo._desde, 'i'))
+    precios_hasta = property(lambda self: self._tramo(self._catalogo._hasta, 'i'))
+    precios = property(lambda self: self._tramo(self._catalogo._precios, 'd'))
+
+    @property
+    def contexto(self):
+        """Bloques de contexto por idioma, renderizados la primera vez que se usa cada uno."""
+        if self._contexto is None:
+            self._contexto = ContextoTour(self)
+        return self._contexto
+
+
+class PostingsMapeados(Mapping):
+    """término -> {doc_id: frecuencia}, como los dicts de IndiceTours, leído del mapeo.
+
+    Con la columna de frecuencias del título solo aparecen los términos y
+    tours con frecuencia distinta de cero.
+    """
+
+    def __init__(self, catalogo, frecuencias):
+        self._catalogo = catalogo
+        self._frecuencias = frecuencias
+        self._longitud = None
+
+    def _postings(self, posicion):
+        catalogo = self._catalogo
+        inicio, fin = catalogo._post_off[posicion], catalogo._post_off[posicion + 1]
+        return {
+            doc_id: tf
+            for doc_id, tf in zip(catalogo._post_doc[inicio:fin], self._frecuencias[inicio:fin])
+            if tf
+        }
+
+    def __getitem__(self, termino):
+        posicion = self._catalogo.posicion_termino(termino)
+        postings = self._postings(posicion) if posicion is not None else None
+        if not postings:
+            raise KeyError(termino)
+        return postings
+
+    def __contains__(self, termino):
+        try:
+            self[termino]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        for posicion in range(self._catalogo._n_terminos):
+            if self._postings(posicion):
+                yield self._catalogo.termino(posicion)
+
+    def __len__(self):
+        if self._longitud is None:
+            self._longitud = sum(1 for _ in self)
+        return self._longitud
+
+
+class IdentidadesMapeadas(Mapping):
+    """término normalizado -> término del catálogo, para construir_lexico(identidades=...)."""
+
+    def __init__(self, catalogo):
+        self._catalogo = catalogo
+
+    def __getitem__(self, normalizado):
+        catalogo = self._catalogo
+        posicion = catalogo.buscar(catalogo._lexico_claves, normalizado)
+        if posicion is None:
+            raise KeyError(normalizado)
+        return catalogo.cadena(catalogo._lexico_terminos[posicion])
+
+    def __iter__(self):
+        return map(self._catalogo.cadena, self._catalogo._lexico_claves)
+
+    def __len__(self):
+        return len(self._catalogo._lexico_claves)
+
+
+# === Verificación de ida y vuelta ===
+def verificar(tours_json, catalogo, languages=('es', 'en', 'fr'), consultas=None):
+    """Compara el catálogo binario con la compilación del JSON. Devuelve la lista de diferencias."""
+    from indice_tours import IndiceTours, crear_motor
+    from traduccion import construir_lexico
+
+    esperados = compilar_catalogo(tours_json, languages)
+    diferencias = []
+    if len(esperados) != len(catalogo.tours):
+        return [f"tours: {len(esperados)} en el JSON, {len(catalogo.tours)} en el binario"]
+
+    for esperado, leido in zip(esperados, catalogo.tours):
+        for campo in CAMPOS + ('id', 'prioridad', 'es_puno', 'precios_desde', 'precios_hasta', 'precios'):
+            if getattr(esperado, campo) != getattr(leido, campo):
+                diferencias.append(f"tour {esperado.id}: {campo} distinto")
+        for language in languages:
+            if esperado.contexto[language] != leido.contexto[language]:
+                diferencias.append(f"tour {esperado.id}: contexto '{language}' distinto")
+
+    indice_json = IndiceTours(esperados, tokenizador=catalogo.tokenizador)
+    indice_binario = IndiceTours(catalogo.tours, catalogo.postings_titulo, catalogo.postings_cuerpo,
+                                 catalogo.longitudes, catalogo.tokenizador)
+    for nombre in ('postings_titulo', 'postings_cuerpo'):
+        if dict(getattr(indice_json, nombre)) != dict(getattr(indice_binario, nombre).items()):
+            diferencias.append(f"{nombre} distintos")
+    if list(indice_json.longitudes) != list(indice_binario.longitudes):
+        diferencias.append("longitudes distintas")
+    lexico_binario = construir_lexico(catalogo.postings_cuerpo.keys(), identidades=catalogo.identidades)
+    if construir_lexico(indice_json.postings_cuerpo.keys()) != dict(lexico_binario.items()):
+        diferencias.append("léxico distinto")
+
+    consultas = consultas or [[termino] for termino in list(indice_json.postings_cuerpo)[::25]] + [
+        ["uros", "taquile"], ["machu", "picchu", "train"], ["colca", "canyon"], ["salar", "uyuni"], ["zzzz"],
+    ]
+    for motor in ('heuristico', 'bm25'):
+        motor_json, motor_binario = crear_motor(motor, indice_json), crear_motor(motor, indice_binario)
+        for keywords in consultas:
+            if motor_json.buscar(keywords) != motor_binario.buscar(keywords):
+                diferencias.append(f"{motor}: resultados distintos para {keywords}")
+    return diferencias
+
+
+def main():
+    from gestor_catalogo import leer_catalogo
+
+    parser = argparse.ArgumentParser(description="Catálogo binario de tours")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_compilar = sub.add_parser("compilar", help="Convierte el JSON de tours al formato binario")
+    p_compilar.add_argument("json")
+    p_compilar.add_argument("salida")
+    p_compilar.add_argument("--tokenizador", choices=("simple", "plegado"), default="simple",
+                            help="plegado quita tildes (catálogos en es/pt/fr/de, ver idiomas.py)")
+    p_verificar = sub.add_parser("verificar", help="Comprueba que el binario reproduce el JSON")
+    p_verificar.add_argument("json")
+    p_verificar.add_argument("binario")
+    args = parser.parse_args()
+
+    if args.comando == "compilar":
+        inicio = time.perf_counter()
+        version = compilar_archivo(args.json, args.salida, args.tokenizador)
+        print(f"✅ {args.salida}: versión {version}, {os.path.getsize(args.salida) / 1024:.1f} KB "
+              f"(JSON {os.path.getsize(args.json) / 1024:.1f} KB) en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+        return
+
+    tours_json, version = leer_catalogo(args.json)
+    inicio = time.perf_counter()
+    catalogo, version_binario = abrir_catalogo_binario(args.binario)
+    apertura_ms = (time.perf_counter() - inicio) * 1000
+    diferencias = verificar(tours_json, catalogo)
+    if version != version_binario:
+        diferencias.insert(0, f"versión {version_binario} en el binario, {version} en el JSON (recompilar)")
+    for diferencia in diferencias[:20]:
+        print(f"❌ {diferencia}")
+    if diferencias:
+        sys.exit(1)
+    print(f"✅ {len(catalogo)} tours idénticos (campos, contexto, postings, léxico y búsquedas); apertura en {apertura_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
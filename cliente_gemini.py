@@ -0,0 +1,483 @@
+"""Capa de resiliencia para las llamadas a Gemini.
+
+Todas las llamadas (respuestas del chat y traducción de keywords) pasan por un
+`ClienteGemini`, que reutiliza los modelos creados y el cliente de transporte
+de genai (uno por proceso), y además:
+
+- limita las llamadas simultáneas por proceso;
+- impone plazos: `request_options.timeout` para el transporte, un plazo al
+  primer chunk y otro para la petición completa;
+- reintenta los errores transitorios con backoff exponencial y jitter, solo
+  antes de haber entregado texto;
+- opcionalmente lanza una segunda llamada (hedging) si el primer chunk tarda;
+- comparte un circuito que, si la tasa de fallos reciente es alta, deja de
+  llamar a Gemini durante un tiempo para que la app sirva una respuesta de respaldo.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from google.api_core import exceptions as errores_google
+
+from instrumentacion import registro
+
+log = logging.getLogger("incalake.cliente_gemini")
+
+eventos_upstream = registro.contador(
+    "incalake_upstream_events_total",
+    "Llamadas a Gemini por cliente y resultado (call, ok, error, timeout, retry, hedge...)",
+    etiquetas=("client", "event"),
+)
+
+
+class PlazoExcedido(TimeoutError):
+    """Gemini no respondió dentro del plazo."""
+
+
+class CircuitoAbierto(Exception):
+    """El circuito está abierto: no se llama a Gemini hasta que termine la espera."""
+
+
+class SinCupo(Exception):
+    """No hubo cupo de concurrencia hacia Gemini dentro de la espera."""
+
+
+# Errores que justifican reintentar y que cuentan como fallo para el circuito
+ERRORES_TRANSITORIOS = (
+    TimeoutError,
+    ConnectionError,
+    errores_google.ServiceUnavailable,
+    errores_google.DeadlineExceeded,
+    errores_google.ResourceExhausted,
+    errores_google.InternalServerError,
+    errores_google.TooManyRequests,
+    errores_google.BadGateway,
+    errores_google.GatewayTimeout,
+)
+
+
+# === Circuito ===
+class Circuito:
+    """Circuit breaker por tasa de fallos en una ventana de llamadas recientes.
+
+    Cerrado: las llamadas pasan. Cuando en las últimas `ventana` llamadas (con
+    al menos la mitad registradas) la fracción de fallos llega a `tasa_fallos`,
+    se abre y rechaza todo durante `espera_segundos`; luego deja pasar una sola
+    llamada de prueba (semiabierto) que lo cierra si sale bien o lo reabre si falla.
+    """
+
+    CERRADO, ABIERTO, SEMIABIERTO = 'closed', 'open', 'half_open'
+
+    def __init__(self, tasa_fallos=0.5, ventana=50, espera_segundos=30):
+        self.tasa_fallos = tasa_fallos
+        self.ventana = ventana
+        self.espera_segundos = espera_segundos
+        self.estado = self.CERRADO
+        self._resultados = deque(maxlen=ventana)  # True = fallo
+        self.aperturas = 0
+        self._abierto_desde = 0.0
+        self._sonda_desde = None
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        """True si la llamada puede ir a Gemini."""
+        with self._lock:
+            if self.estado == self.CERRADO:
+                return True
+            ahora = time.monotonic()
+            if self.estado == self.ABIERTO:
+                if ahora - self._abierto_desde < self.espera_segundos:
+                    return False
+                self.estado = self.SEMIABIERTO
+                self._sonda_desde = None
+            # Semiabierto: una sola sonda a la vez (una sonda abandonada caduca tras la espera)
+            if self._sonda_desde is not None and ahora - self._sonda_desde < self.espera_segundos:
+                return False
+            self._sonda_desde = ahora
+            return True
+
+    def registrar_exito(self):
+        with self._lock:
+            if self.estado != self.CERRADO:
+                log.info("🔌 Circuito de Gemini cerrado: la llamada de prueba respondió")
+                self.estado = self.CERRADO
+                self._resultados.clear()
+                self._sonda_desde = None
+            self._resultados.append(False)
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._resultados.append(True)
+            if self.estado == self.ABIERTO:
+                return
+            fallos = sum(self._resultados)
+            if self.estado == self.SEMIABIERTO or (
+                len(self._resultados) >= self.ventana // 2 and fallos >= self.tasa_fallos * len(self._resultados)
+            ):
+                self.estado = self.ABIERTO
+                self._abierto_desde = time.monotonic()
+                self._sonda_desde = None
+                self.aperturas += 1
+                log.warning("🔌 Circuito de Gemini abierto (%d fallos en las últimas %d llamadas); nueva prueba en %ss",
+                            fallos, len(self._resultados), self.espera_segundos)
+
+    @property
+    def abierto(self):
+        return self.estado != self.CERRADO
+
+    def estadisticas(self):
+        return {
+            "state": self.estado,
+            "recent_failure_rate": round(sum(self._resultados) / len(self._resultados), 3) if self._resultados else None,
+            "opened": self.aperturas,
+        }
+
+
+# === Cliente ===
+class ClienteGemini:
+    """Llamadas a Gemini con cupo, plazos, reintentos, hedging y circuito.
+
+    `fabrica_modelo(clave)` crea el modelo de una clave (idioma, 'traduccion'...)
+    la primera vez que se pide; después se reutiliza. Los streams se consumen
+    como texto: `generar_stream` entrega solo los chunks con texto.
+    """
+
+    def __init__(self, fabrica_modelo, circuito=None, nombre='chat', max_concurrentes=32, espera_cupo=5.0,
+                 plazo_primer_chunk=20.0, plazo_total=120.0, reintentos=2, espera_base=0.2, espera_max=2.0,
+                 cobertura_segundos=0.0, tasa_coberturas=0.1):
+        self.fabrica_modelo = fabrica_modelo
+        self.circuito = circuito or Circuito()
+        self.nombre = nombre
+        self.max_concurrentes = max_concurrentes
+        self.espera_cupo = espera_cupo
+        self.plazo_primer_chunk = plazo_primer_chunk
+        self.plazo_total = plazo_total
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self.cobertura_segundos = cobertura_segundos
+        self.tasa_coberturas = tasa_coberturas
+        self._modelos = {}
+        self._lock_modelos = threading.Lock()
+        self._cupo = threading.BoundedSemaphore(max_concurrentes)
+        # Las coberturas duplican costo: cada llamada suma `tasa_coberturas` de saldo y cada cobertura gasta 1
+        self._max_saldo_coberturas = max(1.0, max_concurrentes * tasa_coberturas)
+        self._saldo_coberturas = self._max_saldo_coberturas
+        # Hilos donde se espera el primer chunk (o la llamada no-stream) con plazo
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrentes * 2, thread_name_prefix=f"gemini-{nombre}")
+        self._eventos = {}
+        self._lock_eventos = threading.Lock()
+
+    def modelo(self, clave):
+        modelo = self._modelos.get(clave)
+        if modelo is None:
+            with self._lock_modelos:
+                modelo = self._modelos.get(clave)
+                if modelo is None:
+                    modelo = self._modelos[clave] = self.fabrica_modelo(clave)
+        return modelo
+
+    def _contar(self, evento):
+        with self._lock_eventos:
+            self._eventos[evento] = self._eventos.get(evento, 0) + 1
+        eventos_upstream.incrementar(self.nombre, evento)
+
+    def _admitir(self):
+        if not self.circuito.permitir():
+            self._contar('short_circuit')
+            raise CircuitoAbierto("Circuito de Gemini abierto")
+
+    def _espera_reintento(self, error, intento, limite):
+        """Registra el fallo y devuelve cuánto esperar antes de reintentar; relanza si no corresponde."""
+        self._contar('timeout' if isinstance(error, TimeoutError) else 'error')
+        if not isinstance(error, ERRORES_TRANSITORIOS):
+            raise error
+        self.circuito.registrar_fallo()
+        # Backoff exponencial con jitter completo para no sincronizar los reintentos de todos los workers
+        espera = random.uniform(0, min(self.espera_max, self.espera_base * 2 ** (intento - 1)))
+        if intento > self.reintentos or time.monotonic() + espera >= limite:
+            raise error
+        if not self.circuito.permitir():
+            self._contar('short_circuit')
+            raise CircuitoAbierto("Circuito de Gemini abierto") from error
+        self._contar('retry')
+        log.warning("🔁 Reintento %d/%d de Gemini (%s) en %.0f ms: %s",
+                    intento, self.reintentos, self.nombre, espera * 1000, error)
+        return espera
+
+    def _plazo_intento(self, limite):
+        return min(limite, time.monotonic() + self.plazo_primer_chunk)
+
+    def _sumar_saldo_coberturas(self):
+        with self._lock_eventos:
+            self._saldo_coberturas = min(self._max_saldo_coberturas, self._saldo_coberturas + self.tasa_coberturas)
+
+    def _lanzar_cobertura(self, lanzar):
+        """Lanza la llamada de cobertura si queda saldo; devuelve la tarea o None."""
+        with self._lock_eventos:
+            if self._saldo_coberturas < 1:
+                return None
+            self._saldo_coberturas -= 1
+        self._contar('hedge')
+        self._contar('call')
+        return lanzar()
+
+    # --- Llamadas no-stream ---
+    def _lanzar_con_cupo(self, espera, funcion, *args):
+        """Toma un cupo y envía la llamada al pool; el cupo se libera cuando la llamada termina.
+
+        Un intento que venció su plazo sigue corriendo en el pool: mientras no
+        termine sigue ocupando su cupo, así los reintentos no superan
+        max_concurrentes llamadas en vuelo.
+        """
+        if not self._cupo.acquire(timeout=max(0.0, espera)):
+            self._contar('rejected')
+            raise SinCupo(f"Sin cupo hacia Gemini tras {espera:.1f}s")
+        try:
+            futuro = self._pool.submit(funcion, *args)
+        except BaseException:
+            self._cupo.release()
+            raise
+        futuro.add_done_callback(lambda _: self._cupo.release())
+        return futuro
+
+    def ejecutar(self, funcion, *args):
+        """Ejecuta una llamada no-stream (`funcion(*args)`) con circuito, cupo, plazo y reintentos."""
+        self._admitir()
+        limite = time.monotonic() + self.plazo_total
+        intento = 0
+        while True:
+            intento += 1
+            # Cada intento toma su propio cupo; los reintentos no esperan más allá del plazo total
+            espera = self.espera_cupo if intento == 1 else min(self.espera_cupo, limite - time.monotonic())
+            futuro = self._lanzar_con_cupo(espera, funcion, *args)
+            self._contar('call')
+            hecho, _ = wait([futuro], timeout=max(0.0, limite - time.monotonic()))
+            if hecho and futuro.exception() is None:
+                self.circuito.registrar_exito()
+                self._contar('ok')
+                return futuro.result()
+            error = futuro.exception() if hecho else PlazoExcedido(f"Gemini no respondió en {self.plazo_total}s")
+            time.sleep(self._espera_reintento(error, intento, limite))
+
+    # --- Streams (WSGI) ---
+    def _abrir(self, clave, contents, limite):
+        """Abre el stream y lee hasta el primer chunk con texto. Devuelve (iterador, texto, stream)."""
+        stream = self.modelo(clave).generate_content(
+            contents, stream=True, request_options={"timeout": max(1.0, limite - time.monotonic())}
+        )
+        iterador = iter(stream)
+        for chunk in iterador:
+            if chunk.text:
+                return iterador, chunk.text, stream
+        return iterador, None, stream
+
+    def _primer_chunk(self, clave, contents, limite):
+        """Espera el primer chunk con plazo; con hedging lanza una segunda llamada si se demora."""
+        plazo = self._plazo_intento(limite)
+        futuros = [self._pool.submit(self._abrir, clave, contents, limite)]
+        if self.cobertura_segundos > 0:
+            self._sumar_saldo_coberturas()
+            hechos, _ = wait(futuros, timeout=min(self.cobertura_segundos, max(0.0, plazo - time.monotonic())))
+            if not hechos and time.monotonic() < plazo:
+                cobertura = self._lanzar_cobertura(lambda: self._pool.submit(self._abrir, clave, contents, limite))
+                if cobertura is not None:
+                    futuros.append(cobertura)
+
+        pendientes = set(futuros)
+        error = None
+        while pendientes:
+            hechos, pendientes = wait(pendientes, timeout=max(0.0, plazo - time.monotonic()),
+                                      return_when=FIRST_COMPLETED)
+            if not hechos:
+                break
+            for futuro in hechos:
+                if futuro.exception() is not None:
+                    error = futuro.exception()
+                    continue
+                for perdedor in pendientes:
+                    perdedor.add_done_callback(_cerrar_stream)
+                if futuro is not futuros[0]:
+                    self._contar('hedge_won')
+                return futuro.result()
+        for perdedor in pendientes:
+            perdedor.add_done_callback(_cerrar_stream)
+        raise error or PlazoExcedido(f"Sin primer chunk de Gemini en {self.plazo_primer_chunk}s")
+
+    def generar_stream(self, clave, contents):
+        """Genera los textos del stream de Gemini; los errores después del primer chunk no se reintentan."""
+        self._admitir()
+        if not self._cupo.acquire(timeout=self.espera_cupo):
+            self._contar('rejected')
+            raise SinCupo(f"Sin cupo hacia Gemini tras {self.espera_cupo}s")
+        iterador = stream = None
+        try:
+            limite = time.monotonic() + self.plazo_total
+            intento = 0
+            while True:
+                intento += 1
+                self._contar('call')
+                try:
+                    iterador, primero, stream = self._primer_chunk(clave, contents, limite)
+                    break
+                except Exception as e:
+                    error = e
+                time.sleep(self._espera_reintento(error, intento, limite))
+            # Gemini respondió: para el circuito cuenta como éxito aunque el cliente corte el stream
+            self.circuito.registrar_exito()
+
+            try:
+                if primero:
+                    yield primero
+                for chunk in iterador:
+                    # El transporte corta con su timeout; aquí se acota la duración total
+                    if time.monotonic() > limite:
+                        raise PlazoExcedido(f"El stream de Gemini superó {self.plazo_total}s")
+                    if chunk.text:
+                        yield chunk.text
+            except Exception as e:
+                self._contar('timeout' if isinstance(e, TimeoutError) else 'error')
+                if isinstance(e, ERRORES_TRANSITORIOS):
+                    self.circuito.registrar_fallo()
+                raise
+            self._contar('ok')
+        finally:
+            # También si el cliente se fue (GeneratorExit en el yield): el cupo cuenta conexiones abiertas
+            if iterador is not None:
+                _cerrar_upstream(iterador, stream)
+            self._cupo.release()
+
+    # --- Streams (ASGI) ---
+    async def _abrir_async(self, clave, contents, limite):
+        stream = await self.modelo(clave).generate_content_async(
+            contents, stream=True, request_options={"timeout": max(1.0, limite - time.monotonic())}
+        )
+        iterador = stream.__aiter__()
+        async for chunk in iterador:
+            if chunk.text:
+                return iterador, chunk.text, stream
+        return iterador, None, stream
+
+    async def _primer_chunk_async(self, clave, contents, limite):
+        plazo = self._plazo_intento(limite)
+        tareas = [asyncio.ensure_future(self._abrir_async(clave, contents, limite))]
+        if self.cobertura_segundos > 0:
+            self._sumar_saldo_coberturas()
+            hechas, _ = await asyncio.wait(
+                tareas, timeout=min(self.cobertura_segundos, max(0.0, plazo - time.monotonic()))
+            )
+            if not hechas and time.monotonic() < plazo:
+                cobertura = self._lanzar_cobertura(
+                    lambda: asyncio.ensure_future(self._abrir_async(clave, contents, limite))
+                )
+                if cobertura is not None:
+                    tareas.append(cobertura)
+
+        pendientes = set(tareas)
+        error = None
+        try:
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(
+                    pendientes, timeout=max(0.0, plazo - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not hechas:
+                    break
+                for tarea in hechas:
+                    if tarea.exception() is not None:
+                        error = tarea.exception()
+                        continue
+                    if tarea is not tareas[0]:
+                        self._contar('hedge_won')
+                    return tarea.result()
+            raise error or PlazoExcedido(f"Sin primer chunk de Gemini en {self.plazo_primer_chunk}s")
+        finally:
+            for tarea in pendientes:
+                tarea.cancel()
+
+    async def generar_stream_async(self, clave, contents):
+        """Versión asíncrona de `generar_stream`; el cupo de streams lo pone asgi_app."""
+        self._admitir()
+        limite = time.monotonic() + self.plazo_total
+        intento = 0
+        while True:
+            intento += 1
+            self._contar('call')
+            try:
+                iterador, primero, stream = await self._primer_chunk_async(clave, contents, limite)
+                break
+            except Exception as e:
+                error = e
+            await asyncio.sleep(self._espera_reintento(error, intento, limite))
+        self.circuito.registrar_exito()
+
+        try:
+            if primero:
+                yield primero
+            async for chunk in iterador:
+                if time.monotonic() > limite:
+                    raise PlazoExcedido(f"El stream de Gemini superó {self.plazo_total}s")
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            self._contar('timeout' if isinstance(e, TimeoutError) else 'error')
+            if isinstance(e, ERRORES_TRANSITORIOS):
+                self.circuito.registrar_fallo()
+            raise
+        finally:
+            await _cerrar_upstream_async(iterador, stream)
+        self._contar('ok')
+
+    def estadisticas(self):
+        with self._lock_eventos:
+            eventos = dict(self._eventos)
+        return {
+            "circuit": self.circuito.estadisticas(),
+            "models": len(self._modelos),
+            "max_concurrent": self.max_concurrentes,
+            "hedge_after_ms": round(self.cobertura_segundos * 1000) or None,
+            "events": eventos,
+        }
+
+
+def _cortar_transporte(stream):
+    """Cancela la llamada gRPC/REST que genai lee debajo de la respuesta (cerrar su iterador no la corta)."""
+    subyacente = getattr(stream, '_iterator', None)
+    cortar = getattr(subyacente, 'cancel', None) or getattr(subyacente, 'close', None)
+    if cortar:
+        try:
+            cortar()
+        except Exception:
+            pass
+
+
+def _cerrar_upstream(iterador, stream):
+    """Cierra el stream de Gemini y su conexión, se haya leído entero o no."""
+    cerrar = getattr(iterador, 'close', None)
+    if cerrar:
+        try:
+            cerrar()
+        except Exception:
+            pass
+    _cortar_transporte(stream)
+
+
+async def _cerrar_upstream_async(iterador, stream):
+    cerrar = getattr(iterador, 'aclose', None)
+    if cerrar:
+        try:
+            await cerrar()
+        except Exception:
+            pass
+    _cortar_transporte(stream)
+
+
+def _cerrar_stream(futuro):
+    """Cierra el stream de un intento descartado (perdió el hedging o llegó tarde)."""
+    if futuro.cancelled() or futuro.exception() is not None:
+        return
+    iterador, _, stream = futuro.result()
+    _cerrar_upstream(iterador, stream)
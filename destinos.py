@@ -0,0 +1,81 @@
+import hashlib
+import json
+from dataclasses import dataclass
+
+# Reglas de etiquetado: un tour pertenece a un destino si su título o tipo de
+# servicio contiene alguna de estas palabras (un tour puede tener varios destinos).
+REGLAS_DESTINOS = (
+    ('Puno', ('puno', 'titicaca', 'uros', 'taquile', 'amantani')),
+    ('Cusco', ('cusco', 'machu picchu', 'machupicchu', 'sacred valley', 'valle sagrado', 'maras', 'moray',
+               'vinicunca', 'rainbow mountain', 'salkantay')),
+    ('Arequipa', ('arequipa', 'colca', 'canyon', 'chivay')),
+    ('Uyuni', ('uyuni', 'salar', 'bolivia')),
+)
+
+
+def destinos_de_tour(tour, reglas=REGLAS_DESTINOS):
+    """Destinos a los que pertenece un tour según las reglas de palabras clave."""
+    texto = (tour.titulo + " " + tour.tipo_servicio).lower()
+    return [destino for destino, palabras in reglas if any(palabra in texto for palabra in palabras)]
+
+
+@dataclass(frozen=True, slots=True)
+class FacetaDestino:
+    """Resumen precalculado de los tours de un destino."""
+    destino: str
+    tour_ids: tuple
+    conteo: int
+    precio_min: float
+    precio_max: float
+    mejor_prioridad: int
+
+
+class FacetasDestinos:
+    """Índice destino -> tours construido una sola vez por carga del catálogo.
+
+    También deja listo el cuerpo de /destinations y su ETag, así el endpoint y
+    el prompt de consultas generales no recorren el catálogo en cada petición.
+    """
+
+    def __init__(self, tours, reglas=REGLAS_DESTINOS, version_catalogo=""):
+        ids_por_destino = {destino: [] for destino, _ in reglas}
+        for tour in tours:
+            for destino in destinos_de_tour(tour, reglas):
+                ids_por_destino[destino].append(tour.id)
+
+        self.facetas = {}
+        for destino, ids in ids_por_destino.items():
+            if not ids:
+                continue
+            precios = [precio for doc_id in ids for precio in tours[doc_id].precios]
+            self.facetas[destino] = FacetaDestino(
+                destino=destino,
+                tour_ids=tuple(ids),
+                conteo=len(ids),
+                precio_min=min(precios) if precios else None,
+                precio_max=max(precios) if precios else None,
+                mejor_prioridad=min(tours[doc_id].prioridad for doc_id in ids),
+            )
+
+        self.destinos = tuple(sorted(self.facetas))
+        self._por_nombre = {destino.lower(): faceta for destino, faceta in self.facetas.items()}
+        self.respuesta = {
+            "destinations": [
+                {
+                    "destination": faceta.destino,
+                    "tour_count": faceta.conteo,
+                    "price_min": faceta.precio_min,
+                    "price_max": faceta.precio_max,
+                    "best_priority": faceta.mejor_prioridad,
+                }
+                for faceta in (self.facetas[destino] for destino in self.destinos)
+            ],
+            "total_destinations": len(self.destinos),
+        }
+        cuerpo = json.dumps(self.respuesta, sort_keys=True)
+        self.etag = hashlib.sha1(f"{version_catalogo}:{cuerpo}".encode('utf-8')).hexdigest()[:16]
+
+    def conteo(self, destino):
+        """Número de tours de un destino (sin distinguir mayúsculas)."""
+        faceta = self._por_nombre.get(destino.lower())
+        return faceta.conteo if faceta else 0
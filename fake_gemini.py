@@ -0,0 +1,128 @@
+"""Stub local y determinista de Gemini para benchmarks y pruebas de carga.
+
+Imita la interfaz de `genai.GenerativeModel` que usa la app: `generate_content`
+(con y sin stream) y `generate_content_async`. Se activa con FAKE_GEMINI=1.
+
+También inyecta fallos para probar la capa de resiliencia: una fracción de
+llamadas falla con un 503 simulado (FAKE_GEMINI_ERROR_RATE) y otra tarda
+FAKE_GEMINI_SLOW_MS en dar el primer chunk (FAKE_GEMINI_SLOW_RATE). Si la
+llamada trae `request_options={"timeout": ...}` menor que esa latencia, se
+corta con TimeoutError como lo haría el transporte real.
+"""
+import asyncio
+import os
+import random
+import time
+
+TEXTO_BASE = (
+    "¡Perfecto! 🌊 Te recomiendo nuestro tour a las Islas Flotantes de los Uros y Taquile. "
+    "Precios por persona desde $35 USD. [Ver más información](https://incalake.com/en/puno/uros-floating-islands-tour) "
+    "¿Para qué fecha planeas viajar y cuántas personas van? 🗓️👥 "
+)
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeRespuesta:
+    """Respuesta no-stream con el texto completo."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Genera `n_chunks` fragmentos de `tamano_chunk` caracteres con latencias y fallos configurables."""
+
+    def __init__(self, n_chunks=20, tamano_chunk=40, latencia_chunk_ms=20, latencia_inicial_ms=300,
+                 tasa_fallos=0.0, tasa_lentos=0.0, latencia_lenta_ms=5000, semilla=None):
+        self.n_chunks = n_chunks
+        self.tamano_chunk = tamano_chunk
+        self.latencia_chunk = latencia_chunk_ms / 1000
+        self.latencia_inicial = latencia_inicial_ms / 1000
+        self.tasa_fallos = tasa_fallos
+        self.tasa_lentos = tasa_lentos
+        self.latencia_lenta = latencia_lenta_ms / 1000
+        self._azar = random.Random(semilla)
+        self.llamadas = 0
+
+    @classmethod
+    def desde_entorno(cls):
+        semilla = os.getenv("FAKE_GEMINI_SEED")
+        return cls(
+            n_chunks=int(os.getenv("FAKE_GEMINI_CHUNKS", "20")),
+            tamano_chunk=int(os.getenv("FAKE_GEMINI_CHUNK_SIZE", "40")),
+            latencia_chunk_ms=float(os.getenv("FAKE_GEMINI_CHUNK_LATENCY_MS", "20")),
+            latencia_inicial_ms=float(os.getenv("FAKE_GEMINI_TTFB_MS", "300")),
+            tasa_fallos=float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0")),
+            tasa_lentos=float(os.getenv("FAKE_GEMINI_SLOW_RATE", "0")),
+            latencia_lenta_ms=float(os.getenv("FAKE_GEMINI_SLOW_MS", "5000")),
+            semilla=int(semilla) if semilla else None,
+        )
+
+    def _sortear(self, request_options):
+        """Latencia hasta el primer chunk de esta llamada y el error a lanzar (o None)."""
+        lenta = self._azar.random() < self.tasa_lentos
+        falla = self._azar.random() < self.tasa_fallos
+        latencia = self.latencia_lenta if lenta else self.latencia_inicial
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and latencia > timeout:
+            return timeout, TimeoutError(f"Plazo de {timeout}s excedido (simulado)")
+        if falla:
+            return latencia, ConnectionError("503 Service Unavailable (fallo inyectado)")
+        return latencia, None
+
+    def _fragmentos(self):
+        texto = TEXTO_BASE * (self.n_chunks * self.tamano_chunk // len(TEXTO_BASE) + 1)
+        return [
+            texto[i * self.tamano_chunk:(i + 1) * self.tamano_chunk]
+            for i in range(self.n_chunks)
+        ]
+
+    def _stream(self, latencia, error):
+        time.sleep(latencia)
+        if error:
+            raise error
+        for i, fragmento in enumerate(self._fragmentos()):
+            if i:
+                time.sleep(self.latencia_chunk)
+            yield FakeChunk(fragmento)
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        self.llamadas += 1
+        latencia, error = self._sortear(request_options)
+        if stream:
+            return self._stream(latencia, error)
+        time.sleep(latencia)
+        if error:
+            raise error
+        return FakeRespuesta("".join(self._fragmentos()))
+
+    async def _stream_async(self, latencia, error):
+        await asyncio.sleep(latencia)
+        if error:
+            raise error
+        for i, fragmento in enumerate(self._fragmentos()):
+            if i:
+                await asyncio.sleep(self.latencia_chunk)
+            yield FakeChunk(fragmento)
+
+    async def generate_content_async(self, contents, stream=False, request_options=None, **kwargs):
+        self.llamadas += 1
+        latencia, error = self._sortear(request_options)
+        if stream:
+            return self._stream_async(latencia, error)
+        await asyncio.sleep(latencia)
+        if error:
+            raise error
+        return FakeRespuesta("".join(self._fragmentos()))
+
+
+def traducir_terminos_fake(terminos):
+    """Traducción remota simulada: devuelve cada término sin cambios tras FAKE_GEMINI_TRANSLATION_MS."""
+    time.sleep(float(os.getenv("FAKE_GEMINI_TRANSLATION_MS", "0")) / 1000)
+    if random.random() < float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0")):
+        raise ConnectionError("503 Service Unavailable (fallo inyectado)")
+    return {termino: termino for termino in terminos}
@@ -0,0 +1,328 @@
+"""Filtros estructurados de la consulta: tamaño de grupo, presupuesto, duración y destino.
+
+"Tour para 4 personas por menos de $100" o "2 días en Cusco" se convierten
+en un FiltrosConsulta. IndiceFiltros guarda por versión del catálogo las
+columnas numéricas para resolverlo antes del ranking: la duración de cada
+tour (leída del título: "2d1n", "in 2 days", "(1D)", "Half Day", "4h"...), su
+precio mínimo y una fila de precio por persona para cada tamaño de grupo.
+Filtrar es recorrer esas columnas; el precio exacto para el grupo pedido va
+al contexto en vez de todos los tramos, así Gemini no hace la aritmética.
+"""
+import math
+import re
+from array import array
+from dataclasses import dataclass, replace
+
+from catalogo import formatear_precio, renderizar_contexto
+from destinos import REGLAS_DESTINOS
+from traduccion import normalizar_termino
+
+# Las filas por tamaño de grupo llegan hasta el mayor "hasta" del catálogo, con este tope
+MAX_GRUPO = 50
+MAX_DIAS = 15
+# Tours de hasta estas horas cuentan como "medio día"
+HORAS_MEDIO_DIA = 6
+# Si nada entra en el presupuesto se ofrecen los más baratos entre los que cumplen lo demás
+CANDIDATOS_SIN_PRESUPUESTO = 5
+
+NUMEROS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8,
+    'nine': 9, 'ten': 10, 'un': 1, 'uno': 1, 'una': 1, 'dos': 2, 'tres': 3, 'cuatro': 4,
+    'cinco': 5, 'seis': 6, 'siete': 7, 'ocho': 8, 'nueve': 9, 'diez': 10,
+    'dois': 2, 'duas': 2, 'quatro': 4, 'deux': 2, 'trois': 3, 'quatre': 4, 'cinq': 5,
+    'zwei': 2, 'drei': 3, 'vier': 4, 'funf': 5,
+}
+_NUM = r'(\d+|' + '|'.join(NUMEROS) + r')'
+_MONTO = r'(\d{1,3}(?:,\d{3})+|\d+(?:\.\d{1,2})?)'
+_MONEDA = r'(?:usd|us\$|dollars?|dolares?|\$)'
+_PERSONAS = (r'(?:people|persons?|pax|travell?ers|adults|guests|friends|of us|personas?|viajeros|adultos|amigos|integrantes|'
+             r'pessoas|viajantes|personnes|adultes|amis|voyageurs|personen|erwachsene|freunde|reisende)')
+_MESES = (r'(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre|'
+          r'january|february|march|april|may|june|july|august|september|october|november|december|'
+          r'jan|feb|mar|apr|jun|jul|aug|sep|sept|oct|nov|dec|ene|abr|ago|dic|'
+          r'janeiro|fevereiro|marco|maio|junho|julho|setembro|outubro|novembro|dezembro|'
+          r'janvier|fevrier|mars|avril|mai|juin|juillet|aout|septembre|octobre|novembre|decembre|'
+          r'januar|februar|marz|juni|juli|oktober|dezember)')
+# Lo que sigue a un número que es fecha u hora y no cantidad: "15 de julio", "15 july", "15/07", "10:30", "8 am"
+_FECHA_U_HORA = rf'(?:(?:de\s+|of\s+)?{_MESES}\b|[/:.-]\d|(?:am|pm|a\.m|p\.m)\b)'
+_DURACION = r'(?:days?|nights?|hours?|hrs?|h|d|dias?|noches?|horas?|noites|jours?|nuits?|heures?|tage?n?|nachte|stunden?)'
+
+# Los patrones trabajan sobre texto en minúsculas y sin tildes; cubren los idiomas de idiomas.json
+# Tras "para/for" solo cuenta una cantidad de al menos dos: "para un tour" o "for one tour" es el artículo
+_CANTIDAD = r'(\d+|' + '|'.join(palabra for palabra, valor in NUMEROS.items() if valor > 1) + r')'
+_NO_CANTIDAD = rf'(?!\s*(?:{_DURACION}\b|{_MONEDA}|soles\b|%|{_FECHA_U_HORA}|tours?\b))'
+# Tras "somos/we are/para/for" lo mismo: "somos una pareja" o "somos un grupo de 6" no dicen 1
+PATRONES_GRUPO = [
+    re.compile(rf'\b{_NUM}\s*{_PERSONAS}\b'),
+    re.compile(rf'\b(?:group of|party of|grupo de|familia de|family of|groupe de|famille de)\s+{_CANTIDAD}\b{_NO_CANTIDAD}'),
+    re.compile(rf'\b(?:somos|we are|nous sommes|wir sind)\s+{_CANTIDAD}\b{_NO_CANTIDAD}'),
+    re.compile(rf'\b(?:for|para|pour|fur)\s+{_CANTIDAD}\b{_NO_CANTIDAD}'),
+]
+# "2 adultos y 2 niños": con niños el grupo es la suma de todas las cantidades
+_ADULTOS = r'(?:adults?|adultos?|adultes?|erwachsenen?)'
+_NINOS = r'(?:kids?|children|child|ninos?|ninas?|hijos?|menores|criancas?|enfants?|kinder|kindern)'
+PATRON_ADULTOS_NINOS = re.compile(rf'\b{_NUM}\s*(?:({_ADULTOS})|{_NINOS})\b')
+PATRONES_PAREJA = re.compile(r'\b(?:couple|pareja|casal|my (?:wife|husband|partner) and i|mi (?:esposa|esposo) y yo)\b')
+PATRONES_SOLO = re.compile(r'\b(?:alone|just me|by myself|solo yo|viajo solo|viajo sola|sozinh[oa]|seule?|allein)\b')
+
+# Un tope ("hasta", "under") solo es presupuesto con moneda: "hasta 15 de julio" es una fecha.
+# Tras una palabra de presupuesto basta el número.
+_TOPE = (r'(?:under|below|less than|cheaper than|max(?:imum)?|at most|up to|no more than|'
+         r'menos de|maximo|como maximo|hasta|no mas de|por debajo de|moins de|jusqu\'a|unter|weniger als|bis zu|maximal)')
+_PALABRA_PRESUPUESTO = r'(?:budget(?: of| is)?|presupuesto(?: de| es)?|orcamento(?: de| e)?|budget von)'
+PATRONES_PRESUPUESTO = [
+    re.compile(rf'\b{_TOPE}\s*(?:de\s+)?{_MONEDA}\s*{_MONTO}\b'),
+    re.compile(rf'\b{_TOPE}\s*(?:de\s+)?{_MONTO}\s*{_MONEDA}'),
+    re.compile(
+        rf'\b{_PALABRA_PRESUPUESTO}\s*(?:de\s+)?(?:{_MONEDA}\s*)?{_MONTO}\b'
+        rf'(?!\s*(?:{_PERSONAS}|{_DURACION}|soles|pen)\b|\s*{_FECHA_U_HORA})'
+    ),
+]
+PATRONES_MONTO = [re.compile(rf'\$\s*{_MONTO}\b'), re.compile(rf'\b{_MONTO}\s*{_MONEDA}')]
+PATRON_TOTAL = re.compile(r'\b(?:in total|total|en total|for all of us|para todos)\b')
+
+PATRON_DIAS_NOCHES = re.compile(r'\b(\d+)\s*d\s*(\d+)\s*n\b')
+PATRON_DIAS = re.compile(rf'\b{_NUM}[\s-]*(?:days?|dias?|jours?|tage?n?|d)\b')
+PATRON_NOCHES = re.compile(rf'\b{_NUM}\s*(?:nights?|noches?|noites|nuits?|nachte)\b')
+PATRON_DIA_COMPLETO = re.compile(
+    r'\b(?:full[\s-]day|all day|day trip|dia completo|todo el dia|dia inteiro|journee complete|ganztags?|tagesausflug)\b'
+)
+PATRON_HORAS = re.compile(r'\b(\d+)\s*(?:hours?|hrs?|h|horas?|heures?|stunden?)\b')
+PATRON_MEDIO_DIA = re.compile(
+    r'\b(?:half[\s-]day|medio dia|few hours|pocas horas|meio dia|algumas horas|demi[\s-]journee|quelques heures|'
+    r'halbtags?|halber tag|wenige stunden)\b'
+)
+
+
+def _numero(texto):
+    return NUMEROS.get(texto) or int(texto)
+
+
+def _monto(texto):
+    return float(texto.replace(',', ''))
+
+
+def duracion_de_titulo(titulo):
+    """(días, corto) de un tour según su título; días=0 si el título no lo dice."""
+    texto = normalizar_termino(titulo)
+    coincidencia = PATRON_DIAS_NOCHES.search(texto) or PATRON_DIAS.search(texto)
+    if coincidencia:
+        return min(_numero(coincidencia.group(1)), MAX_DIAS), False
+    horas = PATRON_HORAS.search(texto)
+    if PATRON_MEDIO_DIA.search(texto) or (horas and int(horas.group(1)) <= HORAS_MEDIO_DIA):
+        return 1, True
+    if horas or PATRON_DIA_COMPLETO.search(texto) or re.search(r'\bone[\s-]day\b', texto):
+        return 1, False
+    return 0, False
+
+
+@dataclass(frozen=True, slots=True)
+class FiltrosConsulta:
+    """Restricciones numéricas y de destino extraídas de la conversación."""
+    personas: int = None
+    presupuesto: float = None
+    # El presupuesto es por persona salvo que digan "en total"
+    presupuesto_total: bool = False
+    dias: int = None
+    corto: bool = False
+    destinos: tuple = ()
+    # Filtros que se relajaron porque ningún tour cumplía todos
+    omitidos: tuple = ()
+
+    @property
+    def activos(self):
+        """Solo los filtros numéricos activan el motor; el destino únicamente los acota."""
+        return bool(self.personas or self.presupuesto or self.dias or self.corto)
+
+    def combinar(self, nuevos):
+        """Los valores del mensaje más reciente reemplazan a los anteriores."""
+        return FiltrosConsulta(
+            personas=nuevos.personas or self.personas,
+            presupuesto=nuevos.presupuesto or self.presupuesto,
+            presupuesto_total=nuevos.presupuesto_total if nuevos.presupuesto else self.presupuesto_total,
+            dias=nuevos.dias or (None if nuevos.corto else self.dias),
+            corto=nuevos.corto or (self.corto and not nuevos.dias),
+            destinos=nuevos.destinos or self.destinos,
+        )
+
+    def clave(self):
+        """Representación estable para la clave de la caché de respuestas."""
+        if not self.activos:
+            return ""
+        return (f"{self.personas}|{self.presupuesto}|{self.presupuesto_total}|{self.dias}|{self.corto}|"
+                f"{','.join(self.destinos)}|{','.join(self.omitidos)}")
+
+    def describir(self):
+        """Resumen en inglés para el contexto del prompt."""
+        partes = []
+        if self.personas:
+            partes.append(f"group of {self.personas}")
+        if self.presupuesto:
+            alcance = "in total" if self.presupuesto_total and self.personas else "per person"
+            partes.append(f"budget up to ${formatear_precio(self.presupuesto)} USD {alcance}")
+        if self.dias:
+            partes.append(f"up to {self.dias} day{'s' if self.dias > 1 else ''}")
+        if self.corto:
+            partes.append("half day or a few hours")
+        if self.destinos:
+            partes.append(f"destination {' or '.join(self.destinos)}")
+        return ", ".join(partes)
+
+
+def extraer_filtros(texto, reglas_destinos=REGLAS_DESTINOS):
+    """Extrae grupo, presupuesto, duración y destinos de un mensaje (ES, EN, PT, FR o DE)."""
+    texto = normalizar_termino(texto)
+
+    personas = None
+    cantidades = PATRON_ADULTOS_NINOS.findall(texto)
+    if any(not adultos for _, adultos in cantidades):
+        personas = sum(_numero(numero) for numero, _ in cantidades)
+        if not any(adultos for _, adultos in cantidades) and PATRONES_PAREJA.search(texto):
+            personas += 2
+    for patron in PATRONES_GRUPO if personas is None else ():
+        coincidencia = patron.search(texto)
+        if coincidencia:
+            personas = _numero(coincidencia.group(1))
+            break
+    if personas is None and PATRONES_PAREJA.search(texto):
+        personas = 2
+    if personas is None and PATRONES_SOLO.search(texto):
+        personas = 1
+    if personas is not None and not 1 <= personas <= MAX_GRUPO:
+        personas = None
+
+    presupuesto = None
+    coincidencia = next((c for c in (p.search(texto) for p in PATRONES_PRESUPUESTO + PATRONES_MONTO) if c), None)
+    if coincidencia:
+        presupuesto = _monto(coincidencia.group(1)) or None
+
+    dias, corto = None, False
+    coincidencia = PATRON_DIAS_NOCHES.search(texto) or PATRON_DIAS.search(texto)
+    if coincidencia:
+        dias = _numero(coincidencia.group(1))
+    elif PATRON_NOCHES.search(texto):
+        dias = _numero(PATRON_NOCHES.search(texto).group(1)) + 1
+    elif PATRON_DIA_COMPLETO.search(texto):
+        dias = 1
+    else:
+        # Como en duracion_de_titulo: hasta HORAS_MEDIO_DIA es medio día, más horas es un día completo
+        horas = PATRON_HORAS.search(texto)
+        if PATRON_MEDIO_DIA.search(texto) or (horas and int(horas.group(1)) <= HORAS_MEDIO_DIA):
+            corto = True
+        elif horas:
+            dias = 1
+    if dias is not None and not 1 <= dias <= MAX_DIAS:
+        dias = None
+
+    destinos = tuple(destino for destino, palabras in reglas_destinos if any(palabra in texto for palabra in palabras))
+    return FiltrosConsulta(
+        personas=personas,
+        presupuesto=presupuesto,
+        presupuesto_total=bool(presupuesto and PATRON_TOTAL.search(texto)),
+        dias=dias,
+        corto=corto,
+        destinos=destinos,
+    )
+
+
+def filtros_de_conversacion(mensajes_usuario, pregunta):
+    """Combina los filtros de los mensajes previos del usuario con los de la pregunta actual."""
+    filtros = FiltrosConsulta()
+    for mensaje in list(mensajes_usuario) + [pregunta]:
+        filtros = filtros.combinar(extraer_filtros(mensaje))
+    return filtros
+
+
+class IndiceFiltros:
+    """Columnas numéricas por tour, construidas una sola vez por versión del catálogo.
+
+    `por_grupo[p]` es un array con el precio por persona de cada tour para un
+    grupo de `p` personas (inf si ningún tramo lo cubre): resolver el tamaño
+    de grupo o el presupuesto es recorrer una sola columna.
+    """
+
+    def __init__(self, tours):
+        self.n_tours = len(tours)
+        self.dias = array('i')
+        self.corto = array('B')
+        self.precio_min = array('d')
+        self.max_grupo = min(
+            max((hasta for tour in tours for hasta in tour.precios_hasta), default=0), MAX_GRUPO
+        )
+        self.por_grupo = [None] + [array('d', [math.inf]) * self.n_tours for _ in range(self.max_grupo)]
+        for doc_id, tour in enumerate(tours):
+            dias, corto = duracion_de_titulo(tour.titulo)
+            self.dias.append(dias)
+            self.corto.append(corto)
+            precios = tour.precios
+            self.precio_min.append(min(precios) if len(precios) else math.inf)
+            # En tramos superpuestos manda el primero, como en la tabla del catálogo
+            tramos = list(zip(tour.precios_desde, tour.precios_hasta, precios))
+            for desde, hasta, precio in reversed(tramos):
+                for personas in range(max(desde, 1), min(hasta, self.max_grupo) + 1):
+                    self.por_grupo[personas][doc_id] = precio
+
+    def precio_para(self, doc_id, personas):
+        """Precio por persona del tour para un grupo, o None si no admite ese tamaño."""
+        if not 1 <= personas <= self.max_grupo:
+            return None
+        precio = self.por_grupo[personas][doc_id]
+        return None if precio == math.inf else precio
+
+    def _aplicar(self, filtros, facetas, omitidos):
+        if filtros.destinos and 'destination' not in omitidos and facetas is not None:
+            ids = sorted({
+                doc_id for destino in filtros.destinos if destino in facetas.facetas
+                for doc_id in facetas.facetas[destino].tour_ids
+            })
+        else:
+            ids = range(self.n_tours)
+        if 'duration' not in omitidos:
+            if filtros.dias:
+                dias = self.dias
+                # Los días que dicen tener son un máximo: con 3 días libres también sirven los de 1 y 2
+                ids = [doc_id for doc_id in ids if 1 <= dias[doc_id] <= filtros.dias]
+            elif filtros.corto:
+                corto = self.corto
+                ids = [doc_id for doc_id in ids if corto[doc_id]]
+        if filtros.personas:
+            if filtros.personas > self.max_grupo:
+                return []
+            fila = self.por_grupo[filtros.personas]
+            ids = [doc_id for doc_id in ids if fila[doc_id] != math.inf]
+        if filtros.presupuesto:
+            precios = self.por_grupo[filtros.personas] if filtros.personas else self.precio_min
+            if 'budget' in omitidos:
+                return sorted(ids, key=precios.__getitem__)[:CANDIDATOS_SIN_PRESUPUESTO]
+            tope = filtros.presupuesto
+            if filtros.presupuesto_total and filtros.personas:
+                tope /= filtros.personas
+            ids = [doc_id for doc_id in ids if precios[doc_id] <= tope]
+        return ids
+
+    def candidatos(self, filtros, facetas=None):
+        """Tours que cumplen los filtros, relajando presupuesto, duración y destino si no hay ninguno.
+
+        Sin presupuesto alcanzable quedan los CANDIDATOS_SIN_PRESUPUESTO más baratos.
+
+        Devuelve (conjunto de doc_ids o None si ni relajando hay candidatos,
+        filtros con `omitidos` indicando qué se relajó).
+        """
+        for omitidos in ((), ('budget',), ('budget', 'duration'), ('budget', 'duration', 'destination')):
+            ids = self._aplicar(filtros, facetas, omitidos)
+            if ids:
+                return frozenset(ids), replace(filtros, omitidos=omitidos)
+        return None, replace(filtros, omitidos=('all',))
+
+    def contexto(self, tour, language, filtros):
+        """Bloque de contexto del tour con el precio exacto para el grupo pedido."""
+        precio = self.precio_para(tour.id, filtros.personas) if filtros.personas else None
+        if precio is None:
+            return tour.contexto[language]
+        personas = filtros.personas
+        linea = (f"For {personas} {'person' if personas == 1 else 'people'}: ${formatear_precio(precio)} USD per person "
+                 f"(total ${formatear_precio(precio * personas)} USD)")
+        return renderizar_contexto(
+            tour.titulo, tour.descripcion, tour.itinerario_breve, tour.url, tour.prioridad, tour.es_puno,
+            tour.precios_desde, tour.precios_hasta, tour.precios, language, linea_precios=linea
+        )
@@ -0,0 +1,224 @@
+"""Generaciones de Gemini compartidas entre peticiones idénticas en curso (single-flight).
+
+En una promoción muchos visitantes nuevos mandan a la vez el mismo mensaje
+del widget y el prompt que arma construir_historial_gemini sale idéntico
+byte a byte. La primera petición con un prompt abre el stream de Gemini
+(líder); las que llegan mientras sigue en curso se suscriben a él: reciben
+los textos ya generados y luego los nuevos a medida que llegan. Cada
+petición sigue registrando su propio turno en su sesión.
+
+Si el cliente del líder se desconecta y quedan suscriptores, el stream de
+Gemini se sigue leyendo para ellos; se corta solo cuando no queda nadie. Un
+error de Gemini llega a todos los suscriptores igual que al líder.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+
+from instrumentacion import registro
+
+generaciones_gemini = registro.contador(
+    "incalake_gemini_generations_total",
+    "Respuestas de Gemini pedidas en /chat: las que abrieron el stream (leader) y las que se sumaron a uno en curso (subscriber)",
+    etiquetas=("role",),
+)
+
+
+class Generacion:
+    """Un stream de Gemini en curso: textos recibidos hasta ahora y cuántas peticiones lo están leyendo."""
+
+    def __init__(self, clave):
+        self.clave = clave
+        self.textos = []
+        self.terminada = False
+        self.error = None
+        self.suscriptores = 0
+        self._condicion = threading.Condition()
+        self._esperas = []  # futuros de los lectores asíncronos
+        self.tarea = None  # lectura del stream en modo asíncrono
+
+    def publicar(self, texto):
+        with self._condicion:
+            self.textos.append(texto)
+            self._condicion.notify_all()
+        self._despertar()
+
+    def terminar(self, error=None):
+        with self._condicion:
+            self.error = error
+            self.terminada = True
+            self._condicion.notify_all()
+        self._despertar()
+
+    def _despertar(self):
+        esperas, self._esperas = self._esperas, []
+        for espera in esperas:
+            if not espera.done():
+                espera.set_result(None)
+
+    def leer(self, espera_maxima=30.0):
+        """Todos los textos, desde el primero, hasta que el líder termine; relanza su error."""
+        indice = 0
+        while True:
+            with self._condicion:
+                while indice >= len(self.textos) and not self.terminada:
+                    self._condicion.wait(espera_maxima)
+                nuevos = self.textos[indice:]
+                terminada, error = self.terminada, self.error
+            yield from nuevos
+            indice += len(nuevos)
+            if terminada and indice >= len(self.textos):
+                if error is not None:
+                    raise error
+                return
+
+    async def leer_async(self):
+        """Como `leer`, para suscriptores en el mismo event loop que el líder."""
+        indice = 0
+        while True:
+            while indice < len(self.textos):
+                indice += 1
+                yield self.textos[indice - 1]
+            if self.terminada:
+                if self.error is not None:
+                    raise self.error
+                return
+            espera = asyncio.get_running_loop().create_future()
+            self._esperas.append(espera)
+            await espera
+
+
+class GeneracionesEnCurso:
+    """Reparte un mismo stream de Gemini entre las peticiones con prompt idéntico que coinciden en el tiempo."""
+
+    def __init__(self, activo=True):
+        self.activo = activo
+        self._generaciones = {}
+        self._lock = threading.Lock()
+        self.lideres = 0
+        self.suscritas = 0
+
+    @staticmethod
+    def clave(modelo, contents):
+        """Hash del prompt final y de la configuración del modelo que lo va a responder."""
+        datos = json.dumps([modelo, contents], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(datos.encode('utf-8')).hexdigest()
+
+    def _unirse(self, clave):
+        """(generación, es_lider) para `clave`."""
+        with self._lock:
+            generacion = self._generaciones.get(clave)
+            if generacion is None:
+                generacion = self._generaciones[clave] = Generacion(clave)
+                self.lideres += 1
+                lider = True
+            else:
+                self.suscritas += 1
+                lider = False
+            generacion.suscriptores += 1
+        generaciones_gemini.incrementar('leader' if lider else 'subscriber')
+        return generacion, lider
+
+    def _retirar(self, generacion):
+        """Un lector menos. Devuelve True si era el último: entonces la generación sale del registro."""
+        with self._lock:
+            generacion.suscriptores -= 1
+            if generacion.suscriptores > 0:
+                return False
+            if self._generaciones.get(generacion.clave) is generacion:
+                del self._generaciones[generacion.clave]
+            return True
+
+    def _cerrar(self, generacion, error=None):
+        # Fuera del registro antes de avisar: quien llegue después abre un stream nuevo
+        with self._lock:
+            if self._generaciones.get(generacion.clave) is generacion:
+                del self._generaciones[generacion.clave]
+        generacion.terminar(error)
+
+    def generar(self, clave, abrir):
+        """Textos de la respuesta para `clave`; `abrir()` da el stream real y solo lo llama el líder.
+
+        El líder lee el stream en su propio hilo y lo publica para los suscriptores.
+        """
+        if not self.activo or clave is None:
+            yield from abrir()
+            return
+        generacion, lider = self._unirse(clave)
+        if not lider:
+            try:
+                yield from generacion.leer()
+            finally:
+                self._retirar(generacion)
+            return
+        iterador = iter(abrir())
+        try:
+            for texto in iterador:
+                generacion.publicar(texto)
+                yield texto
+        except GeneratorExit:
+            if self._retirar(generacion):
+                iterador.close()
+            else:
+                # El cliente del líder se fue pero otros esperan el resto: se termina de leer para ellos
+                self._drenar(generacion, iterador)
+            raise
+        except Exception as e:
+            self._cerrar(generacion, e)
+            raise
+        self._cerrar(generacion)
+
+    def _drenar(self, generacion, iterador):
+        try:
+            for texto in iterador:
+                generacion.publicar(texto)
+        except Exception as e:
+            self._cerrar(generacion, e)
+            return
+        self._cerrar(generacion)
+
+    async def generar_async(self, clave, abrir):
+        """Como `generar` para el stream asíncrono de Gemini.
+
+        El stream se lee en una tarea propia, así que cancelar a un lector no
+        corta a los demás; se cancela cuando se va el último.
+        """
+        if not self.activo or clave is None:
+            async for texto in abrir():
+                yield texto
+            return
+        generacion, lider = self._unirse(clave)
+        if lider:
+            generacion.tarea = asyncio.ensure_future(self._conducir_async(generacion, abrir))
+        try:
+            async for texto in generacion.leer_async():
+                yield texto
+        finally:
+            if self._retirar(generacion) and not generacion.terminada:
+                generacion.tarea.cancel()
+
+    async def _conducir_async(self, generacion, abrir):
+        try:
+            async for texto in abrir():
+                generacion.publicar(texto)
+        except asyncio.CancelledError:
+            generacion.terminar(asyncio.CancelledError())
+            raise
+        except Exception as e:
+            self._cerrar(generacion, e)
+            return
+        self._cerrar(generacion)
+
+    def estadisticas(self):
+        with self._lock:
+            en_curso = len(self._generaciones)
+        total = self.lideres + self.suscritas
+        return {
+            "enabled": self.activo,
+            "in_flight": en_curso,
+            "leaders": self.lideres,
+            "subscribers": self.suscritas,
+            "dedup_ratio": round(self.suscritas / total, 3) if total else None,
+        }
+
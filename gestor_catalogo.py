@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from catalogo_binario import abrir_catalogo_binario, es_catalogo_binario
+
+log = logging.getLogger("incalake.gestor_catalogo")
+
+
+def leer_catalogo(ruta):
+    """Lee el JSON de tours. Devuelve (tours, version); la versión es un hash del contenido.
+
+    Si `ruta` es un catálogo binario (catalogo_binario.py) devuelve el
+    CatalogoBinario mapeado y la versión del JSON del que se compiló.
+    """
+    if es_catalogo_binario(ruta):
+        return abrir_catalogo_binario(ruta)
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    return json.loads(contenido.decode('utf-8')), hashlib.sha1(contenido).hexdigest()[:12]
+
+
+@dataclass(frozen=True, slots=True)
+class SnapshotCatalogo:
+    """Todo lo derivado de una versión del catálogo; se reemplaza entero, nunca se modifica."""
+    version: str
+    # Idioma de los textos del catálogo: las consultas en otro idioma se traducen antes de buscar
+    idioma: str
+    tours: tuple
+    indice: object
+    motor: object
+    facetas: object
+    lexico: dict
+    filtros: object
+
+
+class GestorCatalogo:
+    """Mantiene el catálogo publicado y lo recarga sin reiniciar el proceso.
+
+    `construir(tours_json, version)` arma un snapshot inmutable (records,
+    índices, facetas...) fuera de cualquier lock; luego se publica con una sola
+    asignación de referencia. Quien ya tomó `actual` sigue usando su snapshot
+    hasta terminar, así que los streams en curso no ven el cambio.
+
+    La recarga se dispara por cambio de mtime del archivo (hilo de vigilancia)
+    o manualmente con `recargar()`. Cada worker vigila el archivo por su cuenta.
+    """
+
+    def __init__(self, ruta, construir, intervalo_vigilancia=5, al_publicar=None):
+        self.ruta = ruta
+        self.construir = construir
+        self.al_publicar = al_publicar
+        self.intervalo_vigilancia = intervalo_vigilancia
+        self.actual = None
+        self.generacion = 0
+        self.cargado_en = None
+        self.duracion_carga_ms = None
+        self.recargas = 0
+        self.errores = 0
+        self.ultimo_error = None
+        self._mtime = None
+        self._lock_recarga = threading.Lock()
+        self._evento_cierre = threading.Event()
+        self._hilo = None
+
+    def recargar(self, forzar=False):
+        """Construye y publica un snapshot nuevo. Devuelve True si se publicó una versión distinta."""
+        with self._lock_recarga:
+            inicio = time.perf_counter()
+            try:
+                # El mtime se toma antes de leer: un archivo inválido no se reintenta hasta que vuelva a cambiar
+                self._mtime = os.stat(self.ruta).st_mtime
+                tours_json, version = leer_catalogo(self.ruta)
+            except (OSError, ValueError) as e:  # incluye JSON y catálogo binario inválidos
+                return self._registrar_error(e)
+
+            if not forzar and self.actual is not None and version == self.actual.version:
+                return False
+
+            try:
+                snapshot = self.construir(tours_json, version)
+            except Exception as e:
+                return self._registrar_error(e)
+            del tours_json
+
+            anterior = self.actual
+            self.actual = snapshot
+            self.generacion += 1
+            self.cargado_en = time.time()
+            self.duracion_carga_ms = round((time.perf_counter() - inicio) * 1000, 1)
+            if anterior is not None:
+                self.recargas += 1
+            if self.al_publicar:
+                self.al_publicar(snapshot)
+            log.info(
+                f"✅ {len(snapshot.tours)} tours cargados desde {os.path.basename(self.ruta)} "
+                f"(versión {version}, generación {self.generacion}, {self.duracion_carga_ms} ms)"
+            )
+            return True
+
+    def _registrar_error(self, error):
+        self.errores += 1
+        self.ultimo_error = str(error)
+        if self.actual is None:
+            # Sin catálogo previo se arranca vacío; la vigilancia lo cargará cuando el archivo sea válido
+            log.error(f"❌ Error al cargar el catálogo {self.ruta}: {error}")
+            self.actual = self.construir([], "empty")
+        else:
+            log.error(f"❌ Error al recargar el catálogo, se mantiene la versión {self.actual.version}: {error}")
+        return False
+
+    def cambio_en_disco(self):
+        try:
+            return os.stat(self.ruta).st_mtime != self._mtime
+        except OSError:
+            return False
+
+    def _bucle(self):
+        while not self._evento_cierre.wait(self.intervalo_vigilancia):
+            if self.cambio_en_disco():
+                self.recargar()
+
+    def iniciar(self):
+        if self._hilo is None and self.intervalo_vigilancia > 0:
+            self._hilo = threading.Thread(target=self._bucle, name="catalog-watcher", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._evento_cierre.set()
+
+    def estadisticas(self):
+        return {
+            "catalog_version": self.actual.version if self.actual else None,
+            "catalog_generation": self.generacion,
+            "catalog_loaded_at": self.cargado_en,
+            "catalog_load_ms": self.duracion_carga_ms,
+            "catalog_reloads": self.recargas,
+            "catalog_errors": self.errores,
+            "catalog_last_error": self.ultimo_error,
+        }
@@ -0,0 +1,29 @@
+"""Configuración de gunicorn con precarga copy-on-write del catálogo.
+
+    gunicorn "app:create_app()"
+
+gunicorn lee este archivo desde el directorio de trabajo. El master importa
+app.py y construye el catálogo y sus índices (precargar) una sola vez; cada
+worker hereda esas páginas por copy-on-write y en create_app() solo crea su
+estado propio: sesiones, traductor, hilos de fondo y, con la primera
+petición, los modelos de Gemini.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# La app se crea dentro de cada worker (hilos y conexiones no sobreviven a un fork);
+# lo que sí se comparte se precarga en on_starting
+preload_app = False
+
+
+def on_starting(server):
+    import app
+
+    app.precargar()
+    # Lo construido hasta aquí pasa a la generación permanente: el GC de los workers
+    # no lo recorre ni escribe en sus cabeceras, así esas páginas siguen compartidas
+    gc.freeze()
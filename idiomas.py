@@ -0,0 +1,203 @@
+"""Registro de idiomas: catálogo, tokenizador e índice propios de cada mercado.
+
+Un idioma con catálogo nativo (TOURS_PATH_<IDIOMA>, la clave "catalog" de su
+configuración o tours_<idioma>.incat / tours_<idioma>.json junto a app.py)
+se busca en su propio índice con sus propias keywords, sin pasar por el
+traductor. Esos catálogos no se precargan: cada uno se construye con la
+primera consulta de su idioma, con su propio GestorCatalogo, y se libera
+tras LANGUAGE_IDLE_SECONDS sin consultas. Así sumar mercados no alarga el
+arranque ni ocupa memoria en los workers que no los atienden; compilados al
+formato binario (catalogo_binario.py) además comparten las páginas del mapeo.
+
+Los idiomas sin catálogo propio usan el catálogo base (inglés) y traducen las
+keywords, como hasta ahora. Los idiomas nuevos (textos, stopwords y
+tokenizador) se declaran en idiomas.json sin tocar el código.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from catalogo_binario import bytes_mapeados
+from instrumentacion import tamano_profundo
+
+log = logging.getLogger("incalake.idiomas")
+
+# Idioma del catálogo base (TOURS_PATH); el resto se traduce a él si no tiene catálogo propio
+IDIOMA_BASE = 'en'
+CAMPOS_OBLIGATORIOS = (
+    'stopwords', 'system_instruction', 'greeting', 'error_message', 'no_tours_message', 'general_response_template',
+)
+# La memoria de un snapshot se vuelve a medir como mucho con esta frecuencia
+INTERVALO_MEDICION_MEMORIA = 60
+
+
+def cargar_idiomas_extra(ruta):
+    """Lee configuraciones de idiomas adicionales (pt, fr, de...) desde un JSON."""
+    if not ruta or not os.path.exists(ruta):
+        return {}
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            idiomas = json.load(f).get("languages", {})
+    except (json.JSONDecodeError, IOError) as e:
+        log.warning(f"⚠️ No se pudieron cargar los idiomas de {ruta}: {e}")
+        return {}
+    configs = {}
+    for codigo, config in idiomas.items():
+        faltantes = [campo for campo in CAMPOS_OBLIGATORIOS if campo not in config]
+        if faltantes:
+            log.warning(f"⚠️ Idioma '{codigo}' ignorado, le falta: {', '.join(faltantes)}")
+            continue
+        configs[codigo] = {**config, 'stopwords': set(config['stopwords'])}
+    return configs
+
+
+def tokenizador_de(codigo, config):
+    """El inglés se tokeniza como siempre; los demás idiomas, sin tildes (ver indice_tours.TOKENIZADORES)."""
+    return config.get('tokenizer') or ('simple' if codigo == IDIOMA_BASE else 'plegado')
+
+
+def ruta_catalogo_nativo(codigo, config, directorio):
+    """Archivo con los tours escritos en ese idioma, o None si no hay."""
+    ruta = os.getenv(f"TOURS_PATH_{codigo.upper()}") or config.get('catalog')
+    if ruta:
+        return os.path.join(directorio, ruta)
+    for extension in ('.incat', '.json'):
+        candidata = os.path.join(directorio, f"tours_{codigo}{extension}")
+        if os.path.exists(candidata):
+            return candidata
+    return None
+
+
+class EntradaIdioma:
+    """Estado de un idioma con catálogo nativo; `gestor` es None mientras no está cargado."""
+
+    __slots__ = ('codigo', 'ruta', 'gestor', 'ultimo_uso', 'cargas', 'desalojos', 'lock', 'memoria')
+
+    def __init__(self, codigo, ruta):
+        self.codigo = codigo
+        self.ruta = ruta
+        self.gestor = None
+        self.ultimo_uso = 0.0
+        self.cargas = 0
+        self.desalojos = 0
+        self.lock = threading.Lock()
+        self.memoria = None  # (snapshot medido, bytes, medido_en)
+
+
+class RegistroIdiomas:
+    """Catálogos nativos por idioma, cargados con la primera consulta y liberados sin uso.
+
+    `fabrica_gestor(codigo, ruta)` crea el GestorCatalogo de un idioma (sin
+    cargar). `base` es el gestor del catálogo base: no se desaloja y solo
+    aparece en las estadísticas.
+    """
+
+    def __init__(self, rutas, fabrica_gestor, base=None, inactividad_segundos=1800, intervalo_barrido=60):
+        self.fabrica_gestor = fabrica_gestor
+        self.base = base
+        self.inactividad_segundos = inactividad_segundos
+        self.intervalo_barrido = intervalo_barrido
+        self._entradas = {codigo: EntradaIdioma(codigo, ruta) for codigo, ruta in rutas.items() if ruta}
+        self._entrada_base = EntradaIdioma(IDIOMA_BASE, base.ruta if base else None)
+        self._ultimo_barrido = time.monotonic()
+        self._lock_barrido = threading.Lock()
+
+    def __contains__(self, codigo):
+        return codigo in self._entradas
+
+    def catalogo(self, codigo):
+        """Snapshot del catálogo nativo del idioma, o None si no tiene (o no se pudo cargar)."""
+        entrada = self._entradas.get(codigo)
+        if entrada is None:
+            return None
+        ahora = time.monotonic()
+        entrada.ultimo_uso = ahora
+        gestor = entrada.gestor
+        if gestor is None:
+            gestor = self._cargar(entrada)
+        if ahora - self._ultimo_barrido >= self.intervalo_barrido:
+            self.desalojar_inactivos(ahora)
+        snapshot = gestor.actual
+        # Un catálogo nativo vacío o ilegible no debe dejar al idioma sin tours: se usa el base
+        return snapshot if snapshot.tours else None
+
+    def _cargar(self, entrada):
+        # Un lock por idioma: la primera ola de consultas en portugués construye un solo catálogo
+        with entrada.lock:
+            if entrada.gestor is None:
+                inicio = time.perf_counter()
+                gestor = self.fabrica_gestor(entrada.codigo, entrada.ruta)
+                gestor.recargar()
+                gestor.iniciar()
+                entrada.gestor = gestor
+                entrada.cargas += 1
+                log.info(f"🌍 Catálogo '{entrada.codigo}' cargado bajo demanda en "
+                         f"{(time.perf_counter() - inicio) * 1000:.1f} ms")
+            return entrada.gestor
+
+    def desalojar_inactivos(self, ahora=None):
+        """Libera los catálogos sin consultas en `inactividad_segundos`. Devuelve cuántos se liberaron."""
+        if self.inactividad_segundos <= 0 or not self._lock_barrido.acquire(blocking=False):
+            return 0
+        try:
+            ahora = ahora if ahora is not None else time.monotonic()
+            self._ultimo_barrido = ahora
+            liberados = 0
+            for entrada in self._entradas.values():
+                if entrada.gestor is None or ahora - entrada.ultimo_uso < self.inactividad_segundos:
+                    continue
+                with entrada.lock:
+                    if entrada.gestor is None or ahora - entrada.ultimo_uso < self.inactividad_segundos:
+                        continue
+                    # Las peticiones en curso conservan su snapshot; el resto se libera con la última
+                    entrada.gestor.detener()
+                    entrada.gestor = None
+                    entrada.memoria = None
+                    entrada.desalojos += 1
+                    liberados += 1
+                log.info(f"🧹 Catálogo '{entrada.codigo}' liberado tras {ahora - entrada.ultimo_uso:.0f}s sin uso")
+            return liberados
+        finally:
+            self._lock_barrido.release()
+
+    def _memoria(self, entrada, snapshot):
+        """Bytes del snapshot en el heap de este proceso, medidos de nuevo solo si cambió o envejeció."""
+        medida = entrada.memoria
+        if medida is None or medida[0] is not snapshot or time.monotonic() - medida[2] > INTERVALO_MEDICION_MEMORIA:
+            medida = entrada.memoria = (snapshot, tamano_profundo(snapshot), time.monotonic())
+        return medida[1]
+
+    def _estadisticas_snapshot(self, entrada, gestor):
+        snapshot = gestor.actual
+        return {
+            "catalog_path": os.path.basename(gestor.ruta),
+            "catalog_version": snapshot.version,
+            "tours": len(snapshot.tours),
+            "tokenizer": snapshot.indice.tokenizador,
+            "heap_bytes": self._memoria(entrada, snapshot),
+            # Páginas del archivo mapeado: compartidas entre workers, fuera del heap
+            "mapped_bytes": bytes_mapeados(snapshot.tours),
+        }
+
+    def estadisticas(self):
+        """Por idioma: si está cargado, uso, cargas/desalojos y memoria de su catálogo."""
+        ahora = time.monotonic()
+        idiomas = {}
+        if self.base is not None and self.base.actual is not None:
+            idiomas[IDIOMA_BASE] = {"loaded": True, "pinned": True,
+                                    **self._estadisticas_snapshot(self._entrada_base, self.base)}
+        for codigo, entrada in self._entradas.items():
+            gestor = entrada.gestor
+            datos = {
+                "loaded": gestor is not None,
+                "catalog_path": os.path.basename(entrada.ruta),
+                "idle_seconds": round(ahora - entrada.ultimo_uso, 1) if entrada.cargas else None,
+                "loads": entrada.cargas,
+                "evictions": entrada.desalojos,
+            }
+            if gestor is not None and gestor.actual is not None:
+                datos.update(self._estadisticas_snapshot(entrada, gestor))
+            idiomas[codigo] = datos
+        return idiomas
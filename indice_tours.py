@@ -0,0 +1,240 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import defaultdict
+
+PESO_TITULO = 5
+PESO_CUERPO = 1
+BONUS_PUNO = 10
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenizar(texto):
+    """Divide un texto en términos en minúsculas."""
+    return _TOKEN_RE.findall(texto.lower())
+
+
+def tokenizar_plegado(texto):
+    """Como `tokenizar` pero sin tildes ni diéresis: 'días', 'dias' y 'DÍAS' son el mismo término."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return _TOKEN_RE.findall(''.join(c for c in texto if not unicodedata.combining(c)))
+
+
+# Tokenizador de cada idioma (ver idiomas.py); el nombre viaja en el catálogo binario
+TOKENIZADORES = {'simple': tokenizar, 'plegado': tokenizar_plegado}
+
+
+class IndiceTours:
+    """Índice invertido del catálogo, construido una sola vez al cargar los tours.
+
+    Mantiene postings separados para el título y el cuerpo (título + tipo de
+    servicio + descripción) para conservar la ponderación 5/1, junto con el
+    bonus de Puno y la puntuación por prioridad ya calculados por tour.
+
+    Con un catálogo binario los postings y longitudes ya vienen construidos
+    (mappings de solo lectura sobre el archivo) y no se tokeniza nada.
+
+    `tokenizador` (clave de TOKENIZADORES) se usa para el catálogo y para las
+    consultas, así ambos lados normalizan igual en cada idioma.
+    """
+
+    def __init__(self, tours, postings_titulo=None, postings_cuerpo=None, longitudes=None, tokenizador='simple'):
+        self.tours = tuple(tours)
+        self.tokenizador = tokenizador
+        self._tokenizar = TOKENIZADORES[tokenizador]
+        self.bonus_puno = [BONUS_PUNO if tour.es_puno else 0 for tour in self.tours]
+        self.puntos_prioridad = [6 - tour.prioridad for tour in self.tours]
+
+        if postings_cuerpo is not None:
+            self.postings_titulo = postings_titulo
+            self.postings_cuerpo = postings_cuerpo
+            self.longitudes = longitudes
+        else:
+            self._construir_postings()
+
+        # Todos los tours por su puntuación base (Puno primero, luego prioridad); los de
+        # Puno son candidatos aunque no compartan ningún término con la consulta.
+        self.por_puntuacion = sorted(
+            range(len(self.tours)),
+            key=lambda doc_id: (-(self.bonus_puno[doc_id] + self.puntos_prioridad[doc_id]), doc_id)
+        )
+        self.puno_por_puntuacion = [doc_id for doc_id in self.por_puntuacion if self.bonus_puno[doc_id]]
+
+    def _construir_postings(self):
+        # término -> {id_tour: frecuencia}
+        postings_titulo = defaultdict(dict)
+        postings_cuerpo = defaultdict(dict)
+        self.longitudes = []
+        for doc_id, tour in enumerate(self.tours):
+            titulo = tour.titulo
+            cuerpo = titulo + " " + tour.tipo_servicio + " " + tour.descripcion
+            for termino in self._tokenizar(titulo):
+                postings = postings_titulo[termino]
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+            terminos_cuerpo = self._tokenizar(cuerpo)
+            for termino in terminos_cuerpo:
+                postings = postings_cuerpo[termino]
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+            self.longitudes.append(len(terminos_cuerpo))
+        self.postings_titulo = dict(postings_titulo)
+        self.postings_cuerpo = dict(postings_cuerpo)
+
+    def __len__(self):
+        return len(self.tours)
+
+    def terminos_consulta(self, keywords):
+        """Normaliza las keywords de la consulta a términos del índice."""
+        terminos = []
+        for keyword in keywords:
+            for termino in self._tokenizar(keyword):
+                if termino not in terminos:
+                    terminos.append(termino)
+        return terminos
+
+    def tiene_coincidencias(self, keywords):
+        """True si algún término de la consulta aparece en el catálogo."""
+        return any(termino in self.postings_cuerpo for termino in self.terminos_consulta(keywords))
+
+    def completar_con_puno(self, scored, vistos, limite, candidatos=None):
+        """Agrega los mejores tours de Puno que no coincidieron con la consulta.
+
+        Con `candidatos` (tours que cumplen los filtros de la consulta) se
+        completa con los mejores de ese conjunto, sean o no de Puno.
+        """
+        orden = self.puno_por_puntuacion if candidatos is None else self.por_puntuacion
+        extra = []
+        for doc_id in orden:
+            if len(extra) == limite:
+                break
+            if doc_id not in vistos and (candidatos is None or doc_id in candidatos):
+                extra.append((self.bonus_puno[doc_id] + self.puntos_prioridad[doc_id], doc_id))
+        return scored + extra
+
+
+# === Motores de Ranking ===
+class RankingHeuristico:
+    """Ranking original: +5 por keyword en el título, +1 en el cuerpo, bonus Puno y prioridad."""
+
+    def __init__(self, indice):
+        self.indice = indice
+
+    def puntuar(self, keywords):
+        """Devuelve [(score, doc_id)] ordenado, tocando solo tours con términos en común."""
+        indice = self.indice
+        coincidencias = {}
+        for termino in indice.terminos_consulta(keywords):
+            en_titulo = indice.postings_titulo.get(termino, {})
+            for doc_id in indice.postings_cuerpo.get(termino, ()):
+                peso = PESO_TITULO if doc_id in en_titulo else PESO_CUERPO
+                coincidencias[doc_id] = coincidencias.get(doc_id, 0) + peso
+
+        scored = [
+            (score + indice.bonus_puno[doc_id] + indice.puntos_prioridad[doc_id], doc_id)
+            for doc_id, score in coincidencias.items()
+        ]
+        return sorted(scored, key=lambda x: (-x[0], x[1]))
+
+    def buscar(self, keywords, limite=3, candidatos=None):
+        """Devuelve los `limite` mejores [(score, doc_id)] incluyendo los tours de Puno sin coincidencias.
+
+        `candidatos` restringe el resultado a un conjunto de doc_ids (filtros de precio, duración...).
+        """
+        scored = self.puntuar(keywords)
+        if candidatos is not None:
+            scored = [(score, doc_id) for score, doc_id in scored if doc_id in candidatos]
+        vistos = {doc_id for _, doc_id in scored}
+        scored = self.indice.completar_con_puno(scored[:limite], vistos, limite, candidatos)
+        return sorted(scored, key=lambda x: (-x[0], x[1]))[:limite]
+
+
+class RankingBM25:
+    """Ranking BM25 con ponderación por campo y re-ranking configurable.
+
+    Los pesos BM25 de cada par (término, tour) se calculan la primera vez que
+    se consulta el término y quedan en caché, así que puntuar una consulta es
+    sumar columnas dispersas: el equivalente a multiplicar la matriz
+    término-documento por el vector de la consulta. El bonus de Puno y la
+    prioridad se suman después como términos de re-ranking.
+    """
+
+    def __init__(self, indice, k1=1.2, b=0.75, peso_titulo=3.0, bonus_puno=2.0, peso_prioridad=1.0):
+        self.indice = indice
+        self.k1 = k1
+        self.b = b
+        self.peso_titulo = peso_titulo
+        self.bonus_puno = bonus_puno
+        self.peso_prioridad = peso_prioridad
+
+        n_docs = len(indice)
+        self.promedio = (sum(indice.longitudes) / n_docs) if n_docs else 0.0
+        # término -> ((doc_id, ...), (peso, ...)); acotada por el vocabulario del catálogo
+        self.pesos = {}
+
+        self.reranking = [
+            self.bonus_puno * (1 if indice.bonus_puno[doc_id] else 0) +
+            self.peso_prioridad * indice.puntos_prioridad[doc_id]
+            for doc_id in range(n_docs)
+        ]
+
+    def pesos_termino(self, termino):
+        """Columna dispersa ((doc_id, ...), (peso, ...)) de un término; vacía si no está en el catálogo."""
+        columna = self.pesos.get(termino)
+        if columna is not None:
+            return columna
+        indice = self.indice
+        postings = indice.postings_cuerpo.get(termino)
+        if not postings:
+            return (), ()
+        en_titulo = indice.postings_titulo.get(termino, {})
+        n_docs = len(indice)
+        idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+        doc_ids = []
+        pesos = []
+        for doc_id, tf_cuerpo in postings.items():
+            tf = tf_cuerpo + self.peso_titulo * en_titulo.get(doc_id, 0)
+            norma = self.k1 * (1 - self.b + self.b * indice.longitudes[doc_id] / self.promedio)
+            doc_ids.append(doc_id)
+            pesos.append(idf * tf * (self.k1 + 1) / (tf + norma))
+        columna = self.pesos[termino] = (tuple(doc_ids), tuple(pesos))
+        return columna
+
+    def puntuar(self, keywords):
+        """Devuelve {doc_id: score} para los tours con términos en común."""
+        scores = {}
+        for termino in self.indice.terminos_consulta(keywords):
+            doc_ids, pesos = self.pesos_termino(termino)
+            for doc_id, peso in zip(doc_ids, pesos):
+                scores[doc_id] = scores.get(doc_id, 0.0) + peso
+        for doc_id in scores:
+            scores[doc_id] += self.reranking[doc_id]
+        return scores
+
+    def buscar(self, keywords, limite=3, candidatos=None):
+        """Devuelve los `limite` mejores [(score, doc_id)] sin ordenar todos los resultados.
+
+        `candidatos` restringe el resultado a un conjunto de doc_ids (filtros de precio, duración...).
+        """
+        scores = self.puntuar(keywords)
+        if candidatos is not None:
+            scores = {doc_id: score for doc_id, score in scores.items() if doc_id in candidatos}
+        mejores = heapq.nsmallest(limite, ((-score, doc_id) for doc_id, score in scores.items()))
+        scored = [(-score, doc_id) for score, doc_id in mejores]
+        if len(scored) < limite:
+            # Sin suficientes coincidencias recomendamos nuestra especialidad (o lo mejor que cumple los filtros)
+            scored = self.indice.completar_con_puno(scored, set(scores), limite, candidatos)[:limite]
+        return scored
+
+
+MOTORES_RANKING = {
+    'heuristico': RankingHeuristico,
+    'bm25': RankingBM25,
+}
+
+
+def crear_motor(nombre, indice, **config):
+    """Crea el motor de ranking `nombre` sobre el índice dado."""
+    if nombre not in MOTORES_RANKING:
+        raise ValueError(f"Motor de ranking desconocido: {nombre}")
+    return MOTORES_RANKING[nombre](indice, **config)
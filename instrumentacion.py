@@ -0,0 +1,249 @@
+"""Instrumentación del chatbot: timers por etapa, métricas Prometheus y logging.
+
+Las métricas viven en memoria de cada proceso (con gunicorn, cada worker
+expone las suyas en /metrics). El logging usa el logger "incalake" con nivel
+configurable (LOG_LEVEL, OFF lo apaga) y muestreo por petición
+(LOG_SAMPLE_RATE): en una petición no muestreada solo salen WARNING y ERROR.
+"""
+import bisect
+import contextvars
+import gc
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# === Logging nivelado y muestreado ===
+_peticion_muestreada = contextvars.ContextVar("peticion_muestreada", default=True)
+TASA_MUESTREO = 1.0
+
+
+class FiltroMuestreo(logging.Filter):
+    """Descarta los mensajes informativos de las peticiones que no salieron en la muestra."""
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or _peticion_muestreada.get()
+
+
+def configurar_logging(nivel=None, tasa_muestreo=None):
+    """Configura el logger "incalake" una sola vez por proceso."""
+    global TASA_MUESTREO
+    nivel = (nivel or os.getenv("LOG_LEVEL", "INFO")).upper()
+    TASA_MUESTREO = float(os.getenv("LOG_SAMPLE_RATE", "1.0")) if tasa_muestreo is None else tasa_muestreo
+
+    logger = logging.getLogger("incalake")
+    logger.setLevel(logging.CRITICAL + 1 if nivel == "OFF" else getattr(logging, nivel, logging.INFO))
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        handler.addFilter(FiltroMuestreo())
+        logger.addHandler(handler)
+    return logger
+
+
+def iniciar_muestreo():
+    """Decide al inicio de una petición si sus logs informativos se emiten."""
+    muestreada = TASA_MUESTREO >= 1.0 or random.random() < TASA_MUESTREO
+    _peticion_muestreada.set(muestreada)
+    return muestreada
+
+
+# === Métricas estilo Prometheus ===
+def _formatear_etiquetas(nombres, valores, extra=None):
+    pares = [f'{nombre}="{valor}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Histograma:
+    """Histograma con etiquetas; `observar` cuesta un bisect y un lock."""
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}  # valores de etiquetas -> [conteos por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_etiquetas):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = self._series[valores_etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = {clave: (list(s[0]), s[1], s[2]) for clave, s in self._series.items()}
+        for valores, (conteos, suma, total) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + ("+Inf",), conteos):
+                acumulado += conteo
+                etiquetas = _formatear_etiquetas(self.etiquetas, valores, f'le="{limite}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, valores)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {suma:.6f}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {total}")
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *valores_etiquetas, cantidad=1):
+        with self._lock:
+            self._valores[valores_etiquetas] = self._valores.get(valores_etiquetas, 0) + cantidad
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for etiquetas, valor in valores:
+            lineas.append(f"{self.nombre}{_formatear_etiquetas(self.etiquetas, etiquetas)} {valor}")
+        return lineas
+
+
+class RegistroMetricas:
+    """Conjunto de métricas del proceso más medidores calculados al exportar."""
+
+    def __init__(self):
+        self._metricas = []
+        self._medidores = []  # (nombre, ayuda, función sin argumentos)
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        metrica = Histograma(nombre, ayuda, etiquetas, buckets)
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        metrica = Contador(nombre, ayuda, etiquetas)
+        self._metricas.append(metrica)
+        return metrica
+
+    def medidor(self, nombre, ayuda, funcion, etiqueta=None):
+        """Valor instantáneo (tamaño de caché, sesiones activas...) leído en cada scrape.
+
+        Con `etiqueta` la función devuelve {valor de la etiqueta: valor}, una serie por clave.
+        """
+        self._medidores.append((nombre, ayuda, funcion, etiqueta))
+
+    def exportar(self):
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exportar())
+        for nombre, ayuda, funcion, etiqueta in self._medidores:
+            try:
+                valor = funcion()
+            except Exception:
+                continue
+            if valor is None:
+                continue
+            lineas.extend([f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} gauge"])
+            if etiqueta is None:
+                lineas.append(f"{nombre} {valor}")
+                continue
+            for clave, valor_serie in sorted(valor.items()):
+                if valor_serie is not None:
+                    lineas.append(f"{nombre}{_formatear_etiquetas((etiqueta,), (clave,))} {valor_serie}")
+        return "\n".join(lineas) + "\n"
+
+
+registro = RegistroMetricas()
+
+duracion_etapas = registro.histograma(
+    "incalake_chat_stage_seconds",
+    "Duración de cada etapa del pipeline de /chat",
+    etiquetas=("stage",),
+)
+peticiones_chat = registro.contador(
+    "incalake_chat_requests_total",
+    "Peticiones a /chat por resultado",
+    etiquetas=("result",),
+)
+
+
+# === Memoria del proceso ===
+_CAMPOS_SMAPS = {"Rss": "rss_kb", "Pss": "pss_kb", "Shared_Clean": "shared_clean_kb",
+                 "Shared_Dirty": "shared_dirty_kb", "Private_Clean": "private_clean_kb",
+                 "Private_Dirty": "private_dirty_kb"}
+
+
+def memoria_proceso(pid="self"):
+    """RSS, PSS y memoria privada en KB leídos de /proc/<pid>/smaps_rollup.
+
+    La memoria privada es lo que un worker no comparte con el master ni con
+    otros workers; la PSS reparte lo compartido entre quienes lo usan. Fuera
+    de Linux solo se informa el pico de RSS de este proceso.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lineas = f.readlines()
+    except OSError:
+        if pid != "self":
+            return {}
+        import resource
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"max_rss_kb": maximo // 1024 if sys.platform == "darwin" else maximo}
+    memoria = {}
+    for linea in lineas:
+        campo, _, valor = linea.partition(":")
+        if campo in _CAMPOS_SMAPS:
+            memoria[_CAMPOS_SMAPS[campo]] = int(valor.split()[0])
+    memoria["private_kb"] = memoria.get("private_clean_kb", 0) + memoria.get("private_dirty_kb", 0)
+    return memoria
+
+
+# Compartidos por todo el proceso: no cuentan como memoria de un objeto
+_NO_RECORRER = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def tamano_profundo(raiz):
+    """Bytes aproximados de todo lo alcanzable desde `raiz` (cada objeto una sola vez).
+
+    Suma sys.getsizeof recorriendo gc.get_referents, sin entrar en módulos,
+    clases ni funciones. Los buffers de un mmap no se cuentan: son páginas del
+    archivo, compartidas entre procesos.
+    """
+    vistos = set()
+    pendientes = [raiz]
+    total = 0
+    while pendientes:
+        objeto = pendientes.pop()
+        if id(objeto) in vistos or isinstance(objeto, _NO_RECORRER):
+            continue
+        vistos.add(id(objeto))
+        total += sys.getsizeof(objeto)
+        pendientes.extend(gc.get_referents(objeto))
+    return total
+
+
+def observar_etapa(etapa, segundos):
+    duracion_etapas.observar(segundos, etapa)
+
+
+@contextmanager
+def medir_etapa(etapa):
+    """`with medir_etapa('retrieval'): ...` registra la duración en el histograma de etapas."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion_etapas.observar(time.perf_counter() - inicio, etapa)
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import re
+
+log = logging.getLogger("incalake.intenciones")
+
+# === Intenciones base ===
+# Menciones de Puno/Titicaca (nuestra especialidad): coincidencia por subcadena
+PUNO_KEYWORDS_INTENCION = ['puno', 'titicaca', 'uros', 'taquile', 'amantani', 'floating islands', 'islas flotantes']
+
+# Patrones para preguntas muy generales
+PATRONES_GENERALES = {
+    'es': [
+        r'\b(info|información)\s+(sobre\s+)?tours?\b',
+        r'\btours?\s+(disponibles?|que\s+tienen?)\b',
+        r'\bqué\s+tours?\s+(hay|tienen|ofrecen)\b',
+        r'\bque\s+actividades?\s+(hay|tienen|ofrecen)\b',
+        r'\bque\s+hacer\s+en\s+(perú|peru)\b',
+        r'\bturismo\s+en\s+(perú|peru)\b',
+        r'^(hola|hello|buenos?\s+días?|buenas?\s+tardes?)',
+        r'\bpaquetes?\s+turísticos?\b',
+        r'\brecomendaciones?\b'
+    ],
+    'en': [
+        r'\binfo\s+(about\s+)?tours?\b',
+        r'\btours?\s+(available|you\s+have)\b',
+        r'\bwhat\s+tours?\s+(do\s+you\s+have|are\s+available)\b',
+        r'\bwhat\s+activities?\s+(do\s+you\s+have|are\s+available)\b',
+        r'\bwhat\s+to\s+do\s+in\s+peru\b',
+        r'\btourism\s+in\s+peru\b',
+        r'^(hi|hello|good\s+morning|good\s+afternoon)',
+        r'\btravel\s+packages?\b',
+        r'\brecommendations?\b'
+    ]
+}
+
+INTENCIONES_BASE = [
+    {
+        "name": "specific_puno",
+        "priority": 10,
+        "mode": "specific",
+        "patterns": {
+            language: [re.escape(keyword) for keyword in PUNO_KEYWORDS_INTENCION]
+            for language in PATRONES_GENERALES
+        },
+    },
+    {
+        "name": "general",
+        "priority": 40,
+        "mode": "general",
+        "patterns": PATRONES_GENERALES,
+    },
+]
+
+INTENCION_POR_DEFECTO = 'specific'
+
+
+def cargar_intenciones_extra(ruta):
+    """Lee intenciones adicionales (reservas, precios, derivación a humano...) desde un JSON."""
+    if not ruta or not os.path.exists(ruta):
+        return []
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            return json.load(f).get("intents", [])
+    except (json.JSONDecodeError, IOError) as e:
+        log.warning(f"⚠️ No se pudieron cargar las intenciones de {ruta}: {e}")
+        return []
+
+
+class MotorIntenciones:
+    """Clasificador de intención con los patrones de cada idioma precompilados.
+
+    Cada intención se compila una sola vez en una alternancia por idioma y se
+    prueban en orden de `priority` (menor primero): el primer acierto decide.
+    """
+
+    def __init__(self, intenciones, language_por_defecto='es'):
+        self.language_por_defecto = language_por_defecto
+        ordenadas = sorted(intenciones, key=lambda i: i.get("priority", 100))
+        self.intenciones = {intencion["name"]: intencion for intencion in ordenadas}
+        self._regex = {}  # language -> [(nombre, patrón compilado)] por prioridad
+
+        languages = {language for i in ordenadas for language in i.get("patterns", {})}
+        for language in languages:
+            self._regex[language] = [
+                (intencion["name"], re.compile("|".join(f"(?:{p})" for p in intencion["patterns"][language])))
+                for intencion in ordenadas
+                if intencion["patterns"].get(language)
+            ]
+
+    def detectar(self, texto, language='es'):
+        """Devuelve el nombre de la intención de mayor prioridad presente en el texto."""
+        texto = texto.lower()
+        for nombre, regex in self._regex.get(language) or self._regex[self.language_por_defecto]:
+            if regex.search(texto):
+                return nombre
+        return INTENCION_POR_DEFECTO
+
+    def modo(self, intencion):
+        """'specific' (con contexto de tours), 'general' (sin búsqueda) o 'handoff' (derivar a una persona)."""
+        definicion = self.intenciones.get(intencion)
+        return definicion.get("mode", "specific") if definicion else "specific"
+
+    def busca_tours(self, intencion):
+        """True si la intención lleva contexto de tours en el prompt."""
+        return self.modo(intencion) == 'specific'
+
+    def pista(self, intencion, language):
+        """Indicación extra para el prompt definida por la intención, si existe."""
+        definicion = self.intenciones.get(intencion) or {}
+        return definicion.get("prompt_hint", {}).get(language)
@@ -0,0 +1,142 @@
+import re
+import threading
+
+_URL_RE = re.compile(r'https?://[^\s)\]"]+')
+
+MAX_CARACTERES_PREGUNTA_RESUMEN = 120
+
+ETIQUETAS_RESUMEN = {
+    'es': {
+        'titulo': "Resumen de la conversación anterior:",
+        'usuario': "Usuario",
+        'recomendados': "se recomendó",
+        'respondido': "se respondió sin enlaces",
+    },
+    'en': {
+        'titulo': "Summary of the earlier conversation:",
+        'usuario': "User",
+        'recomendados': "recommended",
+        'respondido': "answered without links",
+    },
+}
+
+
+def estimar_tokens(texto):
+    """Estimación local de tokens (~4 bytes UTF-8 por token), sin llamar a la API."""
+    return (len(texto.encode('utf-8')) + 3) // 4
+
+
+def tokens_mensajes(mensajes):
+    return sum(estimar_tokens(parte) for mensaje in mensajes for parte in mensaje["parts"])
+
+
+def _pares(historial):
+    """Agrupa el historial en turnos [user, model] (un mensaje suelto queda como turno propio)."""
+    pares = []
+    i = 0
+    while i < len(historial):
+        if historial[i]["role"] == "user" and i + 1 < len(historial) and historial[i + 1]["role"] == "model":
+            pares.append(historial[i:i + 2])
+            i += 2
+        else:
+            pares.append(historial[i:i + 1])
+            i += 1
+    return pares
+
+
+def resumir_turnos(turnos, language='es'):
+    """Resumen extractivo de turnos antiguos: la pregunta recortada y los enlaces recomendados."""
+    etiquetas = ETIQUETAS_RESUMEN.get(language, ETIQUETAS_RESUMEN['es'])
+    lineas = [etiquetas['titulo']]
+    for turno in turnos:
+        pregunta = next((m["parts"][0] for m in turno if m["role"] == "user"), "")
+        respuesta = next((m["parts"][0] for m in turno if m["role"] == "model"), "")
+        pregunta = " ".join(pregunta.split())
+        if len(pregunta) > MAX_CARACTERES_PREGUNTA_RESUMEN:
+            pregunta = pregunta[:MAX_CARACTERES_PREGUNTA_RESUMEN] + "..."
+        urls = list(dict.fromkeys(_URL_RE.findall(respuesta)))
+        detalle = f"{etiquetas['recomendados']}: {', '.join(urls)}" if urls else etiquetas['respondido']
+        lineas.append(f"- {etiquetas['usuario']}: \"{pregunta}\" → {detalle}")
+    return "\n".join(lineas)
+
+
+class EnsambladorPrompt:
+    """Arma el `contents` de Gemini dentro de un presupuesto de tokens.
+
+    La instrucción de sistema viaja en el `system_instruction` del modelo, no
+    en los mensajes. La consulta actual siempre entra; el historial se agrega
+    del turno más reciente al más antiguo mientras quepa, y los turnos que no
+    caben se comprimen en un resumen que antecede a los turnos conservados.
+    """
+
+    def __init__(self, presupuesto_tokens=3000, max_tokens_resumen=400):
+        self.presupuesto_tokens = presupuesto_tokens
+        self.max_tokens_resumen = max_tokens_resumen
+        self._lock = threading.Lock()
+        self.peticiones = 0
+        self.tokens_enviados = 0
+        self.tokens_formato_anterior = 0
+        self.turnos_resumidos = 0
+
+    def ensamblar(self, historial_previo, prompt_actual, language='es', tokens_instruccion=0):
+        """Devuelve (contents, medidas) para una petición."""
+        tokens_prompt = estimar_tokens(prompt_actual)
+        disponibles = self.presupuesto_tokens - tokens_prompt
+
+        pares = _pares(historial_previo)
+        conservados = []
+        tokens_historial = 0
+        for par in reversed(pares):
+            tokens_par = tokens_mensajes(par)
+            if tokens_historial + tokens_par > disponibles:
+                break
+            conservados.insert(0, par)
+            tokens_historial += tokens_par
+        antiguos = pares[:len(pares) - len(conservados)]
+
+        contents = [{"role": m["role"], "parts": list(m["parts"])} for par in conservados for m in par]
+        resumen = ""
+        if antiguos:
+            resumen = resumir_turnos(antiguos, language)
+            # Si el resumen excede su tope se quedan las líneas más recientes
+            lineas = resumen.split("\n")
+            while len(lineas) > 2 and estimar_tokens("\n".join(lineas)) > self.max_tokens_resumen:
+                del lineas[1]
+            resumen = "\n".join(lineas)
+            if not contents:
+                prompt_actual = f"{resumen}\n\n{prompt_actual}"
+            elif contents[0]["role"] == "user":
+                contents[0]["parts"][0] = f"{resumen}\n\n{contents[0]['parts'][0]}"
+            else:
+                contents.insert(0, {"role": "user", "parts": [resumen]})
+
+        contents.append({"role": "user", "parts": [prompt_actual]})
+
+        medidas = {
+            "instruccion": tokens_instruccion,
+            "historial": tokens_historial,
+            "resumen": estimar_tokens(resumen) if resumen else 0,
+            "consulta": tokens_prompt,
+            "turnos_conservados": len(conservados),
+            "turnos_resumidos": len(antiguos),
+        }
+        medidas["total"] = tokens_instruccion + tokens_mensajes(contents)
+        # Formato anterior: instrucción como turno de usuario + historial completo + consulta
+        medidas["formato_anterior"] = tokens_instruccion + tokens_mensajes(historial_previo) + tokens_prompt
+
+        with self._lock:
+            self.peticiones += 1
+            self.tokens_enviados += medidas["total"]
+            self.tokens_formato_anterior += medidas["formato_anterior"]
+            self.turnos_resumidos += len(antiguos)
+        return contents, medidas
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "budget_tokens": self.presupuesto_tokens,
+                "requests": self.peticiones,
+                "avg_prompt_tokens": round(self.tokens_enviados / self.peticiones, 1) if self.peticiones else None,
+                "avg_previous_format_tokens": round(self.tokens_formato_anterior / self.peticiones, 1) if self.peticiones else None,
+                "summarized_turns": self.turnos_resumidos,
+            }
@@ -0,0 +1,269 @@
+"""Búsqueda semántica local: vectores de n-gramas de caracteres y fusión con el ranking léxico.
+
+Las keywords se buscan término a término, así que "reed islands" no llega a
+Uros ni "family stay" a las casas de Amantani si el tour no usa esas mismas
+palabras. Este índice representa cada tour (título, descripción e incluye)
+como un vector TF-IDF de n-gramas de caracteres (3 a 5, sobre palabras sin
+tildes, más la palabra entera) proyectados con hashing a `dimension`
+columnas: comparten dimensiones "kayak"/"kayaking", "reed"/"reeds" o
+"famil(y|ia)", sin modelo ni vocabulario que mantener.
+
+Los vectores van en una matriz NumPy (tours x dimension, float32, filas
+normalizadas) que se calcula offline y se guarda junto al catálogo:
+
+    python semantica.py tours_ingles.json            # -> tours_ingles.vectores.npz
+    python semantica.py tours_ingles.incat --dimension 4096
+
+Si el archivo no existe o es de otra versión del catálogo se calcula al
+cargar (~150 ms con 94 tours) y se intenta guardar. Una consulta es un único
+producto matriz-vector; MotorHibrido suma esa similitud, con peso
+SEMANTIC_WEIGHT, al puntaje del motor léxico normalizado.
+
+NumPy es opcional: sin él la búsqueda sigue siendo solo léxica.
+"""
+import argparse
+import logging
+import os
+import time
+import zlib
+from collections import Counter
+
+from indice_tours import tokenizar_plegado
+
+try:
+    import numpy as np
+except ImportError:  # sin numpy no hay modo semántico
+    np = None
+
+log = logging.getLogger("incalake.semantica")
+
+# Cambia si cambia la forma de extraer rasgos: invalida los índices guardados
+ESQUEMA = "ngramas-3-5+palabra/v1"
+DIMENSION = 4096
+LONGITUDES_NGRAMA = (3, 4, 5)
+# Peso de cada campo del tour en su vector
+PESOS_CAMPOS = (('titulo', 2.0), ('descripcion', 1.0), ('incluye', 0.5))
+
+
+def disponible():
+    return np is not None
+
+
+def ruta_indice(ruta_catalogo):
+    """Archivo de vectores junto al catálogo: tours_ingles.json -> tours_ingles.vectores.npz."""
+    return os.path.splitext(ruta_catalogo)[0] + ".vectores.npz"
+
+
+def rasgos(palabra):
+    """La palabra y sus n-gramas de caracteres con marcas de borde."""
+    marcada = f"<{palabra}>"
+    yield palabra
+    for n in LONGITUDES_NGRAMA:
+        for i in range(len(marcada) - n + 1):
+            yield marcada[i:i + n]
+
+
+class Proyector:
+    """Texto -> vector denso de `dimension` columnas, con caché por palabra.
+
+    Cada palabra distinta se descompone y se hashea una sola vez (el
+    vocabulario del catálogo es chico y las consultas repiten sus palabras);
+    sumar sus rasgos es un único np.bincount por texto.
+    """
+
+    def __init__(self, dimension, max_palabras=50000):
+        self.dimension = dimension
+        self.max_palabras = max_palabras
+        self._columnas = {}  # palabra -> (columnas, signos)
+
+    def _de_palabra(self, palabra):
+        columnas = self._columnas.get(palabra)
+        if columnas is None:
+            hashes = [zlib.crc32(rasgo.encode('utf-8')) for rasgo in rasgos(palabra)]
+            # El signo sale de otro bit del hash: las colisiones tienden a anularse en vez de sumar
+            columnas = (
+                np.array([h % self.dimension for h in hashes], dtype=np.intp),
+                np.array([-1.0 if h & 0x80000000 else 1.0 for h in hashes], dtype=np.float32),
+            )
+            if len(self._columnas) < self.max_palabras:
+                self._columnas[palabra] = columnas
+        return columnas
+
+    def proyectar(self, texto):
+        """(columnas, valores) del texto: suma con signo de sus rasgos por columna, con tf sublineal."""
+        conteos = Counter(tokenizar_plegado(texto))
+        if not conteos:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+        partes = [self._de_palabra(palabra) for palabra in conteos]
+        veces = np.repeat(np.fromiter(conteos.values(), dtype=np.float32, count=len(conteos)),
+                          [len(columnas) for columnas, _ in partes])
+        columnas, posiciones = np.unique(np.concatenate([columnas for columnas, _ in partes]), return_inverse=True)
+        suma = np.bincount(posiciones, weights=np.concatenate([signos for _, signos in partes]) * veces)
+        magnitud = np.abs(suma)
+        valores = np.sign(suma) * (1 + np.log(np.maximum(magnitud, 1)))
+        return columnas, valores.astype(np.float32)
+
+
+class IndiceSemantico:
+    """Matriz de vectores del catálogo (filas normalizadas) y el idf de cada columna."""
+
+    def __init__(self, matriz, idf, version, dimension, proyector=None):
+        self.matriz = matriz
+        self.idf = idf
+        self.version = version
+        self.dimension = dimension
+        self.proyector = proyector or Proyector(dimension)
+
+    @classmethod
+    def construir(cls, tours, version, dimension=DIMENSION):
+        proyector = Proyector(dimension)
+        matriz = np.zeros((len(tours), dimension), dtype=np.float32)
+        for doc_id, tour in enumerate(tours):
+            for campo, peso in PESOS_CAMPOS:
+                columnas, valores = proyector.proyectar(getattr(tour, campo) or "")
+                matriz[doc_id, columnas] += peso * valores
+        # idf por columna: los n-gramas de "the", "tour" o "puno" están en casi todos los tours y pesan poco
+        df = np.count_nonzero(matriz, axis=0)
+        idf = (np.log((len(tours) + 1) / (df + 1)) + 1).astype(np.float32)
+        matriz *= idf
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        matriz /= np.where(normas > 0, normas, 1)
+        return cls(matriz, idf, version, dimension, proyector)
+
+    def guardar(self, ruta):
+        """Escribe el .npz de forma atómica (los workers que lo estén leyendo no ven un archivo a medias)."""
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'wb') as f:
+            np.savez(f, matriz=self.matriz, idf=self.idf, version=np.array(self.version),
+                     esquema=np.array(ESQUEMA), dimension=np.array(self.dimension))
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta, version, dimension=DIMENSION, n_tours=None):
+        """Índice guardado si corresponde a esta versión del catálogo y a esta configuración; si no, None."""
+        try:
+            with np.load(ruta) as datos:
+                if (str(datos['version']) != version or str(datos['esquema']) != ESQUEMA
+                        or int(datos['dimension']) != dimension):
+                    return None
+                matriz, idf = datos['matriz'], datos['idf']
+        except (OSError, ValueError, KeyError):
+            return None
+        if n_tours is not None and len(matriz) != n_tours:
+            return None
+        return cls(matriz, idf, version, dimension)
+
+    @classmethod
+    def para_catalogo(cls, tours, version, ruta_catalogo=None, dimension=DIMENSION):
+        """Índice del archivo junto al catálogo o, si no sirve, calculado ahora (y guardado si se puede)."""
+        inicio = time.perf_counter()
+        ruta = ruta_indice(ruta_catalogo) if ruta_catalogo else None
+        indice = cls.cargar(ruta, version, dimension, len(tours)) if ruta else None
+        if indice is not None:
+            log.info(f"🧭 Índice semántico leído de {os.path.basename(ruta)} "
+                     f"({len(tours)} tours, {(time.perf_counter() - inicio) * 1000:.1f} ms)")
+            return indice
+        indice = cls.construir(tours, version, dimension)
+        log.info(f"🧭 Índice semántico calculado: {len(tours)} tours x {dimension} en "
+                 f"{(time.perf_counter() - inicio) * 1000:.1f} ms")
+        if ruta:
+            try:
+                indice.guardar(ruta)
+            except OSError as e:
+                log.warning(f"⚠️ No se pudo guardar el índice semántico en {ruta}: {e}")
+        return indice
+
+    def vector(self, texto):
+        """(columnas, valores) normalizados de una consulta, con el idf del catálogo."""
+        columnas, valores = self.proyector.proyectar(texto)
+        valores = valores * self.idf[columnas]
+        norma = np.linalg.norm(valores)
+        return columnas, (valores / norma if norma > 0 else valores)
+
+    def similitudes(self, keywords):
+        """Coseno entre la consulta y cada tour: un solo producto matriz-vector.
+
+        La consulta activa unas decenas de columnas, así que el producto se
+        hace solo sobre esas en vez de recorrer la matriz entera.
+        """
+        columnas, valores = self.vector(" ".join(keywords))
+        return self.matriz[:, columnas] @ valores
+
+    def __len__(self):
+        return len(self.matriz)
+
+
+class MotorHibrido:
+    """Ranking léxico (BM25 o heurístico) fusionado con la similitud semántica.
+
+    puntaje = (1 - peso) * léxico / máximo léxico de la consulta + peso * coseno
+
+    Las similitudes por debajo de `umbral` no cuentan: todo tour comparte algún
+    n-grama con cualquier consulta. Con la misma interfaz `buscar` que los
+    motores léxicos, incluido el relleno con tours de Puno.
+    """
+
+    def __init__(self, lexico, semantico, peso=0.4, umbral=0.05):
+        self.lexico = lexico
+        self.semantico = semantico
+        self.indice = lexico.indice
+        self.peso = peso
+        self.umbral = umbral
+
+    def puntuar(self, keywords):
+        """Arreglo con el puntaje fusionado de cada tour."""
+        similitud = self.semantico.similitudes(keywords)
+        puntajes = np.where(similitud >= self.umbral, similitud, 0.0) * self.peso
+        lexicos = self.lexico.puntuar(keywords)
+        if not isinstance(lexicos, dict):  # RankingHeuristico devuelve [(score, doc_id)]
+            lexicos = {doc_id: score for score, doc_id in lexicos}
+        if lexicos:
+            maximo = max(lexicos.values()) or 1.0
+            doc_ids = np.fromiter(lexicos.keys(), dtype=np.intp, count=len(lexicos))
+            valores = np.fromiter(lexicos.values(), dtype=np.float32, count=len(lexicos))
+            puntajes[doc_ids] += (1 - self.peso) * valores / maximo
+        return puntajes
+
+    def buscar(self, keywords, limite=3, candidatos=None):
+        """Devuelve los `limite` mejores [(score, doc_id)]; `candidatos` restringe a esos doc_ids."""
+        puntajes = self.puntuar(keywords)
+        if candidatos is not None:
+            mascara = np.zeros(len(puntajes), dtype=bool)
+            mascara[list(candidatos)] = True
+            puntajes = np.where(mascara, puntajes, 0.0)
+        positivos = np.flatnonzero(puntajes > 0)
+        if len(positivos) > limite:
+            positivos = positivos[np.argpartition(-puntajes[positivos], limite - 1)[:limite]]
+        scored = sorted(((float(puntajes[doc_id]), int(doc_id)) for doc_id in positivos), key=lambda x: (-x[0], x[1]))
+        if len(scored) < limite:
+            vistos = {doc_id for _, doc_id in scored}
+            scored = self.indice.completar_con_puno(scored, vistos, limite, candidatos)[:limite]
+        return scored
+
+
+def main():
+    from catalogo_binario import CatalogoBinario
+    from catalogo import compilar_catalogo
+    from gestor_catalogo import leer_catalogo
+
+    parser = argparse.ArgumentParser(description="Índice semántico del catálogo de tours")
+    parser.add_argument("catalogo", help="JSON de tours o catálogo binario (.incat)")
+    parser.add_argument("--dimension", type=int, default=DIMENSION)
+    parser.add_argument("--salida", help="Por defecto, <catalogo>.vectores.npz junto al catálogo")
+    args = parser.parse_args()
+    if np is None:
+        parser.error("hace falta numpy (pip install numpy)")
+
+    tours_json, version = leer_catalogo(args.catalogo)
+    tours = tours_json.tours if isinstance(tours_json, CatalogoBinario) else compilar_catalogo(tours_json, ())
+    inicio = time.perf_counter()
+    indice = IndiceSemantico.construir(tours, version, args.dimension)
+    construccion_ms = (time.perf_counter() - inicio) * 1000
+    salida = args.salida or ruta_indice(args.catalogo)
+    indice.guardar(salida)
+    print(f"✅ {salida}: {len(tours)} tours x {args.dimension} (versión {version}), "
+          f"{os.path.getsize(salida) / 1024:.1f} KB en {construccion_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
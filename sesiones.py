@@ -0,0 +1,528 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger("incalake.sesiones")
+
+
+def sanitizar_session_id(session_id):
+    """Elimina cualquier carácter que permita path traversal o inyección."""
+    return re.sub(r'[^a-zA-Z0-9_-]', '', session_id)
+
+
+class SessionStore:
+    """Almacén de historiales de chat con caché LRU en memoria y bloqueo por sesión.
+
+    Las subclases implementan la persistencia (`_leer`, `_escribir`, `_borrar`,
+    `_firma`, `_contar`). La caché guarda junto a cada historial una firma del
+    dato persistido (mtime, versión) para detectar escrituras de otros procesos
+    y la hora de su última escritura, para aplicar el TTL también a los aciertos.
+    """
+
+    def __init__(self, max_cache=1000, ttl_segundos=None):
+        self.max_cache = max_cache
+        # Sesiones sin actividad por más de ttl_segundos se consideran expiradas
+        self.ttl_segundos = ttl_segundos
+        self._cache = OrderedDict()  # session_id -> (historial, firma, actualizada)
+        self._sucias = {}            # session_id -> historial pendiente de escribir
+        self._lock = threading.Lock()
+        self._bloqueos = {}          # session_id -> [Lock, usuarios]
+        self._bloqueos_lock = threading.Lock()
+
+    # --- Bloqueo por sesión ---
+    def bloqueo(self, session_id):
+        """Context manager que serializa las operaciones sobre una misma sesión."""
+        return _BloqueoSesion(self, sanitizar_session_id(session_id))
+
+    def _adquirir(self, session_id):
+        with self._bloqueos_lock:
+            entrada = self._bloqueos.setdefault(session_id, [threading.Lock(), 0])
+            entrada[1] += 1
+        entrada[0].acquire()
+
+    def _liberar(self, session_id):
+        with self._bloqueos_lock:
+            entrada = self._bloqueos[session_id]
+            entrada[0].release()
+            entrada[1] -= 1
+            if not entrada[1]:
+                del self._bloqueos[session_id]
+
+    # --- Caché ---
+    def _cachear(self, session_id, historial, firma, actualizada):
+        if not self.max_cache:
+            return
+        with self._lock:
+            self._cache[session_id] = (historial, firma, actualizada)
+            self._cache.move_to_end(session_id)
+            # Las sesiones con escritura pendiente se leen de _sucias, así que
+            # desalojarlas de la caché no pierde datos.
+            while len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+
+    # --- API pública ---
+    def cargar(self, session_id):
+        """Devuelve una copia del historial de la sesión ([] si no existe)."""
+        session_id = sanitizar_session_id(session_id)
+        with self._lock:
+            if session_id in self._sucias:
+                return list(self._sucias[session_id])
+            en_cache = self._cache.get(session_id)
+        if en_cache is not None:
+            historial, firma, actualizada = en_cache
+            # Expirada en caché = expirada en disco: no depende del worker que atienda
+            limite = self.limite_expiracion()
+            vigente = firma is not None and (limite is None or actualizada >= limite)
+            if vigente and firma == self._firma(session_id):
+                with self._lock:
+                    if session_id in self._cache:
+                        self._cache.move_to_end(session_id)
+                return list(historial)
+        historial, firma, actualizada = self._leer(session_id)
+        self._cachear(session_id, historial, firma, actualizada)
+        return list(historial)
+
+    def guardar(self, session_id, historial):
+        """Guarda el historial completo de la sesión."""
+        session_id = sanitizar_session_id(session_id)
+        firma = self._escribir(session_id, list(historial))
+        self._cachear(session_id, list(historial), firma, time.time())
+        return True
+
+    def agregar_turno(self, session_id, mensajes, max_mensajes=None):
+        """Agrega mensajes al historial actual de forma atómica respecto a otros turnos de la sesión.
+
+        Relee el historial bajo el bloqueo de la sesión, así dos pestañas con el
+        mismo session_id no se pisan los mensajes.
+        """
+        with self.bloqueo(session_id):
+            historial = self.cargar(session_id)
+            historial.extend(mensajes)
+            if max_mensajes and len(historial) > max_mensajes:
+                historial = historial[-max_mensajes:]
+            self.guardar(session_id, historial)
+            return historial
+
+    def eliminar(self, session_id):
+        """Elimina la sesión. Devuelve False si no existía."""
+        session_id = sanitizar_session_id(session_id)
+        with self.bloqueo(session_id):
+            with self._lock:
+                self._cache.pop(session_id, None)
+                pendiente = self._sucias.pop(session_id, None)
+            return self._borrar(session_id) or pendiente is not None
+
+    def contar(self):
+        """Número de sesiones persistidas."""
+        return self._contar()
+
+    def limite_expiracion(self):
+        """Marca de tiempo antes de la cual una sesión está expirada (None si no hay TTL)."""
+        return time.time() - self.ttl_segundos if self.ttl_segundos else None
+
+    def expirar(self, archivar=True):
+        """Archiva o elimina las sesiones expiradas. Devuelve cuántas se retiraron."""
+        limite = self.limite_expiracion()
+        if limite is None:
+            return 0
+        retiradas = self._expirar(limite, archivar)
+        with self._lock:
+            for session_id in retiradas:
+                self._cache.pop(session_id, None)
+        return len(retiradas)
+
+    def flush(self):
+        """Escribe las sesiones pendientes (no-op en almacenes sin escritura diferida)."""
+
+    def cerrar(self):
+        self.flush()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "backend": type(self).__name__,
+                "cached_sessions": len(self._cache),
+                "pending_writes": len(self._sucias),
+            }
+
+
+class _BloqueoSesion:
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    def __enter__(self):
+        self.store._adquirir(self.session_id)
+        return self
+
+    def __exit__(self, *exc):
+        self.store._liberar(self.session_id)
+        return False
+
+
+# === Backend de archivos JSON ===
+def shard_de(session_id):
+    """Subdirectorio (2 hex del hash) donde vive la sesión: 256 shards."""
+    return hashlib.sha1(session_id.encode('utf-8')).hexdigest()[:2]
+
+
+class FileSessionStore(SessionStore):
+    """Un archivo JSON por sesión, repartido en subdirectorios por hash.
+
+    Las escrituras son atómicas (temporal + rename). Con `intervalo_escritura`
+    > 0 son diferidas: se acumulan en memoria y un hilo las persiste en lote
+    cada `intervalo_escritura` segundos. El número de sesiones se mantiene de
+    forma incremental para que /health no tenga que listar directorios.
+    """
+
+    def __init__(self, directorio, max_cache=1000, intervalo_escritura=0.0,
+                 ttl_segundos=None, directorio_archivo=None):
+        super().__init__(max_cache, ttl_segundos)
+        self.directorio = directorio
+        self.directorio_archivo = directorio_archivo
+        self.intervalo_escritura = intervalo_escritura
+        os.makedirs(directorio, exist_ok=True)
+        self._conteo_lock = threading.Lock()
+        self._conteo = self._inventariar()
+        self._evento_cierre = threading.Event()
+        self._hilo_escritura = None
+        if intervalo_escritura > 0:
+            self._hilo_escritura = threading.Thread(
+                target=self._bucle_escritura, name="session-write-behind", daemon=True
+            )
+            self._hilo_escritura.start()
+            atexit.register(self.cerrar)
+
+    def ruta(self, session_id):
+        return os.path.join(self.directorio, shard_de(session_id), f"{session_id}.json")
+
+    def _archivos(self):
+        """Itera (session_id, ruta, DirEntry) de todas las sesiones en los shards."""
+        with os.scandir(self.directorio) as shards:
+            for shard in shards:
+                if not shard.is_dir() or len(shard.name) != 2:
+                    continue
+                with os.scandir(shard.path) as archivos:
+                    for archivo in archivos:
+                        if archivo.name.endswith('.json') and archivo.is_file():
+                            yield archivo.name[:-5], archivo.path, archivo
+
+    def _inventariar(self):
+        """Mueve las sesiones del formato plano a su shard y cuenta el total.
+
+        Solo se recorre el directorio una vez, al arrancar.
+        """
+        migradas = 0
+        with os.scandir(self.directorio) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and entrada.name.endswith('.json'):
+                    destino = self.ruta(entrada.name[:-5])
+                    try:
+                        os.makedirs(os.path.dirname(destino), exist_ok=True)
+                        os.replace(entrada.path, destino)
+                        migradas += 1
+                    except FileNotFoundError:
+                        pass  # Otro worker ya la migró
+        if migradas:
+            log.info(f"📦 {migradas} sesiones migradas a subdirectorios por hash")
+        return sum(1 for _ in self._archivos())
+
+    def _ajustar_conteo(self, delta):
+        with self._conteo_lock:
+            self._conteo = max(0, self._conteo + delta)
+
+    def _firma(self, session_id):
+        try:
+            return os.stat(self.ruta(session_id)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _leer(self, session_id):
+        filepath = self.ruta(session_id)
+        try:
+            firma = os.stat(filepath).st_mtime_ns
+            limite = self.limite_expiracion()
+            if limite is not None and firma < limite * 1e9:
+                return [], None, None  # Expirada: el conserje la archivará
+            with open(filepath, 'r', encoding='utf-8') as f:
+                return json.load(f), firma, firma / 1e9
+        except FileNotFoundError:
+            return [], None, None
+        except (json.JSONDecodeError, IOError) as e:
+            log.warning(f"⚠️ Error al leer archivo de sesión {session_id}: {e}")
+            return [], None, None
+
+    def _escribir_archivo(self, session_id, historial):
+        filepath = self.ruta(session_id)
+        temporal = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            nueva = not os.path.exists(filepath)
+            with open(temporal, 'w', encoding='utf-8') as f:
+                json.dump(historial, f, ensure_ascii=False, indent=2)
+            os.replace(temporal, filepath)
+            if nueva:
+                self._ajustar_conteo(1)
+            return os.stat(filepath).st_mtime_ns
+        except IOError as e:
+            log.error(f"❌ Error grave al guardar sesión {session_id}: {e}")
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+            raise
+
+    def _escribir(self, session_id, historial):
+        if self._hilo_escritura is None:
+            return self._escribir_archivo(session_id, historial)
+        with self._lock:
+            self._sucias[session_id] = historial
+        return None
+
+    def _borrar(self, session_id):
+        try:
+            os.remove(self.ruta(session_id))
+        except FileNotFoundError:
+            return False
+        self._ajustar_conteo(-1)
+        return True
+
+    def _contar(self):
+        return self._conteo
+
+    def _expirar(self, limite, archivar):
+        retiradas = []
+        restantes = 0
+        for session_id, ruta, entrada in self._archivos():
+            try:
+                if entrada.stat().st_mtime >= limite:
+                    restantes += 1
+                    continue
+            except FileNotFoundError:
+                continue
+            with self.bloqueo(session_id):
+                with self._lock:
+                    if session_id in self._sucias:
+                        restantes += 1
+                        continue
+                try:
+                    if archivar and self.directorio_archivo:
+                        destino = os.path.join(
+                            self.directorio_archivo, time.strftime('%Y%m%d'), f"{session_id}.json"
+                        )
+                        os.makedirs(os.path.dirname(destino), exist_ok=True)
+                        os.replace(ruta, destino)
+                    else:
+                        os.remove(ruta)
+                    retiradas.append(session_id)
+                except FileNotFoundError:
+                    pass
+        # El recorrido completo también corrige el conteo (p. ej. escrituras de otros workers)
+        with self._conteo_lock:
+            self._conteo = restantes
+        return retiradas
+
+    def flush(self):
+        with self._lock:
+            lote = dict(self._sucias)
+        for session_id in lote:
+            # El bloqueo evita escribir una sesión que se está eliminando
+            with self.bloqueo(session_id):
+                with self._lock:
+                    historial = self._sucias.get(session_id)
+                if historial is None:
+                    continue
+                try:
+                    firma = self._escribir_archivo(session_id, historial)
+                except IOError:
+                    continue  # Queda pendiente para la próxima pasada
+                with self._lock:
+                    if self._sucias.get(session_id) is historial:
+                        del self._sucias[session_id]
+                        if session_id in self._cache:
+                            self._cache[session_id] = (historial, firma, firma / 1e9)
+
+    def _bucle_escritura(self):
+        while not self._evento_cierre.wait(self.intervalo_escritura):
+            self.flush()
+
+    def cerrar(self):
+        self._evento_cierre.set()
+        self.flush()
+
+
+# === Backend SQLite ===
+class SQLiteSessionStore(SessionStore):
+    """Historiales en una base SQLite compartida por todos los workers.
+
+    Cada fila lleva un contador de versión; la caché local solo se reutiliza si
+    la versión en disco no cambió, y `agregar_turno` corre dentro de una
+    transacción IMMEDIATE para serializar turnos también entre procesos.
+    """
+
+    def __init__(self, ruta_db, max_cache=1000, ttl_segundos=None):
+        super().__init__(max_cache, ttl_segundos)
+        self.ruta_db = ruta_db
+        self._local = threading.local()
+        conexion = self._conexion()
+        conexion.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " history TEXT NOT NULL,"
+            " version INTEGER NOT NULL DEFAULT 1,"
+            " updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);"
+            "CREATE TABLE IF NOT EXISTS sessions_archive ("
+            " session_id TEXT NOT NULL,"
+            " history TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " archived_at REAL NOT NULL);"
+            # Conteo mantenido por triggers para que contar() sea O(1)
+            "CREATE TABLE IF NOT EXISTS sessions_meta (clave TEXT PRIMARY KEY, valor INTEGER NOT NULL);"
+            "INSERT OR IGNORE INTO sessions_meta VALUES ('count', (SELECT COUNT(*) FROM sessions));"
+            "CREATE TRIGGER IF NOT EXISTS sessions_count_insert AFTER INSERT ON sessions BEGIN"
+            " UPDATE sessions_meta SET valor = valor + 1 WHERE clave = 'count'; END;"
+            "CREATE TRIGGER IF NOT EXISTS sessions_count_delete AFTER DELETE ON sessions BEGIN"
+            " UPDATE sessions_meta SET valor = valor - 1 WHERE clave = 'count'; END;"
+        )
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def _firma(self, session_id):
+        fila = self._conexion().execute(
+            "SELECT version FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return fila[0] if fila else None
+
+    def _leer(self, session_id):
+        fila = self._conexion().execute(
+            "SELECT history, version, updated_at FROM sessions WHERE session_id = ? AND updated_at >= ?",
+            (session_id, self.limite_expiracion() or 0),
+        ).fetchone()
+        if not fila:
+            return [], None, None
+        try:
+            return json.loads(fila[0]), fila[1], fila[2]
+        except json.JSONDecodeError as e:
+            log.warning(f"⚠️ Historial corrupto para la sesión {session_id}: {e}")
+            return [], None, None
+
+    def _escribir(self, session_id, historial, conexion=None):
+        conexion = conexion or self._conexion()
+        fila = conexion.execute(
+            "INSERT INTO sessions (session_id, history, version, updated_at) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET history = excluded.history, "
+            "version = sessions.version + 1, updated_at = excluded.updated_at "
+            "RETURNING version",
+            (session_id, json.dumps(historial, ensure_ascii=False), time.time()),
+        ).fetchone()
+        return fila[0]
+
+    def agregar_turno(self, session_id, mensajes, max_mensajes=None):
+        session_id = sanitizar_session_id(session_id)
+        with self.bloqueo(session_id):
+            conexion = self._conexion()
+            conexion.execute("BEGIN IMMEDIATE")
+            try:
+                historial, _, _ = self._leer(session_id)
+                historial.extend(mensajes)
+                if max_mensajes and len(historial) > max_mensajes:
+                    historial = historial[-max_mensajes:]
+                version = self._escribir(session_id, historial, conexion)
+                conexion.execute("COMMIT")
+            except Exception:
+                conexion.execute("ROLLBACK")
+                raise
+            self._cachear(session_id, list(historial), version, time.time())
+            return historial
+
+    def _borrar(self, session_id):
+        cursor = self._conexion().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def _contar(self):
+        return self._conexion().execute("SELECT valor FROM sessions_meta WHERE clave = 'count'").fetchone()[0]
+
+    def _expirar(self, limite, archivar):
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            retiradas = [
+                fila[0] for fila in conexion.execute(
+                    "SELECT session_id FROM sessions WHERE updated_at < ?", (limite,)
+                )
+            ]
+            if archivar:
+                conexion.execute(
+                    "INSERT INTO sessions_archive (session_id, history, updated_at, archived_at) "
+                    "SELECT session_id, history, updated_at, ? FROM sessions WHERE updated_at < ?",
+                    (time.time(), limite),
+                )
+            conexion.execute("DELETE FROM sessions WHERE updated_at < ?", (limite,))
+            conexion.execute("COMMIT")
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+        return retiradas
+
+
+# === Ciclo de vida ===
+class ConserjeSesiones:
+    """Hilo en segundo plano que archiva o elimina periódicamente las sesiones expiradas."""
+
+    def __init__(self, store, intervalo_segundos=3600, archivar=True):
+        self.store = store
+        self.intervalo_segundos = intervalo_segundos
+        self.archivar = archivar
+        self.ultima_ejecucion = None
+        self.total_retiradas = 0
+        self._evento_cierre = threading.Event()
+        self._hilo = None
+
+    def ejecutar_una_vez(self):
+        inicio = time.time()
+        try:
+            retiradas = self.store.expirar(self.archivar)
+        except (OSError, sqlite3.Error) as e:
+            log.error(f"❌ Error del conserje de sesiones: {e}")
+            return 0
+        self.ultima_ejecucion = inicio
+        self.total_retiradas += retiradas
+        if retiradas:
+            accion = "archivadas" if self.archivar else "eliminadas"
+            log.info(f"🧹 {retiradas} sesiones expiradas {accion} en {time.time() - inicio:.2f}s")
+        return retiradas
+
+    def _bucle(self):
+        while True:
+            self.ejecutar_una_vez()
+            if self._evento_cierre.wait(self.intervalo_segundos):
+                return
+
+    def iniciar(self):
+        if self._hilo is None and self.intervalo_segundos > 0:
+            self._hilo = threading.Thread(target=self._bucle, name="session-janitor", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._evento_cierre.set()
+
+    def estadisticas(self):
+        return {
+            "janitor_last_run": self.ultima_ejecucion,
+            "janitor_expired_total": self.total_retiradas,
+        }
@@ -0,0 +1,505 @@
+"""Salida de /chat como Server-Sent Events: framing, agrupación, compresión y reanudación.
+
+Gemini entrega muchos fragmentos pequeños; reenviar cada uno como una
+escritura aparte produce muchos paquetes TCP diminutos (caros detrás de los
+proxies de las redes móviles) y, sin framing, el widget no sabe dónde
+termina la respuesta. Esta etapa:
+
+- agrupa los textos hasta SSE_COALESCE_BYTES o SSE_COALESCE_MS desde el
+  último envío. El primer texto sale sin esperar (no suma al TTFB) y tampoco
+  se retiene un texto que llegó tras una pausa larga de Gemini;
+- emite eventos SSE reales: `id` y `data` por grupo, `event: done` al final y
+  `event: error` si Gemini corta a mitad de respuesta;
+- comprime con gzip, o br si `brotli` está instalado, cuando el cliente lo
+  acepta, vaciando el compresor en cada evento para que llegue entero;
+- guarda los eventos de cada respuesta SSE_RESUME_SECONDS: un cliente que
+  pierde la conexión reintenta con Last-Event-ID y recibe lo que le faltó.
+  Si se desconecta a mitad, la respuesta se termina de generar en segundo
+  plano (y se guarda en la sesión) para que el reintento la encuentre.
+
+La reconexión puede llegar a otro worker (gunicorn reparte sin afinidad).
+Por eso, con `directorio` (SSE_RESUME_DIR), cada evento también se anexa
+a un archivo por transmisión. Un worker que no la tiene en memoria la lee
+de ahí y sigue el archivo mientras el worker original la termina de
+generar. Ese directorio solo se comparte entre los workers de una misma
+máquina. Con varias máquinas detrás de un balanceador hace falta afinidad
+de sesión o un directorio compartido. Si no, la reconexión recibe 204 y el
+widget marca la respuesta como incompleta.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from instrumentacion import registro
+
+log = logging.getLogger("incalake.sse")
+
+try:
+    import brotli
+except ImportError:  # br es opcional: sin el paquete se ofrece solo gzip
+    brotli = None
+
+eventos_sse = registro.contador(
+    "incalake_sse_events_total",
+    "Eventos SSE emitidos en /chat, por tipo",
+    etiquetas=("event",),
+)
+bytes_sse = registro.contador(
+    "incalake_sse_bytes_total",
+    "Bytes de eventos SSE enviados en /chat, ya comprimidos",
+    etiquetas=("encoding",),
+)
+reanudaciones_sse = registro.contador(
+    "incalake_sse_resumes_total",
+    "Reconexiones con Last-Event-ID según su resultado",
+    etiquetas=("outcome",),
+)
+
+CABECERAS_SSE = {
+    "Cache-Control": "no-cache",
+    # nginx y otros proxies no deben acumular el stream antes de reenviarlo
+    "X-Accel-Buffering": "no",
+}
+
+
+class RespuestaInterrumpida(Exception):
+    """La respuesta se cortó después de empezar; el mensaje va al cliente como `event: error`."""
+
+
+def formatear_evento(datos, id_evento=None, evento=None):
+    """Un evento SSE; cada línea del texto va en su propio campo `data`."""
+    lineas = []
+    if id_evento:
+        lineas.append(f"id: {id_evento}")
+    if evento:
+        lineas.append(f"event: {evento}")
+    datos = datos.replace("\r\n", "\n").replace("\r", "\n")
+    lineas.extend(f"data: {linea}" for linea in datos.split("\n"))
+    return "\n".join(lineas) + "\n\n"
+
+
+# === Agrupación ===
+class Agrupador:
+    """Junta textos hasta `max_bytes` o hasta que pasen `ventana` segundos desde el último envío."""
+
+    def __init__(self, max_bytes=512, ventana=0.05):
+        self.max_bytes = max_bytes
+        self.ventana = ventana
+        self._partes = []
+        self._tamano = 0
+        self._ultimo_envio = None
+        self._ultima_llegada = None
+
+    def agregar(self, texto, ahora):
+        """Devuelve el texto a enviar ya, o None si conviene esperar al siguiente."""
+        pausa = self._ultima_llegada is None or ahora - self._ultima_llegada >= self.ventana
+        self._ultima_llegada = ahora
+        self._partes.append(texto)
+        self._tamano += len(texto.encode('utf-8'))
+        # Tras una pausa de Gemini (o en el primer texto) no hay con qué agrupar: esperar solo suma latencia
+        if pausa or self._tamano >= self.max_bytes or ahora - self._ultimo_envio >= self.ventana:
+            return self.vaciar(ahora)
+        return None
+
+    def vaciar(self, ahora=None):
+        """Texto acumulado (o None si no hay) y reinicio de la ventana."""
+        if not self._partes:
+            return None
+        texto = "".join(self._partes)
+        self._partes, self._tamano = [], 0
+        self._ultimo_envio = time.monotonic() if ahora is None else ahora
+        return texto
+
+    def espera(self, ahora):
+        """Segundos hasta que venza la ventana del texto retenido; None si no hay nada retenido."""
+        if not self._partes:
+            return None
+        return max(0.0, self._ultimo_envio + self.ventana - ahora)
+
+
+# === Compresión ===
+def elegir_codificacion(accept_encoding, permitidas=('br', 'gzip')):
+    """'br', 'gzip' o None según Accept-Encoding; respeta q=0 y prefiere br."""
+    aceptadas = {}
+    for parte in (accept_encoding or "").lower().split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        calidad = 1.0
+        if parametros.strip().startswith("q="):
+            try:
+                calidad = float(parametros.strip()[2:])
+            except ValueError:
+                calidad = 0.0
+        aceptadas[nombre.strip()] = calidad
+    for codificacion in permitidas:
+        if codificacion == 'br' and brotli is None:
+            continue
+        if aceptadas.get(codificacion, aceptadas.get('*', 0.0)) > 0:
+            return codificacion
+    return None
+
+
+class Compresor:
+    """Comprime un stream de eventos; cada evento se vacía para que el cliente lo pueda descomprimir ya."""
+
+    def __init__(self, codificacion=None):
+        self.codificacion = codificacion or 'identity'
+        if codificacion == 'gzip':
+            self._zlib = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif codificacion == 'br':
+            self._brotli = brotli.Compressor(quality=5)
+
+    def comprimir(self, texto):
+        datos = texto.encode('utf-8')
+        if self.codificacion == 'gzip':
+            datos = self._zlib.compress(datos) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+        elif self.codificacion == 'br':
+            datos = self._brotli.process(datos) + self._brotli.flush()
+        bytes_sse.incrementar(self.codificacion, cantidad=len(datos))
+        return datos
+
+    def cerrar(self):
+        """Cola del formato comprimido (trailer de gzip, fin de br)."""
+        datos = b""
+        if self.codificacion == 'gzip':
+            datos = self._zlib.flush(zlib.Z_FINISH)
+        elif self.codificacion == 'br':
+            datos = self._brotli.finish()
+        bytes_sse.incrementar(self.codificacion, cantidad=len(datos))
+        return datos
+
+
+# === Reanudación con Last-Event-ID ===
+class Transmision:
+    """Eventos ya emitidos de una respuesta, para reenviarlos a un cliente que se reconecta.
+
+    Con `archivo` cada evento se anexa también ahí, para los demás workers.
+    """
+
+    def __init__(self, id_transmision, archivo=None):
+        self.id = id_transmision
+        self.creada = time.monotonic()
+        self.terminada = False
+        self.archivo = archivo
+        self._eventos = []
+        self._condicion = threading.Condition()
+
+    def publicar(self, datos, evento=None):
+        """Registra un evento y devuelve su texto SSE; `done` y `error` cierran la transmisión."""
+        with self._condicion:
+            texto = formatear_evento(datos, f"{self.id}-{len(self._eventos) + 1}", evento)
+            self._eventos.append(texto)
+            if evento in ('done', 'error'):
+                self.terminada = True
+            self._anexar(texto)
+            self._condicion.notify_all()
+        eventos_sse.incrementar(evento or 'message')
+        return texto
+
+    def _anexar(self, texto):
+        if self.archivo is None:
+            return
+        try:
+            with open(self.archivo, 'a', encoding='utf-8') as f:
+                f.write(texto)
+        except OSError as e:
+            # Sin el archivo la reanudación queda en este worker; la respuesta sigue igual
+            log.warning(f"⚠️ No se pudo anexar el evento SSE a {self.archivo}: {e}")
+            self.archivo = None
+
+    def siguientes(self, desde, espera_maxima=30.0):
+        """Eventos posteriores al número `desde`; espera los nuevos mientras la respuesta se siga generando."""
+        indice = desde
+        while True:
+            with self._condicion:
+                if indice >= len(self._eventos) and not self.terminada:
+                    self._condicion.wait(espera_maxima)
+                nuevos = self._eventos[indice:]
+                terminada = self.terminada
+            yield from nuevos
+            indice += len(nuevos)
+            if terminada or not nuevos:
+                return
+
+
+def _es_final(texto):
+    return "\nevent: done\n" in texto or "\nevent: error\n" in texto
+
+
+class TransmisionEnDisco:
+    """Transmisión de otro worker, leída del archivo que ese worker va anexando.
+
+    Se lee en bytes desde la última posición: el otro worker puede estar a
+    mitad de escribir un evento (y de un carácter multibyte), así que solo se
+    decodifican los eventos completos y el resto espera al siguiente sondeo.
+    """
+
+    def __init__(self, archivo, intervalo_sondeo=0.1):
+        self.archivo = archivo
+        self.intervalo_sondeo = intervalo_sondeo
+        self.terminada = False
+        self._posicion = 0
+        self._pendiente = b""
+
+    def _leer(self):
+        """Eventos completos anexados desde la lectura anterior (cada uno termina en una línea en blanco)."""
+        with open(self.archivo, 'rb') as f:
+            f.seek(self._posicion)
+            datos = f.read()
+        self._posicion += len(datos)
+        bloques = (self._pendiente + datos).split(b"\n\n")
+        self._pendiente = bloques.pop()
+        return [bloque.decode('utf-8') + "\n\n" for bloque in bloques]
+
+    def siguientes(self, desde, espera_maxima=30.0):
+        """Como Transmision.siguientes, sondeando el archivo hasta el evento final."""
+        leidos = 0
+        ultima_novedad = time.monotonic()
+        while True:
+            try:
+                eventos = self._leer()
+            except OSError:
+                return
+            for texto in eventos:
+                leidos += 1
+                if leidos > desde:
+                    yield texto
+                if _es_final(texto):
+                    self.terminada = True
+                    return
+            ahora = time.monotonic()
+            if eventos:
+                ultima_novedad = ahora
+            elif ahora - ultima_novedad >= espera_maxima:
+                return
+            time.sleep(self.intervalo_sondeo)
+
+
+class RegistroTransmisiones:
+    """Transmisiones recientes del proceso, con TTL y un tope de entradas.
+
+    Con `directorio` las transmisiones se anexan a archivos que cualquier
+    worker de la máquina puede reanudar; se borran pasado el TTL.
+    """
+
+    def __init__(self, ttl_segundos=60, max_transmisiones=1000, directorio=None):
+        self.ttl_segundos = ttl_segundos
+        self.max_transmisiones = max_transmisiones
+        self.directorio = directorio
+        self._transmisiones = OrderedDict()
+        self._lock = threading.Lock()
+        self._ultima_limpieza = 0.0
+        self._directorio_listo = False
+
+    def _ruta(self, id_transmision):
+        return os.path.join(self.directorio, f"{id_transmision}.sse")
+
+    def _preparar_directorio(self):
+        """Crea el directorio con la primera transmisión; si no se puede, la reanudación queda en cada worker."""
+        if self._directorio_listo or not self.directorio:
+            return
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+        except OSError as e:
+            log.warning(f"⚠️ No se pudo crear {self.directorio}: la reanudación SSE queda en cada worker ({e})")
+            self.directorio = None
+        self._directorio_listo = True
+
+    def crear(self):
+        id_transmision = uuid.uuid4().hex[:16]
+        if self.ttl_segundos <= 0:
+            return Transmision(id_transmision)
+        self._preparar_directorio()
+        transmision = Transmision(id_transmision, self._ruta(id_transmision) if self.directorio else None)
+        with self._lock:
+            self._purgar(transmision.creada)
+            self._transmisiones[transmision.id] = transmision
+        self._limpiar_directorio()
+        return transmision
+
+    def _purgar(self, ahora):
+        while self._transmisiones:
+            transmision = next(iter(self._transmisiones.values()))
+            if len(self._transmisiones) < self.max_transmisiones and ahora - transmision.creada < self.ttl_segundos:
+                break
+            self._transmisiones.popitem(last=False)
+
+    def _limpiar_directorio(self):
+        """Borra los archivos vencidos, como mucho una vez por TTL (lo haga el worker que lo haga)."""
+        ahora = time.time()
+        if not self.directorio or ahora - self._ultima_limpieza < self.ttl_segundos:
+            return
+        self._ultima_limpieza = ahora
+        try:
+            nombres = os.listdir(self.directorio)
+        except OSError:
+            return
+        for nombre in nombres:
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if nombre.endswith(".sse") and ahora - os.path.getmtime(ruta) >= self.ttl_segundos:
+                    os.remove(ruta)
+            except OSError:
+                pass  # otro worker la borró antes
+
+    def _desde_disco(self, id_transmision):
+        """Transmisión de otro worker si su archivo existe y no venció; None si no."""
+        if not self.directorio or not id_transmision.isalnum():
+            return None
+        ruta = self._ruta(id_transmision)
+        try:
+            if time.time() - os.path.getmtime(ruta) >= self.ttl_segundos:
+                return None
+        except OSError:
+            return None
+        return TransmisionEnDisco(ruta)
+
+    def reanudar(self, ultimo_id):
+        """(transmisión, número del último evento recibido) para un Last-Event-ID, o (None, 0)."""
+        id_transmision, _, numero = (ultimo_id or "").strip().rpartition("-")
+        with self._lock:
+            self._purgar(time.monotonic())
+            transmision = self._transmisiones.get(id_transmision)
+        resultado = 'resumed'
+        if transmision is None and numero.isdigit():
+            transmision = self._desde_disco(id_transmision)
+            resultado = 'resumed_shared'
+        if transmision is None or not numero.isdigit():
+            reanudaciones_sse.incrementar('unknown')
+            return None, 0
+        reanudaciones_sse.incrementar(resultado)
+        return transmision, int(numero)
+
+    def __len__(self):
+        return len(self._transmisiones)
+
+
+def reenviar(transmision, desde, compresor):
+    """Bytes de los eventos posteriores a `desde` para un cliente que se reconectó."""
+    for texto in transmision.siguientes(desde):
+        yield compresor.comprimir(texto)
+    yield compresor.cerrar()
+
+
+# === Etapa de salida ===
+def _cierre(transmision, agrupador, error=None):
+    """Publica lo retenido y el evento final (`done` o `error`). Devuelve su texto SSE."""
+    resto = agrupador.vaciar()
+    texto = transmision.publicar(resto) if resto else ""
+    if error is not None:
+        return texto + transmision.publicar(str(error), evento='error')
+    return texto + transmision.publicar("done", evento='done')
+
+
+def _completar(textos, transmision, agrupador):
+    """Sigue la respuesta tras la desconexión del cliente, solo para dejarla en la transmisión."""
+    error = None
+    try:
+        for texto in textos:
+            listo = agrupador.agregar(texto, time.monotonic())
+            if listo:
+                transmision.publicar(listo)
+    except RespuestaInterrumpida as e:
+        error = e
+    _cierre(transmision, agrupador, error)
+
+
+def emitir_sse(textos, transmision, agrupador, compresor, lanzar_en_segundo_plano=None):
+    """Convierte el generador de textos de la respuesta en bytes de eventos SSE.
+
+    `lanzar_en_segundo_plano(funcion)` (p. ej. un pool) termina la respuesta si
+    el cliente se desconecta; sin él se cierra el generador de textos.
+    """
+    try:
+        error = None
+        try:
+            for texto in textos:
+                listo = agrupador.agregar(texto, time.monotonic())
+                if listo:
+                    yield compresor.comprimir(transmision.publicar(listo))
+        except RespuestaInterrumpida as e:
+            error = e
+        yield compresor.comprimir(_cierre(transmision, agrupador, error)) + compresor.cerrar()
+    except GeneratorExit:
+        if lanzar_en_segundo_plano is not None and not transmision.terminada:
+            lanzar_en_segundo_plano(lambda: _completar(textos, transmision, agrupador))
+        else:
+            textos.close()
+        raise
+
+
+# --- Versión asíncrona (asgi_app) ---
+_tareas_fondo = set()
+
+
+async def _siguiente(iterador):
+    """Próximo texto como tupla de un elemento, o None al terminar."""
+    try:
+        return (await iterador.__anext__(),)
+    except StopAsyncIteration:
+        return None
+
+
+async def _completar_async(iterador, pendiente, transmision, agrupador, reanudable):
+    if not reanudable:
+        # Cancelar la lectura en curso corta también el generador de textos (y libera su cupo)
+        if pendiente is not None:
+            pendiente.cancel()
+            try:
+                await pendiente
+            except BaseException:
+                pass
+        await iterador.aclose()
+        return
+    error = None
+    try:
+        while True:
+            siguiente = await (pendiente if pendiente is not None else _siguiente(iterador))
+            pendiente = None
+            if siguiente is None:
+                break
+            listo = agrupador.agregar(siguiente[0], time.monotonic())
+            if listo:
+                transmision.publicar(listo)
+    except RespuestaInterrumpida as e:
+        error = e
+    _cierre(transmision, agrupador, error)
+
+
+async def emitir_sse_async(textos, transmision, agrupador, compresor, reanudable=True):
+    """Como `emitir_sse` para un generador asíncrono, con la ventana de agrupación por temporizador.
+
+    Mientras hay texto retenido, la espera del próximo fragmento de Gemini se
+    acota a lo que falta de la ventana: al vencer se envía sin esperarlo.
+    """
+    iterador = textos.__aiter__()
+    pendiente = None
+    try:
+        error = None
+        try:
+            while True:
+                if pendiente is None:
+                    pendiente = asyncio.ensure_future(_siguiente(iterador))
+                hechos, _ = await asyncio.wait({pendiente}, timeout=agrupador.espera(time.monotonic()))
+                if not hechos:
+                    yield compresor.comprimir(transmision.publicar(agrupador.vaciar()))
+                    continue
+                siguiente, pendiente = pendiente.result(), None
+                if siguiente is None:
+                    break
+                listo = agrupador.agregar(siguiente[0], time.monotonic())
+                if listo:
+                    yield compresor.comprimir(transmision.publicar(listo))
+        except RespuestaInterrumpida as e:
+            error = e
+        yield compresor.comprimir(_cierre(transmision, agrupador, error)) + compresor.cerrar()
+    except (GeneratorExit, asyncio.CancelledError):
+        if not transmision.terminada:
+            tarea = asyncio.ensure_future(_completar_async(iterador, pendiente, transmision, agrupador, reanudable))
+            _tareas_fondo.add(tarea)
+            tarea.add_done_callback(_tareas_fondo.discard)
+        raise
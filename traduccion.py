@@ -0,0 +1,389 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+
+log = logging.getLogger("incalake.traduccion")
+
+# === Léxico bilingüe de términos de viaje (ES -> EN) ===
+# Semilla curada; al construir el traductor solo se conservan las entradas
+# cuya traducción existe en el vocabulario del catálogo.
+LEXICO_SEMILLA_ES_EN = {
+    'lago': 'lake', 'lagos': 'lakes', 'isla': 'island', 'islas': 'islands',
+    'flotante': 'floating', 'flotantes': 'floating', 'totora': 'totora', 'balsa': 'raft',
+    'balsas': 'rafts', 'barco': 'boat', 'bote': 'boat', 'lancha': 'boat', 'rapida': 'fast',
+    'rapido': 'fast', 'kayak': 'kayak', 'navegacion': 'sailing', 'puerto': 'port',
+    'ciudad': 'city', 'pueblo': 'town', 'comunidad': 'community', 'comunidades': 'communities',
+    'familia': 'family', 'familias': 'families', 'vivencial': 'homestay', 'casa': 'home',
+    'hospedaje': 'accommodation', 'alojamiento': 'accommodation', 'hotel': 'hotel',
+    'hoteles': 'hotels', 'noche': 'night', 'noches': 'nights', 'dia': 'day', 'dias': 'days',
+    'manana': 'morning', 'tarde': 'afternoon', 'atardecer': 'sunset', 'amanecer': 'sunrise',
+    'sol': 'sun', 'luna': 'moon', 'estrellas': 'stars', 'montana': 'mountain',
+    'montanas': 'mountains', 'colores': 'colors', 'arcoiris': 'rainbow', 'canon': 'canyon',
+    'valle': 'valley', 'sagrado': 'sacred', 'volcan': 'volcano', 'cascada': 'waterfall',
+    'termales': 'hot', 'aguas': 'waters', 'salar': 'salt', 'sal': 'salt', 'desierto': 'desert',
+    'laguna': 'lagoon', 'lagunas': 'lagoons', 'flamencos': 'flamingos', 'condor': 'condor',
+    'condores': 'condors', 'mirador': 'viewpoint', 'ruinas': 'ruins', 'templo': 'temple',
+    'templos': 'temples', 'puerta': 'gate', 'portal': 'gate', 'mistica': 'mystical',
+    'mistico': 'mystical', 'arqueologico': 'archaeological', 'complejo': 'complex',
+    'torres': 'towers', 'funerarias': 'funerary', 'museo': 'museum', 'iglesia': 'church',
+    'catedral': 'cathedral', 'plaza': 'square', 'mercado': 'market', 'tejidos': 'weaving',
+    'tejido': 'weaving', 'textil': 'textile', 'textiles': 'textiles', 'artesania': 'crafts',
+    'cultura': 'culture', 'cultural': 'cultural', 'tradicional': 'traditional',
+    'costumbres': 'customs', 'danza': 'dance', 'fiesta': 'festival', 'gastronomia': 'food',
+    'comida': 'food', 'almuerzo': 'lunch', 'desayuno': 'breakfast', 'cena': 'dinner',
+    'buffet': 'buffet', 'guia': 'guide', 'guiado': 'guided', 'traslado': 'transfer',
+    'traslados': 'transfers', 'transporte': 'transport', 'recojo': 'pickup',
+    'aeropuerto': 'airport', 'terminal': 'terminal', 'bus': 'bus', 'turistico': 'tourist',
+    'tren': 'train', 'bicicleta': 'bike', 'caminata': 'trek', 'caminatas': 'hiking',
+    'trekking': 'trekking', 'aventura': 'adventure', 'privado': 'private',
+    'privada': 'private', 'grupal': 'group', 'grupo': 'group', 'compartido': 'shared',
+    'personas': 'people', 'persona': 'person', 'ninos': 'children', 'precio': 'price',
+    'precios': 'prices', 'barato': 'cheap', 'economico': 'budget', 'lujo': 'luxury',
+    'entrada': 'entrance', 'entradas': 'entrance', 'boleto': 'ticket', 'boletos': 'tickets',
+    'paquete': 'package', 'paquetes': 'packages', 'excursion': 'excursion',
+    'frontera': 'border', 'peninsula': 'peninsula', 'tiahuanaco': 'tiwanaku',
+    'machupicchu': 'machu', 'peru': 'peru', 'bolivia': 'bolivia',
+}
+
+
+def normalizar_termino(termino):
+    """Minúsculas y sin tildes, para que 'días' y 'dias' compartan entrada."""
+    termino = unicodedata.normalize('NFKD', termino.lower().strip())
+    return ''.join(c for c in termino if not unicodedata.combining(c))
+
+
+def construir_lexico(vocabulario_catalogo, semilla=LEXICO_SEMILLA_ES_EN, identidades=None):
+    """Construye el léxico ES->EN a partir del vocabulario del catálogo.
+
+    Conserva las entradas de la semilla cuya traducción aparece en el catálogo
+    y agrega como identidad los términos del catálogo (nombres propios como
+    'puno', 'uros' o 'colca') que se escriben igual en ambos idiomas.
+
+    El catálogo binario trae esas identidades (normalizado -> término) ya
+    calculadas; con `identidades` el léxico es una vista sobre ellas.
+    """
+    lexico = {
+        normalizar_termino(es): en
+        for es, en in semilla.items()
+        if en in vocabulario_catalogo
+    }
+    if identidades is not None:
+        return LexicoConIdentidades(lexico, identidades)
+    for termino in vocabulario_catalogo:
+        lexico.setdefault(normalizar_termino(termino), termino)
+    return lexico
+
+
+class LexicoConIdentidades(Mapping):
+    """Entradas de la semilla primero y luego la tabla de identidades del catálogo."""
+
+    def __init__(self, semilla, identidades):
+        self.semilla = semilla
+        self.identidades = identidades
+        self._longitud = None
+
+    def __getitem__(self, termino):
+        if termino in self.semilla:
+            return self.semilla[termino]
+        return self.identidades[termino]
+
+    def __iter__(self):
+        yield from self.semilla
+        for termino in self.identidades:
+            if termino not in self.semilla:
+                yield termino
+
+    def __len__(self):
+        if self._longitud is None:
+            self._longitud = sum(1 for _ in self)
+        return self._longitud
+
+
+# === Caché LRU persistente con TTL ===
+class CacheTraducciones:
+    """Caché LRU de traducciones con expiración y persistencia en un archivo JSON.
+
+    Las traducciones nuevas se escriben a disco desde un hilo cada
+    `intervalo_persistencia` segundos y al salir, nunca en la petición. Al
+    escribir se combinan con las que ya están en el archivo, así los workers
+    que comparten la ruta no se borran las traducciones entre sí.
+    """
+
+    def __init__(self, ruta=None, max_entradas=5000, ttl_segundos=30 * 24 * 3600, intervalo_persistencia=60.0):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self.intervalo_persistencia = intervalo_persistencia
+        self._entradas = OrderedDict()  # término -> (traducción, expira_en)
+        self._lock = threading.Lock()
+        self._sucias = 0
+        self.cargar()
+        self._evento_cierre = threading.Event()
+        self._hilo_persistencia = None
+        if ruta and intervalo_persistencia > 0:
+            self._hilo_persistencia = threading.Thread(
+                target=self._bucle_persistencia, name="translation-cache-writer", daemon=True
+            )
+            self._hilo_persistencia.start()
+        if ruta:
+            atexit.register(self.cerrar)
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def obtener(self, termino):
+        """Devuelve la traducción en caché o None si no existe o expiró."""
+        with self._lock:
+            entrada = self._entradas.get(termino)
+            if entrada is None:
+                return None
+            traduccion, expira_en = entrada
+            if expira_en < time.time():
+                del self._entradas[termino]
+                return None
+            self._entradas.move_to_end(termino)
+            return traduccion
+
+    def guardar_traduccion(self, termino, traduccion):
+        with self._lock:
+            self._entradas[termino] = (traduccion, time.time() + self.ttl_segundos)
+            self._entradas.move_to_end(termino)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+            self._sucias += 1
+
+    def _leer_archivo(self):
+        """Entradas del archivo ({} si no existe o no se puede leer)."""
+        if not self.ruta or not os.path.exists(self.ruta):
+            return {}
+        try:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            log.warning(f"⚠️ No se pudo leer la caché de traducciones {self.ruta}: {e}")
+            return {}
+
+    def cargar(self):
+        """Carga las entradas vigentes desde disco."""
+        datos = self._leer_archivo()
+        ahora = time.time()
+        with self._lock:
+            for termino, (traduccion, expira_en) in datos.items():
+                if expira_en > ahora:
+                    self._entradas[termino] = (traduccion, expira_en)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def persistir(self, forzar=False):
+        """Combina la caché con el archivo y lo reemplaza de forma atómica (temporal + rename).
+
+        Ante el mismo término gana la entrada que expira más tarde; si el total
+        supera max_entradas se descartan primero las del archivo que este
+        worker no usó.
+        """
+        if not self.ruta:
+            return
+        with self._lock:
+            if not self._sucias and not forzar:
+                return
+            propias = {termino: list(entrada) for termino, entrada in self._entradas.items()}
+            self._sucias = 0
+        en_disco = self._leer_archivo()
+        ahora = time.time()
+        # Primero las del archivo que no están en memoria, luego las propias en orden LRU
+        datos = {
+            termino: list(entrada) for termino, entrada in en_disco.items()
+            if termino not in propias and entrada[1] > ahora
+        }
+        for termino, entrada in propias.items():
+            previa = en_disco.get(termino)
+            datos[termino] = list(previa) if previa and previa[1] > entrada[1] else entrada
+        if len(datos) > self.max_entradas:
+            datos = dict(list(datos.items())[-self.max_entradas:])
+        temporal = f"{self.ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporal, 'w', encoding='utf-8') as f:
+                json.dump(datos, f, ensure_ascii=False)
+            os.replace(temporal, self.ruta)
+        except IOError as e:
+            log.warning(f"⚠️ No se pudo guardar la caché de traducciones: {e}")
+
+    def _bucle_persistencia(self):
+        while not self._evento_cierre.wait(self.intervalo_persistencia):
+            self.persistir()
+
+    def cerrar(self):
+        self._evento_cierre.set()
+        self.persistir()
+
+
+# === Lote de traducciones remotas ===
+class LoteTraducciones:
+    """Agrupa los términos desconocidos de peticiones concurrentes en una sola llamada remota.
+
+    El primer término que llega abre una ventana corta; todo lo que se pida
+    durante esa ventana viaja en la misma llamada, y cada petición espera solo
+    los futuros de sus propios términos.
+    """
+
+    def __init__(self, funcion_remota, ventana_segundos=0.05, max_terminos=64):
+        self.funcion_remota = funcion_remota
+        self.ventana_segundos = ventana_segundos
+        self.max_terminos = max_terminos
+        self._pendientes = {}  # término -> Future
+        self._lock = threading.Lock()
+        self._temporizador = None
+        self.llamadas = 0
+        self.terminos_enviados = 0
+
+    def solicitar(self, terminos):
+        """Encola los términos y devuelve {término: Future}."""
+        futuros = {}
+        despachar_ya = False
+        with self._lock:
+            for termino in terminos:
+                futuro = self._pendientes.get(termino)
+                if futuro is None:
+                    futuro = Future()
+                    self._pendientes[termino] = futuro
+                futuros[termino] = futuro
+            if len(self._pendientes) >= self.max_terminos:
+                despachar_ya = True
+            elif self._temporizador is None:
+                self._temporizador = threading.Timer(self.ventana_segundos, self._despachar)
+                self._temporizador.daemon = True
+                self._temporizador.start()
+        if despachar_ya:
+            self._despachar()
+        return futuros
+
+    def _despachar(self):
+        with self._lock:
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+                self._temporizador = None
+            lote, self._pendientes = self._pendientes, {}
+        if not lote:
+            return
+        self.llamadas += 1
+        self.terminos_enviados += len(lote)
+        try:
+            traducciones = self.funcion_remota(list(lote))
+        except Exception as e:
+            for futuro in lote.values():
+                futuro.set_exception(e)
+            return
+        for termino, futuro in lote.items():
+            futuro.set_result(traducciones.get(termino))
+
+
+# === Traductor de keywords ===
+class TraductorKeywords:
+    """Traduce keywords ES->EN: léxico local, luego caché y, como último recurso, Gemini en lote."""
+
+    def __init__(self, lexico, cache, funcion_remota=None, timeout_remoto=3.0, ventana_lote=0.05):
+        self.lexico = lexico
+        self.cache = cache
+        self.timeout_remoto = timeout_remoto
+        self.lote = LoteTraducciones(funcion_remota, ventana_lote) if funcion_remota else None
+        self._lock = threading.Lock()
+        self.aciertos_lexico = 0
+        self.aciertos_cache = 0
+        self.fallbacks = 0
+        self.errores_remotos = 0
+
+    def traducir_local(self, keywords):
+        """Traducción solo con léxico y caché, sin esperar a Gemini ni contar estadísticas.
+
+        Devuelve (traducidas, pendientes): las keywords sin traducción local se
+        conservan tal cual en `traducidas` y se listan en `pendientes`.
+        """
+        traducidas = []
+        pendientes = []
+        for keyword in keywords:
+            termino = normalizar_termino(keyword)
+            traduccion = self.lexico.get(termino)
+            if traduccion is None:
+                traduccion = self.cache.obtener(termino)
+            if traduccion is None:
+                pendientes.append(keyword)
+                traduccion = keyword
+            if traduccion not in traducidas:
+                traducidas.append(traduccion)
+        return traducidas, pendientes
+
+    def traducir(self, keywords):
+        """Devuelve la lista de keywords traducidas, conservando el orden."""
+        traducidas = {}
+        desconocidas = []
+        aciertos_lexico = aciertos_cache = 0
+        for keyword in keywords:
+            termino = normalizar_termino(keyword)
+            if termino in self.lexico:
+                traducidas[keyword] = self.lexico[termino]
+                aciertos_lexico += 1
+                continue
+            en_cache = self.cache.obtener(termino)
+            if en_cache is not None:
+                traducidas[keyword] = en_cache
+                aciertos_cache += 1
+            else:
+                desconocidas.append(keyword)
+
+        fallbacks = errores = 0
+        if desconocidas and self.lote:
+            fallbacks = len(desconocidas)
+            futuros = self.lote.solicitar([normalizar_termino(k) for k in desconocidas])
+            limite = time.time() + self.timeout_remoto
+            for keyword in desconocidas:
+                termino = normalizar_termino(keyword)
+                try:
+                    traduccion = futuros[termino].result(timeout=max(0.0, limite - time.time()))
+                except FuturesTimeoutError:
+                    log.warning(f"⏱️ Traducción remota de '{keyword}' excedió {self.timeout_remoto}s")
+                    errores += 1
+                    continue
+                except Exception as e:
+                    log.error(f"❌ Error en la traducción remota de '{keyword}': {e}")
+                    errores += 1
+                    continue
+                if traduccion:
+                    traducidas[keyword] = traduccion
+                    self.cache.guardar_traduccion(termino, traduccion)
+                else:
+                    # Sin equivalente útil: recordarlo para no volver a preguntar
+                    self.cache.guardar_traduccion(termino, keyword)
+
+        with self._lock:
+            self.aciertos_lexico += aciertos_lexico
+            self.aciertos_cache += aciertos_cache
+            self.fallbacks += fallbacks
+            self.errores_remotos += errores
+
+        resultado = []
+        for keyword in keywords:
+            traduccion = traducidas.get(keyword, keyword)
+            if traduccion not in resultado:
+                resultado.append(traduccion)
+        return resultado
+
+    def estadisticas(self):
+        """Contadores de aciertos locales y fallbacks remotos."""
+        consultas = self.aciertos_lexico + self.aciertos_cache + self.fallbacks
+        return {
+            "lexicon_hits": self.aciertos_lexico,
+            "cache_hits": self.aciertos_cache,
+            "fallback_terms": self.fallbacks,
+            "fallback_calls": self.lote.llamadas if self.lote else 0,
+            "remote_errors": self.errores_remotos,
+            "hit_rate": round((self.aciertos_lexico + self.aciertos_cache) / consultas, 3) if consultas else None,
+            "cache_size": len(self.cache),
+            "lexicon_size": len(self.lexico),
+        }